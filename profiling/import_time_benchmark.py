@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""Measure time of `import qutepart` with `python -X importtime` and time of opening the first editor.
+Every measurement is done in a new process. The best of RUN_COUNT runs is shown
+
+Usage: import_time_benchmark.py [--top N]
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+
+RUN_COUNT = 10
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+_FIRST_EDITOR_SCRIPT = '''
+import sys, time
+sys.path.insert(0, {path!r})
+timeBefore = time.perf_counter()
+import qutepart
+imported = time.perf_counter()
+from PyQt5.QtWidgets import QApplication
+app = QApplication(sys.argv)
+qpart = qutepart.Qutepart()
+qpart.text = 'def main():\\n    return 0\\n'
+qpart.detectSyntax(language='Python')
+created = time.perf_counter()
+print(imported - timeBefore, created - imported)
+'''
+
+
+def importTimes():
+    """Run `python -X importtime -c "import qutepart"`.
+    Returns {module: (self us, cumulative us)}
+    """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import qutepart'],
+                            cwd=topLevelPath, stderr=subprocess.PIPE, check=True,
+                            universal_newlines=True).stderr
+    times = {}
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        selfTime, cumulativeTime, name = line[len('import time:'):].split('|')
+        times[name.strip()] = (int(selfTime), int(cumulativeTime))
+    return times
+
+
+def firstEditorTimes():
+    """Returns (import time, editor creation time) in seconds
+    """
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    output = subprocess.check_output([sys.executable, '-c', _FIRST_EDITOR_SCRIPT.format(path=topLevelPath)],
+                                     env=env, universal_newlines=True)
+    importTime, creationTime = output.split()
+    return float(importTime), float(creationTime)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure import time of qutepart')
+    parser.add_argument('--top', type=int, default=15, help='count of the slowest modules to show')
+    args = parser.parse_args()
+
+    importTimes()  # create .pyc files
+
+    runs = [importTimes() for i in range(RUN_COUNT)]
+    best = min(runs, key=lambda times: times['qutepart'][1])
+    print('import qutepart: {:.1f} ms, {} modules imported'.format(best['qutepart'][1] / 1000, len(best)))
+
+    print('\nSlowest modules, cumulative ms:')
+    slowest = sorted(best.items(), key=lambda item: item[1][1], reverse=True)[:args.top]
+    for name, (selfTime, cumulativeTime) in slowest:
+        print('  {:<40} {:>7.1f} {:>7.1f} self'.format(name, cumulativeTime / 1000, selfTime / 1000))
+
+    qutepartModules = sorted(name for name in best if name.startswith('qutepart'))
+    print('\nImported qutepart modules: {}'.format(', '.join(qutepartModules)))
+
+    editorRuns = [firstEditorTimes() for i in range(RUN_COUNT)]
+    importTime, creationTime = min(editorRuns, key=sum)
+    print('\nFirst editor: import {:.1f} ms, create editor and set syntax {:.1f} ms, total {:.1f} ms'.format(
+          importTime * 1000, creationTime * 1000, (importTime + creationTime) * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Measure count of format ranges per line and time of applying and painting them
+
+Usage: segments_benchmark.py FILE...
+"""
+
+import sys
+import time
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+
+import qutepart
+
+
+REPAINT_COUNT = 20
+
+
+app = QApplication(sys.argv)
+
+
+def benchmark(path):
+    with open(path, encoding='utf-8') as file_:
+        text = file_.read()
+
+    q = qutepart.Qutepart()
+    q.resize(1000, 1000)
+    q.detectSyntax(sourceFilePath=path)
+    q.text = text
+    q.show()
+    while q.isHighlightingInProgress():
+        app.processEvents()
+
+    highlighter = q._highlighter
+    syntax = highlighter._syntax
+    blocks = []
+    block = q.document().firstBlock()
+    while block.isValid():
+        blocks.append(block)
+        block = block.next()
+
+    # Parse and apply segments to every line
+    applyTime = 0
+    rangesCount = 0
+    lineData = None
+    for block in blocks:
+        contextStack = lineData[0] if lineData is not None else None
+        lineData, highlightedSegments = syntax.highlightBlock(block.text(), contextStack)
+        block.layout().clearAdditionalFormats()
+        timeBefore = time.perf_counter()
+        highlighter._applyHighlightedSegments(block, highlightedSegments)
+        applyTime += time.perf_counter() - timeBefore
+        rangesCount += len(block.layout().additionalFormats())
+
+    # Repaint whole document, page by page
+    scrollBar = q.verticalScrollBar()
+    q.viewport().repaint()  # warm up
+    timeBefore = time.perf_counter()
+    for i in range(REPAINT_COUNT):
+        scrollBar.setValue(scrollBar.maximum() * i // REPAINT_COUNT)
+        q.viewport().repaint()
+    repaintTime = time.perf_counter() - timeBefore
+
+    print('{}: {} lines, {:.2f} ranges per line, apply {:.1f} us per line, repaint {:.1f} ms per page'.format(
+          path, len(blocks), rangesCount / len(blocks),
+          applyTime * 1000000 / len(blocks), repaintTime * 1000 / REPAINT_COUNT))
+
+    q.terminate()
+
+
+def doTest():
+    for path in sys.argv[1:]:
+        benchmark(path)
+    app.quit()
+
+QTimer.singleShot(0, doTest)
+app.exec_()
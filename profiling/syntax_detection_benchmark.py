@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""Measure syntax detection by file name for many files.
+Compares the index with linear scan of all glob patterns, which was used before,
+and checks, that results are the same
+
+Usage: syntax_detection_benchmark.py [FILE_COUNT]
+"""
+
+import fnmatch
+import json
+import os.path
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from qutepart.syntax import SyntaxManager
+
+
+def makeFileNames(count):
+    """File names, similar to a big project tree: mostly common extensions,
+    some special names and some unknown files
+    """
+    random.seed(1)
+    common = ['.py', '.c', '.h', '.cpp', '.hpp', '.js', '.html', '.css', '.json', '.xml', '.md',
+              '.txt', '.sh', '.java', '.rb', '.go', '.rs', '.yml', '.php', '.pl']
+    special = ['Makefile', 'CMakeLists.txt', 'makefile.inc', '.gitignore', 'Doxyfile.in',
+               'Kconfig.debug', 'ChangeLog', 'Dockerfile', 'README', 'LICENSE']
+    unknown = ['.o', '.pyc', '.png', '.lock', '.bak', '']
+    names = []
+    for i in range(count):
+        kind = random.random()
+        if kind < 0.8:
+            names.append('file%d%s' % (i, random.choice(common)))
+        elif kind < 0.9:
+            names.append(random.choice(special))
+        else:
+            names.append('data%d%s' % (i, random.choice(unknown)))
+    return names
+
+
+def linearScan(names):
+    """Detection, as it was implemented before the index
+    """
+    dbPath = os.path.join(os.path.dirname(__file__), '..', 'qutepart', 'syntax', 'data', 'syntax_db.json')
+    with open(dbPath, encoding='utf-8') as dbFile:
+        syntaxDb = json.load(dbFile)
+    xmlFileNameToSyntaxName = {xmlFileName: syntaxName \
+                                    for syntaxName, xmlFileName in syntaxDb['syntaxNameToXmlFileName'].items()}
+    regExps = [(re.compile(fnmatch.translate(glob)), xmlFileName) \
+                    for glob, xmlFileName in syntaxDb['extensionToXmlFileName'].items()]
+
+    results = []
+    for name in names:
+        name = os.path.basename(name)
+        for regExp, xmlFileName in regExps:
+            if regExp.match(name):
+                results.append(xmlFileNameToSyntaxName[xmlFileName])
+                break
+        else:
+            results.append(None)
+    return results
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    names = makeFileNames(count)
+
+    timeBefore = time.perf_counter()
+    expected = linearScan(names)
+    linearTime = time.perf_counter() - timeBefore
+
+    manager = SyntaxManager()
+    timeBefore = time.perf_counter()
+    results = manager.detectMany(names)
+    indexTime = time.perf_counter() - timeBefore
+
+    print('{} file names'.format(count))
+    print('linear scan:  {:.3f} s, {:.1f} us per file'.format(linearTime, linearTime / count * 1e6))
+    print('detectMany(): {:.3f} s, {:.1f} us per file'.format(indexTime, indexTime / count * 1e6))
+    print('speedup {:.1f}x'.format(linearTime / indexTime))
+
+    mismatches = sum(1 for result, expectedResult in zip(results, expected) if result != expectedResult)
+    if mismatches:
+        print('ERROR: {} results differ from linear scan'.format(mismatches))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Measure cold load time of syntaxes with and without the on-disk syntax cache.
+Every measurement is done in a new process, so nothing is loaded before.
+The cache is created in a temporary directory, user's cache is not touched.
+
+Usage: syntax_load_benchmark.py [LANGUAGE ...]
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+DEFAULT_LANGUAGES = ['PHP/PHP', 'C++', 'JavaScript', 'HTML', 'Perl', 'Python', 'Ruby', 'CSS']
+RUN_COUNT = 5
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def loadInChildProcess(language, cacheDirectory):
+    """Executed in a child process. Print load time in seconds
+    """
+    sys.path.insert(0, topLevelPath)
+    import logging
+    logging.disable(logging.CRITICAL)
+    import qutepart.syntax.loader
+    from qutepart.syntax import SyntaxManager
+
+    qutepart.syntax.loader.cacheDirectory = cacheDirectory or None
+    manager = SyntaxManager()
+
+    timeBefore = time.perf_counter()
+    manager.getSyntax(languageName=language)
+    print(time.perf_counter() - timeBefore)
+
+
+def measure(language, cacheDirectory):
+    """Best of RUN_COUNT runs, ms
+    """
+    times = []
+    for i in range(RUN_COUNT):
+        output = subprocess.check_output([sys.executable, __file__, '--child', language, cacheDirectory])
+        times.append(float(output))
+    return min(times) * 1000
+
+
+def main():
+    languages = sys.argv[1:] or DEFAULT_LANGUAGES
+
+    import qutepart.syntax.loader
+    print('Parser: {}'.format('C' if qutepart.syntax.loader.binaryParserAvailable else 'Python'))
+    print('{:<12} {:>10} {:>10} {:>8}'.format('Language', 'XML, ms', 'cache, ms', 'speedup'))
+
+    with tempfile.TemporaryDirectory() as cacheDirectory:
+        for language in languages:
+            xmlTime = measure(language, '')
+            measure(language, cacheDirectory)  # fill the cache
+            cachedTime = measure(language, cacheDirectory)
+            print('{:<12} {:>10.1f} {:>10.1f} {:>7.1f}x'.format(language, xmlTime, cachedTime, xmlTime / cachedTime))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) == 4 and sys.argv[1] == '--child':
+        loadInChildProcess(sys.argv[2], sys.argv[3])
+    else:
+        sys.path.insert(0, topLevelPath)
+        main()
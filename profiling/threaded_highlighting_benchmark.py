@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""Measure GUI responsiveness while a big log file is being highlighted.
+A timer ticks every 16 ms (60 fps). Long gaps between ticks are missed frames
+
+Usage: threaded_highlighting_benchmark.py [LINE_COUNT]
+"""
+
+import sys
+import time
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+
+import qutepart
+
+
+FRAME_SEC = 0.016
+
+
+app = QApplication(sys.argv)
+
+
+def makeLogLines(lineCount):
+    return ['03-{:02} 12:{:02}:{:02}.{:03}  1234  {:4} {} ActivityManager: processed request "GET /index.html" in {} ms'.format(
+            i % 28 + 1, i % 60, i % 59, i % 1000, 5000 + i % 8, 'VDIWE'[i % 5], i % 1000)
+            for i in range(lineCount)]
+
+
+def benchmark(lines, threaded):
+    q = qutepart.Qutepart()
+    q.resize(1000, 1000)
+    q.show()
+    q.threadedHighlighting = threaded
+    q.lines = lines
+
+    # let the completer update its word set before measuring
+    timeBefore = time.perf_counter()
+    while time.perf_counter() < timeBefore + 1:
+        app.processEvents()
+
+    ticks = []
+    timer = QTimer()
+    timer.timeout.connect(lambda: ticks.append(time.perf_counter()))
+    timer.start(FRAME_SEC * 1000)
+
+    timeBefore = time.perf_counter()
+    q.detectSyntax(language='Logcat')
+    while q.isHighlightingInProgress():
+        app.processEvents()
+    totalTime = time.perf_counter() - timeBefore
+    timer.stop()
+
+    gaps = [b - a for a, b in zip([timeBefore] + ticks, ticks)]
+    missedFrames = sum(1 for gap in gaps if gap > FRAME_SEC * 1.5)
+    print('threaded={}: {:.1f} s, max gap between frames {:.1f} ms, {} of {} frames missed'.format(
+          threaded, totalTime, max(gaps) * 1000, missedFrames, len(gaps)))
+
+    q.terminate()
+
+
+def doTest():
+    lineCount = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    lines = makeLogLines(lineCount)
+    benchmark(lines, False)
+    benchmark(lines, True)
+    app.quit()
+
+QTimer.singleShot(0, doTest)
+app.exec_()
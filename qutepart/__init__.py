@@ -5,7 +5,7 @@
 import sys
 import os.path
 import logging
-import platform
+import time
 
 from PyQt5.QtCore import QRect, Qt, pyqtSignal
 from PyQt5.QtWidgets import QAction, QApplication, QDialog, QPlainTextEdit, QTextEdit, QWidget
@@ -16,20 +16,20 @@ from PyQt5.QtGui import QColor, QBrush, \
                         QTextCharFormat, QTextCursor, \
                         QTextBlock, QTextFormat
 
-from qutepart.syntax import SyntaxManager
+from qutepart.syntax import SyntaxManager, defaultColorTheme
 import qutepart.version
 
 
 if 'sphinx-build' not in sys.argv[0]:
     # See explanation near `import sip` above
-    from qutepart.syntaxhlighter import SyntaxHighlighter
+    # syntaxhlighter, syntax loader and vim are imported, when used first time, to make import quicker
     from qutepart.brackethlighter import BracketHighlighter
     from qutepart.completer import Completer
+    from qutepart.globaltimer import globalTimer, DEFAULT_LATENCY_TARGET_SEC
     from qutepart.lines import Lines
     from qutepart.rectangularselection import RectangularSelection
     import qutepart.sideareas
     from qutepart.indenter import Indenter
-    import qutepart.vim
 
     def setPositionInBlock(cursor, positionInBlock, anchor=QTextCursor.MoveAnchor):
         return cursor.setPosition(cursor.block().position() + positionInBlock, anchor)
@@ -46,9 +46,18 @@ logger.addHandler(consoleHandler)
 logger.setLevel(logging.ERROR)
 
 
-# After logging setup
-import qutepart.syntax.loader
-binaryParserAvailable = qutepart.syntax.loader.binaryParserAvailable
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        """binaryParserAvailable is evaluated, when used first time, because loading the parser is slow
+        """
+        if name == 'binaryParserAvailable':
+            import qutepart.syntax.loader  # After logging setup
+            return qutepart.syntax.loader.binaryParserAvailable
+        raise AttributeError("module 'qutepart' has no attribute '%s'" % name)
+else:  # module __getattr__ is not supported
+    # After logging setup
+    import qutepart.syntax.loader
+    binaryParserAvailable = qutepart.syntax.loader.binaryParserAvailable
 
 
 _ICONS_PATH = os.path.join(os.path.dirname(__file__), 'icons')
@@ -57,6 +66,13 @@ def getIconPath(iconFileName):
     return os.path.join(_ICONS_PATH, iconFileName)
 
 
+def _isChar(event):
+    """Check if an event may be a typed character. Vim module is imported only when needed
+    """
+    from qutepart.vim import isChar
+    return isChar(event)
+
+
 #Define for old Qt versions methods, which appeared in 4.7
 if not hasattr(QTextCursor, 'positionInBlock'):
     def _positionInBlock(cursor):
@@ -151,6 +167,13 @@ class Qutepart(QPlainTextEdit):
     * ``drawIncorrectIndentation`` - Draw trailing whitespaces, tabs if text is indented with spaces, spaces if text is indented with tabs. Default is ``True``. Doesn't have any effect if ``drawAnyWhitespace`` is ``True``.
     * ``drawAnyWhitespace`` - Draw trailing and other whitespaces, used as indentation. Default is ``False``.
 
+    **Syntax highlighting**
+
+    * ``viewportFirstHighlighting`` - Highlight visible lines first, when a big file is being parsed. State of not parsed yet lines is guessed and corrected later. Default is ``True``.
+    * ``threadedHighlighting`` - Parse text in a background thread. The GUI thread only applies highlighting. Useful for huge files, especially with the binary parser, which releases the GIL while matching regular expressions. Default is ``False``.
+    * ``latencyTarget`` - Target GUI latency in seconds, when the editor has focus. Time of background highlighting is adapted to measured event loop lag and keystroke-to-paint latency to keep the latency near the target. Default is ``0.05``.
+    * ``colorTheme`` - ``qutepart.syntax.colortheme.ColorTheme``, which defines formats of highlighting styles, including colors and font styles. Text is not parsed again, when the theme is changed. Assign the theme again after modifying it. Default is the default theme.
+
     **Autocompletion**
 
     Qutepart supports autocompletion, based on document contents.
@@ -229,6 +252,8 @@ class Qutepart(QPlainTextEdit):
     * ``eolChanged(eol)``                         EOL mode changed. See also ``eol``.
     * ``vimModeEnabledChanged(enabled)            Vim mode has been enabled or disabled.
     * ``vimModeIndicationChanged(color, text)``   Vim mode changed. Parameters contain color and text to be displayed on an indicator. See also ``vimModeIndication``
+    * ``highlightingSliceFinished(float)``        Highlighter has worked for given time in seconds and released the main loop. See also ``highlightingCounters()``
+    * ``highlightingFinished(float)``             Text has been fully highlighted. Parameter is time since the text has been loaded or the language has been set, in seconds
 
     **Public methods**
     '''
@@ -240,6 +265,8 @@ class Qutepart(QPlainTextEdit):
     eolChanged = pyqtSignal(str)
     vimModeIndicationChanged = pyqtSignal(QColor, str)
     vimModeEnabledChanged = pyqtSignal(bool)
+    highlightingSliceFinished = pyqtSignal(float)
+    highlightingFinished = pyqtSignal(float)
 
     LINT_ERROR = 'e'
     LINT_WARNING = 'w'
@@ -288,6 +315,12 @@ class Qutepart(QPlainTextEdit):
         palette.setColor(QPalette.Text, QColor('#000000'))
         self.setPalette(palette)
 
+        self.viewportFirstHighlighting = True
+        self.threadedHighlighting = False
+        self._latencyTarget = DEFAULT_LATENCY_TARGET_SEC
+        self._colorTheme = defaultColorTheme()
+        self._formatTable = None  # style index: QTextCharFormat. Created, when syntax is set first time
+        self._keyPressTime = None  # time of the last key press, which is not painted yet
         self._highlighter = None
         self._bracketHighlighter = BracketHighlighter()
 
@@ -321,9 +354,9 @@ class Qutepart(QPlainTextEdit):
         self.textChanged.connect(self._resetCachedText)
         self.textChanged.connect(self._clearLintMarks)
 
-        fontFamilies = {'Windows':'Courier New',
-                        'Darwin': 'Menlo'}
-        fontFamily = fontFamilies.get(platform.system(), 'Monospace')
+        fontFamilies = {'win32':'Courier New',
+                        'darwin': 'Menlo'}
+        fontFamily = fontFamilies.get(sys.platform, 'Monospace')
         self.setFont(QFont(fontFamily))
 
         self._updateExtraSelections()
@@ -451,8 +484,32 @@ class Qutepart(QPlainTextEdit):
         pass  # suppress dockstring for non-public method
         """ Qt 5.big automatically changes font when adding document to workspace. Workaround this bug """
         super().setFont(self._fontBackup)
+        self._updateSchedulingPriority()
         return super().showEvent(ev)
 
+    def hideEvent(self, ev):
+        pass  # suppress docstring for non-public method
+        self._updateSchedulingPriority()
+        return super().hideEvent(ev)
+
+    def focusInEvent(self, ev):
+        pass  # suppress docstring for non-public method
+        globalTimer().setLatencyTarget(self._latencyTarget)
+        self._updateSchedulingPriority()
+        return super().focusInEvent(ev)
+
+    def focusOutEvent(self, ev):
+        pass  # suppress docstring for non-public method
+        self._updateSchedulingPriority()
+        return super().focusOutEvent(ev)
+
+    def _updateSchedulingPriority(self):
+        """Focused and visible editors are highlighted first. See qutepart.globaltimer
+        """
+        self._completer.updatePriority()
+        if self._highlighter is not None:
+            self._highlighter.updatePriority()
+
     def _updateTabStopWidth(self):
         """Update tabstop width after font or indentation changed
         """
@@ -616,6 +673,30 @@ class Qutepart(QPlainTextEdit):
             self._indenter.useTabs = use
             self.indentUseTabsChanged.emit(use)
 
+    @property
+    def latencyTarget(self):
+        return self._latencyTarget
+
+    @latencyTarget.setter
+    def latencyTarget(self, target):
+        if target <= 0:
+            raise ValueError("Latency target must be positive")
+        self._latencyTarget = target
+        if self.hasFocus():
+            globalTimer().setLatencyTarget(target)
+
+    @property
+    def colorTheme(self):
+        return self._colorTheme
+
+    @colorTheme.setter
+    def colorTheme(self, colorTheme):
+        self._colorTheme = colorTheme
+        if self._formatTable is not None:
+            self._formatTable.setColorTheme(colorTheme)
+            if self._highlighter is not None:
+                self._highlighter.restyle()
+
     @property
     def lintMarks(self):
         return self._lintMarks
@@ -639,7 +720,8 @@ class Qutepart(QPlainTextEdit):
     def vimModeEnabled(self, enabled):
         if enabled:
             if self._vim is None:
-                self._vim = qutepart.vim.Vim(self)
+                from qutepart.vim import Vim
+                self._vim = Vim(self)
                 self._vim.modeIndicationChanged.connect(self.vimModeIndicationChanged)
                 self.vimModeEnabledChanged.emit(True)
         else:
@@ -756,19 +838,22 @@ class Qutepart(QPlainTextEdit):
 
         Method returns ``True``, if syntax is detected, and ``False`` otherwise
         """
+        from qutepart.syntaxhlighter import FormatTable, SyntaxHighlighter
+
         oldLanguage = self.language()
 
         self.clearSyntax()
 
-        syntax = self._globalSyntaxManager.getSyntax(SyntaxHighlighter.formatConverterFunction,
-                                                     xmlFileName=xmlFileName,
+        syntax = self._globalSyntaxManager.getSyntax(xmlFileName=xmlFileName,
                                                      mimeType=mimeType,
                                                      languageName=language,
                                                      sourceFilePath=sourceFilePath,
                                                      firstLine=firstLine)
 
         if syntax is not None:
-            self._highlighter = SyntaxHighlighter(syntax, self)
+            if self._formatTable is None:
+                self._formatTable = FormatTable(self._colorTheme)
+            self._highlighter = SyntaxHighlighter(syntax, self, self._formatTable)
             self._indenter.setSyntax(syntax)
 
         newLanguage = self.language()
@@ -802,6 +887,14 @@ class Qutepart(QPlainTextEdit):
         return self._highlighter is not None and \
                self._highlighter.isInProgress()
 
+    def highlightingCounters(self):
+        """Performance counters of the highlighter as ``qutepart.perf.HighlightingCounters``.
+        None, if syntax is not set. See also ``qutepart.perf.snapshot()``
+        """
+        if self._highlighter is None:
+            return None
+        return self._highlighter.counters()
+
     def isCode(self, blockOrBlockNumber, column):
         """Check if text at given position is a code.
 
@@ -957,7 +1050,22 @@ class Qutepart(QPlainTextEdit):
     def keyPressEvent(self, event):
         pass # suppress dockstring for non-public method
         """QPlainTextEdit.keyPressEvent() implementation.
-        Catch events, which may not be catched with QShortcut and call slots
+        Measures keystroke-to-paint latency of keys, which change text or cursor. Other keys are not painted
+        """
+        pressTime = time.time()
+        stateBefore = self._keyPressResultState()
+        self._processKeyPressEvent(event)
+        if self._keyPressResultState() != stateBefore:
+            self._keyPressTime = pressTime
+
+    def _keyPressResultState(self):
+        """State, which is painted, if changed by a keystroke
+        """
+        cursor = self.textCursor()
+        return self.document().revision(), cursor.position(), cursor.anchor()
+
+    def _processKeyPressEvent(self, event):
+        """Catch events, which may not be catched with QShortcut and call slots
         """
         self._lastKeyPressProcessedByParent = False
 
@@ -1021,7 +1129,7 @@ class Qutepart(QPlainTextEdit):
             backspaceOverwrite()
         elif self.overwriteMode() and \
             event.text() and \
-            qutepart.vim.isChar(event) and \
+            _isChar(event) and \
             not cursor.hasSelection() and \
             cursor.positionInBlock() < cursor.block().length():
             typeOverwrite(event.text())
@@ -1247,6 +1355,10 @@ class Qutepart(QPlainTextEdit):
         super(Qutepart, self).paintEvent(event)
         self._drawIndentMarkersAndEdge(event.rect())
 
+        if self._keyPressTime is not None:  # measure keystroke-to-paint latency
+            globalTimer().reportInputLatency(time.time() - self._keyPressTime)
+            self._keyPressTime = None
+
     def _currentLineExtraSelections(self):
         """QTextEdit.ExtraSelection, which highlightes current line
         """
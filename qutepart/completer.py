@@ -9,6 +9,7 @@ from PyQt5.QtWidgets import QListView
 from PyQt5.QtGui import QCursor
 
 from qutepart.htmldelegate import HTMLDelegate
+from qutepart.globaltimer import globalTimer, widgetPriority
 
 
 _wordPattern = "\w+"
@@ -22,9 +23,9 @@ MAX_VISIBLE_WORD_COUNT = 256
 
 
 class _GlobalUpdateWordSetTimer:
-    """Timer updates word set, when editor is idle. (5 sec. after last change)
+    """Timer starts word set updating, when editor is idle. (1 sec. after last change)
     Timer is global, for avoid situation, when all instances
-    update set simultaneously
+    update set simultaneously. Word sets are updated by parts by the global timer
     """
     _IDLE_TIMEOUT_MS = 1000
 
@@ -49,10 +50,10 @@ class _GlobalUpdateWordSetTimer:
             self._timer.stop()
 
     def _onTimer(self):
-        method = self._scheduledMethods.pop()
-        method()
-        if self._scheduledMethods:
-            self._timer.start(self._IDLE_TIMEOUT_MS)
+        methods = self._scheduledMethods
+        self._scheduledMethods = []
+        for method in methods:
+            method()
 
 
 class _CompletionModel(QAbstractItemModel):
@@ -333,8 +334,6 @@ class Completer(QObject):
     """
     _globalUpdateWordSetTimer = _GlobalUpdateWordSetTimer()
 
-    _WORD_SET_UPDATE_MAX_TIME_SEC = 0.4
-
     def __init__(self, qpart):
         QObject.__init__(self, qpart)
 
@@ -343,6 +342,9 @@ class Completer(QObject):
         self._completionOpenedManually = False
 
         self._wordSet = None
+        # word set, which is being updated, and number of the next block to add
+        self._newWordSet = None
+        self._wordSetBlockNumber = None
 
         qpart.textChanged.connect(self._onTextChanged)
         qpart.document().modificationChanged.connect(self._onModificationChanged)
@@ -351,6 +353,7 @@ class Completer(QObject):
         """Object deleted. Cancel timer
         """
         self._globalUpdateWordSetTimer.cancel(self._updateWordSet)
+        globalTimer().unScheduleCallback(self._continueWordSetUpdate)
 
     def isVisible(self):
         return self._widget is not None
@@ -363,19 +366,41 @@ class Completer(QObject):
         if not modified:
             self._closeCompletion()
 
-    def _updateWordSet(self):
-        """Make a set of words, which shall be completed, from text
+    def updatePriority(self):
+        """Update priority of scheduled word set updating.
+        Called, when the editor has been shown, hidden, focused or unfocused
         """
-        self._wordSet = set()
+        if globalTimer().isCallbackScheduled(self._continueWordSetUpdate):
+            globalTimer().scheduleCallback(self._continueWordSetUpdate, widgetPriority(self._qpart))
 
-        start = time.time()
+    def _updateWordSet(self):
+        """Start making a set of words, which shall be completed, from text.
+        The set is made by parts by the global timer, the previous set is used until the new one is ready.
+        Updating is not started here, because many editors might start it at once
+        """
+        self._newWordSet = set()
+        self._wordSetBlockNumber = 0
+        globalTimer().scheduleCallback(self._continueWordSetUpdate, widgetPriority(self._qpart))
 
-        for line in self._qpart.lines:
-            for match in _wordRegExp.findall(line):
-                self._wordSet.add(match)
-            if time.time() - start > self._WORD_SET_UPDATE_MAX_TIME_SEC:
-                """It is better to have incomplete word set, than to freeze the GUI"""
-                break
+    def _continueWordSetUpdate(self):
+        """Add words of next blocks to the set, while the global timer frame is not over
+        """
+        endTime = time.time() + globalTimer().timeLeft()
+
+        block = self._qpart.document().findBlockByNumber(self._wordSetBlockNumber)
+        while block.isValid():
+            if time.time() >= endTime:
+                self._wordSetBlockNumber = block.blockNumber()
+                globalTimer().scheduleCallback(self._continueWordSetUpdate, widgetPriority(self._qpart))
+                return
+
+            for match in _wordRegExp.findall(block.text()):
+                self._newWordSet.add(match)
+            block = block.next()
+
+        self._wordSet = self._newWordSet
+        self._newWordSet = None
+        self._wordSetBlockNumber = None
 
     def invokeCompletion(self):
         """Invoke completion manually"""
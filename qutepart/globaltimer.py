@@ -0,0 +1,208 @@
+"""Scheduler of background work in the main loop thread.
+Syntax highlighting and word set updating of all Qutepart instances share one timer
+"""
+
+import collections
+import time
+
+from PyQt5.QtCore import QTimer
+from PyQt5.QtWidgets import QApplication
+
+
+# Priorities of scheduled callbacks. Callbacks with lower value are called first
+PRIORITY_FOCUSED = 0  # the editor is visible and has focus
+PRIORITY_VISIBLE = 1  # the editor is visible
+PRIORITY_HIDDEN = 2  # the editor is hidden, i.e. not current tab
+_PRIORITY_COUNT = 3
+
+DEFAULT_LATENCY_TARGET_SEC = 0.05
+
+
+def widgetPriority(widget):
+    """Priority of work for the widget
+    """
+    if not widget.isVisible():
+        return PRIORITY_HIDDEN
+    elif widget.hasFocus():
+        return PRIORITY_FOCUSED
+    else:
+        return PRIORITY_VISIBLE
+
+
+class GlobalTimer:
+    """All parsing and highlighting is done in main loop thread.
+    If parsing is being done for long time, main loop gets blocked.
+    Therefore SyntaxHighlighter controls, how long parsign is going, and, if too long,
+    schedules timer and releases main loop.
+    One global timer is used by all Qutepart instances, because main loop time usage
+    must not depend on opened files count
+
+    On every timer event callbacks are called, until frameBudget() is spent.
+    A callback shall not work longer than timeLeft() and schedule itself again, if it has more work.
+    Callbacks with higher priority are called first, callbacks with the same priority are called in turn
+
+    The frame budget is adapted to keep the GUI latency near the latency target.
+    Event loop lag (time, which other events take between frames) is measured on every frame,
+    keystroke-to-paint latency is reported by editors. The budget is the target minus the lag,
+    reduced while keystrokes are painted later than the target
+    """
+    # callback is not called, if less time is left in the frame
+    _MIN_SLICE_SEC = 0.001
+    _MIN_FRAME_BUDGET_SEC = 0.002
+    # weight of the last measurement in the average lag
+    _LAG_SMOOTHING = 0.2
+    # budget reduction after a late keystroke is undone by this factor per frame
+    _INPUT_FACTOR_RECOVERY = 1.05
+    _MIN_INPUT_FACTOR = 0.1
+    # keystroke painted later than the target multiplied by this factor has been delayed not by callbacks
+    _MAX_INPUT_LATENCY_FACTOR = 2.
+    # a change is "just before", if it has been done less than this time ago
+    _RECENT_CHANGE_SEC = 1.
+
+    def __init__(self):
+        self._timer = QTimer(QApplication.instance())
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._onTimer)
+
+        self._queues = [collections.deque() for priority in range(_PRIORITY_COUNT)]
+        self._priorities = {}  # callback: priority
+        self._frameEndTime = None
+        self._timerStartTime = None
+
+        self._latencyTarget = DEFAULT_LATENCY_TARGET_SEC
+        self._lag = 0.
+        self._inputFactor = 1.
+        self._frameBudget = self._latencyTarget
+        self._lastChangeTime = None
+
+    def isActive(self):
+        return self._timer.isActive()
+
+    def scheduleCallback(self, callback, priority=PRIORITY_VISIBLE):
+        """Schedule the callback. If it is already scheduled with other priority, the priority is changed
+        """
+        oldPriority = self._priorities.get(callback)
+        if oldPriority == priority:
+            return
+
+        if oldPriority is not None:
+            self._queues[oldPriority].remove(callback)
+        self._queues[priority].append(callback)
+        self._priorities[callback] = priority
+        self._startTimer()
+
+    def unScheduleCallback(self, callback):
+        priority = self._priorities.pop(callback, None)
+        if priority is not None:
+            self._queues[priority].remove(callback)
+
+        if not self._priorities:
+            self._timer.stop()
+
+    def isCallbackScheduled(self, callback):
+        return callback in self._priorities
+
+    def timeLeft(self):
+        """Time, which a callback might work. Whole frame budget, if called not from a callback
+        """
+        if self._frameEndTime is None:
+            return self._frameBudget
+        return max(0., self._frameEndTime - time.time())
+
+    def frameBudget(self):
+        """Time, which callbacks might work on one timer event
+        """
+        return self._frameBudget
+
+    def latencyTarget(self):
+        return self._latencyTarget
+
+    def eventLoopLag(self):
+        """Average time, which other events take between timer events
+        """
+        return self._lag
+
+    def setLatencyTarget(self, target):
+        """Set target GUI latency in seconds. Editors set it, when get focus
+        """
+        self._latencyTarget = target
+        self._updateFrameBudget()
+
+    def reportInputLatency(self, latency):
+        """Editor reports time between a keystroke and painting of its result.
+        Too old keystrokes are ignored
+        """
+        if self._latencyTarget < latency <= self._latencyTarget * self._MAX_INPUT_LATENCY_FACTOR:
+            self._inputFactor = max(self._MIN_INPUT_FACTOR,
+                                    self._inputFactor * self._latencyTarget / latency)
+            self._updateFrameBudget()
+
+    def notifyChange(self):
+        """An editor has been changed. See wasChangedJustBefore()
+        """
+        self._lastChangeTime = time.time()
+
+    def wasChangedJustBefore(self):
+        """Check if ANY Qutepart instance was changed just before
+        """
+        return self._lastChangeTime is not None and \
+               time.time() <= self._lastChangeTime + self._RECENT_CHANGE_SEC
+
+    def _updateFrameBudget(self):
+        self._frameBudget = max(self._MIN_FRAME_BUDGET_SEC,
+                                (self._latencyTarget - self._lag) * self._inputFactor)
+
+    def _measureLag(self, frameStartTime):
+        """Event loop lag is time between starting the timer and the timer event
+        """
+        if self._timerStartTime is not None:
+            lag = frameStartTime - self._timerStartTime
+            self._lag += (lag - self._lag) * self._LAG_SMOOTHING
+        self._inputFactor = min(1., self._inputFactor * self._INPUT_FACTOR_RECOVERY)
+        self._updateFrameBudget()
+
+    def _startTimer(self):
+        self._timerStartTime = time.time()
+        self._timer.start()
+
+    def _popCallback(self):
+        for queue in self._queues:
+            if queue:
+                callback = queue.popleft()
+                del self._priorities[callback]
+                return callback
+        return None
+
+    def _onTimer(self):
+        frameStartTime = time.time()
+        self._measureLag(frameStartTime)
+        self._timerStartTime = None
+
+        self._frameEndTime = frameStartTime + self._frameBudget
+        try:
+            # a callback, which schedules itself again, might be called again in the same frame.
+            # Count of calls is limited to avoid endless loop, if callbacks do nothing
+            for i in range(len(self._priorities)):
+                if self.timeLeft() < self._MIN_SLICE_SEC:
+                    break
+                callback = self._popCallback()
+                if callback is None:
+                    break
+                callback()
+        finally:
+            self._frameEndTime = None
+
+        if self._priorities:
+            self._startTimer()
+
+
+_globalTimer = None
+
+
+def globalTimer():
+    """The timer, which is used by all Qutepart instances. Created on first use, when QApplication exists
+    """
+    global _globalTimer
+    if _globalTimer is None:
+        _globalTimer = GlobalTimer()
+    return _globalTimer
@@ -0,0 +1,121 @@
+"""Highlighting performance counters.
+
+Every SyntaxHighlighter counts its work, see ``HighlightingCounters``.
+``snapshot()`` sums the counters of all editors by language, including editors, which have been closed,
+therefore an application can log highlighting health periodically::
+
+    import qutepart.perf
+
+    for language, counters in qutepart.perf.snapshot().languages.items():
+        logger.info('%s: %s', language, counters.asDict())
+"""
+
+import collections
+import weakref
+
+from qutepart.globaltimer import globalTimer
+
+
+class HighlightingCounters:
+    """Counters of highlighting work
+
+    * ``blocksParsed``              Count of parsed blocks
+    * ``charactersParsed``          Count of characters in the parsed blocks
+    * ``blocksUpToDate``            Count of changed blocks, which haven't been parsed, because their text and context are the same
+    * ``formatsUnchanged``          Count of parsed blocks, which formats haven't changed, therefore they were not applied
+    * ``longLinesSkipped``          Count of long lines, which were not highlighted speculatively
+    * ``slices``                    Count of highlighting time slices
+    * ``slicesRescheduled``         Count of slices, after which highlighting has been continued later
+    * ``sliceTime``                 Total time of the slices in seconds
+    * ``maxSliceTime``              The longest slice in seconds
+    * ``fullHighlightings``         Count of document loads, which have been fully highlighted
+    * ``fullHighlightingTime``      Total time from document loads to the end of highlighting in seconds
+    * ``lastFullHighlightingTime``  Time from the last document load to the end of highlighting in seconds, or ``None``
+    """
+    _FIELDS = ('blocksParsed', 'charactersParsed', 'blocksUpToDate', 'formatsUnchanged', 'longLinesSkipped',
+               'slices', 'slicesRescheduled', 'sliceTime', 'maxSliceTime',
+               'fullHighlightings', 'fullHighlightingTime', 'lastFullHighlightingTime')
+
+    def __init__(self):
+        self.blocksParsed = 0
+        self.charactersParsed = 0
+        self.blocksUpToDate = 0
+        self.formatsUnchanged = 0
+        self.longLinesSkipped = 0
+        self.slices = 0
+        self.slicesRescheduled = 0
+        self.sliceTime = 0.
+        self.maxSliceTime = 0.
+        self.fullHighlightings = 0
+        self.fullHighlightingTime = 0.
+        self.lastFullHighlightingTime = None
+
+    def __repr__(self):
+        return 'HighlightingCounters(%s)' % ', '.join('%s=%r' % item for item in self.asDict().items())
+
+    def asDict(self):
+        return collections.OrderedDict((name, getattr(self, name)) for name in self._FIELDS)
+
+    def copy(self):
+        result = HighlightingCounters()
+        result.add(self)
+        return result
+
+    def add(self, other):
+        """Add counters of other highlighter
+        """
+        for name in self._FIELDS:
+            if name == 'maxSliceTime':
+                self.maxSliceTime = max(self.maxSliceTime, other.maxSliceTime)
+            elif name == 'lastFullHighlightingTime':
+                if other.lastFullHighlightingTime is not None:
+                    self.lastFullHighlightingTime = other.lastFullHighlightingTime
+            else:
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+
+
+"""Performance snapshot. See snapshot()
+languages       {languageName: HighlightingCounters}
+frameBudget     Current time budget of background highlighting per main loop iteration in seconds
+latencyTarget   Latency target of the focused editor in seconds
+eventLoopLag    Average time, which other events take between highlighting slices, in seconds
+"""
+Snapshot = collections.namedtuple('Snapshot', ['languages', 'frameBudget', 'latencyTarget', 'eventLoopLag'])
+
+
+_highlighters = weakref.WeakSet()
+_terminatedCounters = {}  # languageName: HighlightingCounters of terminated highlighters
+
+
+def _register(highlighter):
+    _highlighters.add(highlighter)
+
+
+def _unregister(highlighter):
+    """Highlighter has been terminated. Keep its counters
+    """
+    if highlighter in _highlighters:
+        _highlighters.discard(highlighter)
+        language = highlighter.syntax().name
+        _terminatedCounters.setdefault(language, HighlightingCounters()).add(highlighter.counters())
+
+
+def snapshot():
+    """Get counters of all highlighters by language and the global timer state.
+    Returns Snapshot
+    """
+    languages = {language: counters.copy() for language, counters in _terminatedCounters.items()}
+    for highlighter in list(_highlighters):
+        language = highlighter.syntax().name
+        languages.setdefault(language, HighlightingCounters()).add(highlighter.counters())
+
+    timer = globalTimer()
+    return Snapshot(languages, timer.frameBudget(), timer.latencyTarget(), timer.eventLoopLag())
+
+
+def reset():
+    """Reset counters of all highlighters
+    """
+    _terminatedCounters.clear()
+    for highlighter in list(_highlighters):
+        highlighter.resetCounters()
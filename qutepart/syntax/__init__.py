@@ -1,6 +1,8 @@
 """Source file parser and highlighter
 """
 
+import bisect
+import collections
 import os.path
 import fnmatch
 import json
@@ -8,6 +10,8 @@ import threading
 import logging
 import re
 
+from qutepart.syntax.colortheme import ColorTheme
+
 _logger = logging.getLogger('qutepart')
 
 class TextFormat:
@@ -47,6 +51,99 @@ class TextFormat:
         return cmp(self.__dict__, other.__dict__)
 
 
+"""Highlighting style. Parsers emit indexes of styles in highlighted segments, see styleIndex().
+    defaultStyleName    Kate default style, i.e. 'dsKeyword'. Color theme defines its format
+    attributes          Tuple of (name, value) of TextFormat attributes, which are set by the syntax definition
+    textType            Text type of the style, see TextFormat.textType
+"""
+Style = collections.namedtuple('Style', ['defaultStyleName', 'attributes', 'textType'])
+
+"""Highlighted segment is an integer (segmentLength << STYLE_INDEX_BITS) | styleIndex.
+Style index NO_STYLE means, that text is not formatted
+"""
+STYLE_INDEX_BITS = 16
+STYLE_INDEX_MASK = (1 << STYLE_INDEX_BITS) - 1
+NO_STYLE = 0
+
+# Styles of all syntaxes. Indexes are shared, because a syntax includes contexts of other syntaxes
+_styles = [None]
+_styleIndexes = {}  # style: index
+_stylesLock = threading.Lock()
+_defaultColorTheme = None
+
+
+def styleIndex(style):
+    """Get index of the style. The style is registered, if used first time
+    """
+    with _stylesLock:
+        index = _styleIndexes.get(style)
+        if index is None:
+            if len(_styles) > STYLE_INDEX_MASK:
+                _logger.warning('Too many highlighting styles. %s is not highlighted', style)
+                return NO_STYLE
+            index = len(_styles)
+            _styles.append(style)
+            _styleIndexes[style] = index
+        return index
+
+
+def styles():
+    """List of registered styles. Item at NO_STYLE index is None
+    """
+    with _stylesLock:
+        return list(_styles)
+
+
+def defaultColorTheme():
+    global _defaultColorTheme
+    if _defaultColorTheme is None:
+        _defaultColorTheme = ColorTheme(TextFormat)
+    return _defaultColorTheme
+
+
+def textFormat(styleIndex, colorTheme=None):
+    """TextFormat of the style with the color theme. Default theme is used, if colorTheme is None.
+    None for NO_STYLE
+    """
+    with _stylesLock:
+        style = _styles[styleIndex]
+    if style is None:
+        return None
+    return (colorTheme or defaultColorTheme()).styleFormat(style)
+
+
+def unpackSegments(highlightedSegments):
+    """Generator. Yields (segmentLength, styleIndex) for every segment
+    """
+    for segment in highlightedSegments:
+        yield segment >> STYLE_INDEX_BITS, segment & STYLE_INDEX_MASK
+
+
+def extendSegments(highlightedSegments, partSegments):
+    """Append segments of the next part of a long line, see Syntax.highlightBlockPart().
+    Segments of the same style at the parts boundary are merged
+    """
+    if highlightedSegments and partSegments and \
+       (highlightedSegments[-1] & STYLE_INDEX_MASK) == (partSegments[0] & STYLE_INDEX_MASK):
+        highlightedSegments[-1] += partSegments[0] & ~STYLE_INDEX_MASK
+        highlightedSegments.extend(partSegments[1:])
+    else:
+        highlightedSegments.extend(partSegments)
+
+
+"""Rule match statistics, see Syntax.ruleProfile().
+    contextName     Name of the context, which tried the rule
+    rule            Rule object
+    description     Rule type and main attribute, i.e. 'RegExpr(\\w+)'.
+                    Only the rule type, if the syntax has been loaded before profiling was enabled
+    attempts        Count of match attempts
+    successes       Count of successful matches
+    time            Total time of the attempts in seconds
+"""
+RuleProfileItem = collections.namedtuple('RuleProfileItem',
+                                         ['contextName', 'rule', 'description', 'attempts', 'successes', 'time'])
+
+
 class Syntax:
     """Syntax. Programming language parser definition
 
@@ -68,6 +165,7 @@ class Syntax:
     def __init__(self, manager):
         self.manager = manager
         self.parser = None
+        self._ruleDescriptions = {}  # rule: short description. Filled by the loader, while profiling is enabled
 
     def __str__(self):
         res = 'Syntax\n'
@@ -90,17 +188,52 @@ class Syntax:
         self.parser = parser
         # performance optimization, avoid 1 function call
         self.highlightBlock = parser.highlightBlock
+        self.highlightBlockPart = parser.highlightBlockPart
         self.parseBlock = parser.parseBlock
 
-    def highlightBlock(self, text, prevLineData):
+    def highlightBlock(self, text, prevLineData, releaseGil=False):
         """Parse line of text and return
             (lineData, highlightedSegments)
         where
             lineData is data, which shall be saved and used for parsing next line
-            highlightedSegments is list of touples (segmentLength, segmentFormat)
+            highlightedSegments is list of integer segments, see unpackSegments()
+                adjacent segments have different styles
+
+        If releaseGil is True, the C parser releases the GIL while matching regular expressions.
+        Use it in background threads, in the main thread it only slows down parsing
         """
         #self.parser.parseAndPrintBlockTextualResults(text, prevLineData)
-        return self.parser.highlightBlock(text, prevLineData)
+        return self.parser.highlightBlock(text, prevLineData, releaseGil)
+
+    def highlightBlockPart(self, text, prevLineData, partialLineState, maxLength, releaseGil=False):
+        """Parse about maxLength characters of a long line of text.
+        Long lines are parsed by parts to avoid freezing of the GUI.
+        partialLineState is None for the first part and the value returned for the previous part otherwise.
+        The state can be used only once, with the same text.
+        Use extendSegments() to join segments of the parts.
+        releaseGil is the same as for highlightBlock()
+
+        return (lineData, partialLineState, highlightedSegments)
+        where
+            lineData is None, until the last part has been parsed
+            partialLineState is None, when the last part has been parsed
+            highlightedSegments is list of segments of the parsed part
+        """
+        return self.parser.highlightBlockPart(text, prevLineData, partialLineState, maxLength, releaseGil)
+
+    def highlightLines(self, lines):
+        """Generator. Highlight lines of a whole file. Qt is not used.
+        Yields (lineData, highlightedSegments) for every line, see highlightBlock().
+
+        Lines are parsed as they are consumed, only data of the previous line is kept.
+        Line separators at the end of lines are ignored, therefore a file object might be passed
+        """
+        highlightBlock = self.highlightBlock
+        contextStack = None
+        for line in lines:
+            lineData, highlightedSegments = highlightBlock(line.rstrip('\r\n'), contextStack)
+            yield lineData, highlightedSegments
+            contextStack = lineData[0] if lineData is not None else None
 
     def parseBlock(self, text, prevLineData):
         """Parse line of text and return
@@ -114,17 +247,70 @@ class Syntax:
         """
         return self.parser.parseBlock(text, prevLineData)
 
+    def ruleProfile(self):
+        """Rule match statistics for contexts of the syntax.
+        Collected while profiling is enabled with qutepart.syntax.loader.setRuleProfilingEnabled(True)
+
+        Returns list of RuleProfileItem, the most expensive rules first.
+        Rules, which are included from other contexts, are reported for every including context
+        """
+        items = []
+        for context in self.parser.contexts.values():
+            if context.loader is not None:  # not loaded yet, see loader.lazyContextLoading
+                continue
+            for rule, attempts, successes, time in context.ruleProfile():
+                items.append(RuleProfileItem(context.name, rule, self._ruleDescription(rule),
+                                             attempts, successes, time))
+
+        items.sort(key=lambda item: item.time, reverse=True)
+        return items
+
+    def resetRuleProfile(self):
+        """Reset rule match statistics of all contexts of the syntax
+        """
+        for context in self.parser.contexts.values():
+            if context.loader is None:
+                context.resetRuleProfile()
+
+    def _ruleDescription(self, rule):
+        """Description of the rule. Rules of included syntaxes are described by their syntax
+        """
+        if rule in self._ruleDescriptions:
+            return self._ruleDescriptions[rule]
+
+        if self.manager is not None:
+            with self.manager._loadedSyntaxesLock:
+                syntaxes = list(self.manager._loadedSyntaxes.values())
+            for syntax in syntaxes:
+                if rule in syntax._ruleDescriptions:
+                    return '%s: %s' % (syntax.name, syntax._ruleDescriptions[rule])
+
+        return type(rule).__name__
+
     def _getTextType(self, lineData, column):
         """Get text type (letter)
+
+        Text type map is a sorted tuple of runs (runEnd << 8) | ord(textType).
+        Text after the last run is code.
+        Lines of a single not code text type share a map, which run ends after any column
         """
         if lineData is None:
             return ' '  # default is code
 
         textTypeMap = lineData[1]
-        if column >= len(textTypeMap):  # probably, not actual data, not updated yet
+        if not textTypeMap:  # whole line is code
             return ' '
 
-        return textTypeMap[column]
+        run = (column << 8) | 0xff
+        if len(textTypeMap) == 1:
+            runIndex = 0 if textTypeMap[0] > run else 1
+        else:
+            runIndex = bisect.bisect_right(textTypeMap, run)
+
+        if runIndex == len(textTypeMap):  # code or not actual data, not updated yet
+            return ' '
+
+        return chr(textTypeMap[runIndex] & 0xff)
 
     def isCode(self, lineData, column):
         """Check if text at given position is a code
@@ -147,6 +333,70 @@ class Syntax:
         return self._getTextType(lineData, column) ==  'h'
 
 
+_GLOB_WILDCARDS = re.compile(r'[*?[]')
+
+
+class _GlobIndex:
+    """Index of glob patterns for quick matching.
+    Applying hundreds of glob patterns one by one is slow. Therefore
+        * patterns without wildcards are looked up in the exact name dictionary
+        * patterns "*literal", i.e. "*.c", are looked up in the suffix dictionary.
+          Suffixes, which start with ".", are looked up for every "." in the name, other suffixes for every length
+        * other patterns are compiled to one reg exp
+    The first pattern, which matches, wins, as if the patterns were applied one by one in the original order
+    """
+    def __init__(self, globsAndValues):
+        self._exact = {}  # name: (order, value)
+        self._suffixes = {}  # suffix: (order, value)
+        otherPatterns = []
+        self._otherValues = {}  # group name: (order, value)
+
+        for order, (glob, value) in enumerate(globsAndValues):
+            if not _GLOB_WILDCARDS.search(glob):
+                self._exact.setdefault(glob, (order, value))
+            elif glob.startswith('*') and not _GLOB_WILDCARDS.search(glob[1:]):
+                self._suffixes.setdefault(glob[1:], (order, value))
+            else:
+                groupName = '_glob%d' % order
+                otherPatterns.append('(?P<%s>%s)' % (groupName, fnmatch.translate(glob)))
+                self._otherValues[groupName] = (order, value)
+
+        self._otherSuffixLengths = sorted(set(len(suffix) for suffix in self._suffixes \
+                                                if not suffix.startswith('.')))
+        # the first alternative, which matches, is the outermost group, which is closed the last
+        self._otherRegExp = re.compile('|'.join(otherPatterns)) if otherPatterns else None
+
+    def match(self, name):
+        """Get value of the first pattern, which matches the name, or None
+        """
+        best = self._exact.get(name)
+
+        suffixes = self._suffixes
+        dotIndex = name.find('.')
+        while dotIndex != -1:
+            found = suffixes.get(name[dotIndex:])
+            if found is not None and (best is None or found[0] < best[0]):
+                best = found
+            dotIndex = name.find('.', dotIndex + 1)
+
+        nameLength = len(name)
+        for length in self._otherSuffixLengths:
+            if length > nameLength:
+                break
+            found = suffixes.get(name[nameLength - length:])
+            if found is not None and (best is None or found[0] < best[0]):
+                best = found
+
+        if self._otherRegExp is not None:
+            match = self._otherRegExp.match(name)
+            if match is not None:
+                found = self._otherValues[match.lastgroup]
+                if best is None or found[0] < best[0]:
+                    best = found
+
+        return best[1] if best is not None else None
+
+
 class SyntaxManager:
     """SyntaxManager holds references to loaded Syntax'es and allows to find or
     load Syntax by its name or by source file name
@@ -154,20 +404,31 @@ class SyntaxManager:
     def __init__(self):
         self._loadedSyntaxesLock = threading.RLock()
         self._loadedSyntaxes = {}
-        syntaxDbPath = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data", "syntax_db.json")
-        with open(syntaxDbPath, encoding='utf-8') as syntaxDbFile:
-            syntaxDb = json.load(syntaxDbFile)
-        self._syntaxNameToXmlFileName = syntaxDb['syntaxNameToXmlFileName']
-        self._mimeTypeToXmlFileName = syntaxDb['mimeTypeToXmlFileName']
-        self._firstLineToXmlFileName = syntaxDb['firstLineToXmlFileName']
-        globToXmlFileName = syntaxDb['extensionToXmlFileName']
-
-        # Applying glob patterns is really slow. Therefore they are compiled to reg exps
-        self._extensionToXmlFileName = \
-                {re.compile(fnmatch.translate(glob)): xmlFileName \
-                        for glob, xmlFileName in globToXmlFileName.items()}
-
-    def _getSyntaxByXmlFileName(self, xmlFileName, formatConverterFunction):
+        self._syntaxDbLoaded = False
+
+    def _loadSyntaxDb(self):
+        """Load syntax database, when it is used first time.
+        SyntaxManager is created, when qutepart is imported, therefore construction shall be quick
+        """
+        with self._loadedSyntaxesLock:
+            if self._syntaxDbLoaded:
+                return
+
+            syntaxDbPath = os.path.join(os.path.abspath(os.path.dirname(__file__)), "data", "syntax_db.json")
+            with open(syntaxDbPath, encoding='utf-8') as syntaxDbFile:
+                syntaxDb = json.load(syntaxDbFile)
+            self._syntaxNameToXmlFileName = syntaxDb['syntaxNameToXmlFileName']
+            self._xmlFileNameToSyntaxName = {xmlFileName: syntaxName \
+                                                for syntaxName, xmlFileName in self._syntaxNameToXmlFileName.items()}
+            self._mimeTypeToXmlFileName = syntaxDb['mimeTypeToXmlFileName']
+
+            self._fileNameIndex = _GlobIndex(syntaxDb['extensionToXmlFileName'].items())
+            # fnmatch.fnmatch() normalizes case of the name and the pattern
+            self._firstLineIndex = _GlobIndex((os.path.normcase(glob), xmlFileName) \
+                                                for glob, xmlFileName in syntaxDb['firstLineToXmlFileName'].items())
+            self._syntaxDbLoaded = True
+
+    def _getSyntaxByXmlFileName(self, xmlFileName):
         """Get syntax by its xml file name
         """
         import qutepart.syntax.loader  # delayed import for avoid cross-imports problem
@@ -177,39 +438,37 @@ class SyntaxManager:
                 xmlFilePath = os.path.join(os.path.dirname(__file__), "data", "xml", xmlFileName)
                 syntax = Syntax(self)
                 self._loadedSyntaxes[xmlFileName] = syntax
-                qutepart.syntax.loader.loadSyntax(syntax, xmlFilePath, formatConverterFunction)
+                qutepart.syntax.loader.loadSyntax(syntax, xmlFilePath)
 
             return self._loadedSyntaxes[xmlFileName]
 
-    def _getSyntaxByLanguageName(self, syntaxName, formatConverterFunction):
+    def _getSyntaxByLanguageName(self, syntaxName):
         """Get syntax by its name. Name is defined in the xml file
         """
         xmlFileName = self._syntaxNameToXmlFileName[syntaxName]
-        return self._getSyntaxByXmlFileName(xmlFileName, formatConverterFunction)
+        return self._getSyntaxByXmlFileName(xmlFileName)
 
-    def _getSyntaxBySourceFileName(self, name, formatConverterFunction):
+    def _getSyntaxBySourceFileName(self, name):
         """Get syntax by source name of file, which is going to be highlighted
         """
-        for regExp, xmlFileName in self._extensionToXmlFileName.items():
-            if regExp.match(name):
-                return self._getSyntaxByXmlFileName(xmlFileName, formatConverterFunction)
-        else:
+        xmlFileName = self._fileNameIndex.match(name)
+        if xmlFileName is None:
             raise KeyError("No syntax for " + name)
+        return self._getSyntaxByXmlFileName(xmlFileName)
 
-    def _getSyntaxByMimeType(self, mimeType, formatConverterFunction):
+    def _getSyntaxByMimeType(self, mimeType):
         """Get syntax by first line of the file
         """
         xmlFileName = self._mimeTypeToXmlFileName[mimeType]
-        return self._getSyntaxByXmlFileName(xmlFileName, formatConverterFunction)
+        return self._getSyntaxByXmlFileName(xmlFileName)
 
-    def _getSyntaxByFirstLine(self, firstLine, formatConverterFunction):
+    def _getSyntaxByFirstLine(self, firstLine):
         """Get syntax by first line of the file
         """
-        for pattern, xmlFileName in self._firstLineToXmlFileName.items():
-            if fnmatch.fnmatch(firstLine, pattern):
-                return self._getSyntaxByXmlFileName(xmlFileName, formatConverterFunction)
-        else:
+        xmlFileName = self._firstLineIndex.match(os.path.normcase(firstLine))
+        if xmlFileName is None:
             raise KeyError("No syntax for " + firstLine)
+        return self._getSyntaxByXmlFileName(xmlFileName)
 
     def getSyntax(self, formatConverterFunction = None,
                   xmlFileName=None,
@@ -223,38 +482,59 @@ class SyntaxManager:
             * languageName
             * sourceFilePath
         First parameter in the list has biggest priority
+
+        formatConverterFunction is ignored and kept for compatibility.
+        Parsers emit style indexes, which are converted to formats by the user, see textFormat()
         """
+        self._loadSyntaxDb()
+
         syntax = None
 
         if syntax is None and xmlFileName is not None:
             try:
-                syntax = self._getSyntaxByXmlFileName(xmlFileName, formatConverterFunction)
+                syntax = self._getSyntaxByXmlFileName(xmlFileName)
             except KeyError:
                 _logger.warning('No xml definition %s' % xmlFileName)
 
         if syntax is None and mimeType is not None:
             try:
-                syntax = self._getSyntaxByMimeType(mimeType, formatConverterFunction)
+                syntax = self._getSyntaxByMimeType(mimeType)
             except KeyError:
                 _logger.warning('No syntax for mime type %s' % mimeType)
 
         if syntax is None and languageName is not None:
             try:
-                syntax = self._getSyntaxByLanguageName(languageName, formatConverterFunction)
+                syntax = self._getSyntaxByLanguageName(languageName)
             except KeyError:
                 _logger.warning('No syntax for language %s' % languageName)
 
         if syntax is None and sourceFilePath is not None:
             baseName = os.path.basename(sourceFilePath)
             try:
-                syntax = self._getSyntaxBySourceFileName(baseName, formatConverterFunction)
+                syntax = self._getSyntaxBySourceFileName(baseName)
             except KeyError:
                 pass
 
         if syntax is None and firstLine is not None:
             try:
-                syntax = self._getSyntaxByFirstLine(firstLine, formatConverterFunction)
+                syntax = self._getSyntaxByFirstLine(firstLine)
             except KeyError:
                 pass
 
         return syntax
+
+    def detectMany(self, paths):
+        """Detect languages of many files by their names. Syntaxes are not loaded.
+        Returns list of language names, None for files, for which the language is not detected.
+        Language name can be passed to getSyntax() as languageName
+        """
+        self._loadSyntaxDb()
+
+        match = self._fileNameIndex.match
+        xmlFileNameToSyntaxName = self._xmlFileNameToSyntaxName
+        basename = os.path.basename
+        results = []
+        for path in paths:
+            xmlFileName = match(basename(path))
+            results.append(xmlFileNameToSyntaxName.get(xmlFileName) if xmlFileName is not None else None)
+        return results
@@ -20,6 +20,12 @@
 
 #include <stdio.h>
 
+#ifdef _WIN32
+    #include <windows.h>
+#else
+    #include <time.h>
+#endif
+
 // Allow the PCRE's config.h to set options used by pcre.h below.
 #ifdef HAVE_PCRE_CONFIG_H
     #include "config.h"
@@ -261,6 +267,7 @@ typedef struct {
     size_t textLen;
     bool firstNonSpace;
     bool isWordStart;
+    bool releaseGil;  // release the GIL while matching reg exps. Set by the caller of the parser
     size_t wordLength;
     size_t utf8WordLength;   // word length in bytes of utf8 code
     char utf8Word[QUTEPART_MAX_WORD_LENGTH];
@@ -274,6 +281,19 @@ typedef struct {
 
 typedef RuleTryMatchResult_internal (*_tryMatchFunctionType)(PyObject* self, TextToMatchObject_internal* textToMatchObject);
 
+#define QUTEPART_DISPATCH_TABLE_SIZE 128  // table item for each ASCII character
+
+typedef struct {
+    size_t* indexes;
+    size_t size;
+} _RuleIndexes;
+
+typedef struct {
+    unsigned long long attempts;
+    unsigned long long successes;
+    double time;  // seconds
+} _RuleProfileItem;
+
 
 typedef struct {
     PyObject_HEAD
@@ -288,16 +308,29 @@ typedef struct {
     PyObject* rulesPython;
     AbstractRule** rulesC;
     size_t rulesSize;
+    PyObject* flatRulesPython;  // rules with expanded IncludeRules
+    AbstractRule** flatRulesC;
+    size_t flatRulesSize;
+    PyObject* dispatchTablePython;
+    _RuleIndexes dispatchTable[QUTEPART_DISPATCH_TABLE_SIZE];  // rules, which may match text, started with ASCII character
+    _RuleIndexes nonAsciiRules;  // rules, which may match text, started with other character
+    size_t* dispatchTableBuffer;
     bool dynamic;
     Py_UNICODE textType;
     PyObject* textTypePython;
+    PyObject* loader;  // called, when not loaded context is entered first time
+    _RuleProfileItem* ruleProfile;  // statistics for each flat rule. NULL, if not profiled yet
 } Context;
 
-typedef struct {
+// Immutable interned stack frame. See ContextStack_make()
+typedef struct _ContextStack {
     PyObject_HEAD
-    Context* _contexts[QUTEPART_MAX_CONTEXT_STACK_DEPTH];
-    _RegExpMatchGroups* _data[QUTEPART_MAX_CONTEXT_STACK_DEPTH];
+    struct _ContextStack* _parent;  // NULL for the bottom frame
+    Context* _context;
+    _RegExpMatchGroups* _data;
     size_t _size;
+    Py_hash_t _hash;
+    struct _ContextStack* _nextInBucket;  // interned stacks hash table chain
 } ContextStack;
 
 #define DELIMINATOR_SET_CACHE_SIZE 128
@@ -573,6 +606,8 @@ static TextToMatchObject_internal
 TextToMatchObject_internal_make(unsigned int column, PyObject* unicodeText, _RegExpMatchGroups* contextData)
 {
     TextToMatchObject_internal textToMatchObject;
+    Py_UNICODE* wholeLineUnicodeBuffer = PyUnicode_AS_UNICODE(unicodeText);
+    unsigned int i;
 
     textToMatchObject.wholeLineLen = PyUnicode_GET_SIZE(unicodeText);
     textToMatchObject.currentColumnIndex = column;
@@ -585,11 +620,21 @@ TextToMatchObject_internal_make(unsigned int column, PyObject* unicodeText, _Reg
 
     // text and textLen is updated in the loop
     textToMatchObject.textLen = textToMatchObject.wholeLineLen;
-    textToMatchObject.firstNonSpace = true;  // updated in the loop
-    // isWordStart, wordLength is updated in the loop
+    // updated in the loop. Context might start parsing in the middle of the line,
+    // the update checks the previous character, here check all characters before it
     textToMatchObject.firstNonSpace = true;
+    for (i = 0; i + 1 < column; i++)
+    {
+        if ( ! Py_UNICODE_ISSPACE(wholeLineUnicodeBuffer[i]))
+        {
+            textToMatchObject.firstNonSpace = false;
+            break;
+        }
+    }
+    // isWordStart, wordLength is updated in the loop
     textToMatchObject.isWordStart = true;
     textToMatchObject.contextData = contextData;
+    textToMatchObject.releaseGil = false;
 
     return textToMatchObject;
 }
@@ -798,6 +843,20 @@ TextToMatchObject_init(TextToMatchObject*self, PyObject *args, PyObject *kwds)
 
 DECLARE_TYPE(TextToMatchObject, NULL, "Rule.tryMatch() input parameter");
 
+// Make object for the line, which is parsed by parts. See Parser_highlightBlockPart()
+// Returns new reference or NULL on memory error
+static TextToMatchObject*
+TextToMatchObject_make(PyObject* unicodeText)
+{
+    TextToMatchObject* self = PyObject_New(TextToMatchObject, &TextToMatchObjectType);
+    if (NULL == self)
+        return NULL;
+
+    self->internal = TextToMatchObject_internal_make(0, unicodeText, NULL);
+    Py_INCREF(unicodeText);
+    return self;
+}
+
 
 /********************************************************************************
  *                                Rules
@@ -968,6 +1027,184 @@ _makeDynamicSubstitutions(char* utf8String,
     return resultLen;
 }
 
+/********************************************************************************
+ *                                _DynamicRuleCache
+ * Dynamic StringDetect and RegExpr rules make substitutions and compile reg exp
+ * for every character of dynamic context, i.e. heredoc.
+ * Every rule caches results for few last values of context data. Least recently used
+ * value is the last in the list
+ ********************************************************************************/
+#define QUTEPART_DYNAMIC_RULE_CACHE_SIZE 8
+
+// Compiled reg exp of dynamic RegExpr. Reference counted, because the parsing thread
+// matches it without the GIL, while the main thread might drop it from the cache.
+// The counter is changed only with the GIL held
+typedef struct {
+    pcre* regExp;
+    pcre_extra* extra;
+    size_t refCount;
+} _DynamicRegExp;
+
+typedef struct {
+    _RegExpMatchGroups* contextData;
+    char* utf8String;  // StringDetect string
+    size_t stringLen;
+    _DynamicRegExp* regExp;  // RegExpr reg exp. NULL if failed to compile
+} _DynamicRuleCacheItem;
+
+typedef struct {
+    _DynamicRuleCacheItem items[QUTEPART_DYNAMIC_RULE_CACHE_SIZE];
+    size_t size;
+} _DynamicRuleCache;
+
+static unsigned long _dynamicRuleCacheHits = 0;
+static unsigned long _dynamicRuleCacheMisses = 0;
+
+static bool
+_RegExpMatchGroups_equal(_RegExpMatchGroups* self, _RegExpMatchGroups* other)
+{
+    size_t i;
+
+    if (self == other)
+        return true;
+
+    if (_RegExpMatchGroups_size(self) != _RegExpMatchGroups_size(other))
+        return false;
+
+    for (i = 0; i < _RegExpMatchGroups_size(self); i++)
+    {
+        if (0 != strcmp(_RegExpMatchGroups_getItem(self, i), _RegExpMatchGroups_getItem(other, i)))
+            return false;
+    }
+
+    return true;
+}
+
+static void
+_DynamicRegExp_release(_DynamicRegExp* self)
+{
+    if (NULL == self)
+        return;
+
+    self->refCount--;
+
+    if (0 == self->refCount)
+    {
+        pcre_free(self->regExp);
+        if (NULL != self->extra)
+            pcre_free(self->extra);
+        PyMem_Free(self);
+    }
+}
+
+static void
+_DynamicRuleCacheItem_free(_DynamicRuleCacheItem* item)
+{
+    _RegExpMatchGroups_release(item->contextData);
+    if (NULL != item->utf8String)
+        PyMem_Free(item->utf8String);
+    _DynamicRegExp_release(item->regExp);
+}
+
+static void
+_DynamicRuleCache_free(_DynamicRuleCache* self)
+{
+    size_t i;
+    for (i = 0; i < self->size; i++)
+        _DynamicRuleCacheItem_free(&self->items[i]);
+    self->size = 0;
+}
+
+// Returns cached item and makes it most recently used, or NULL
+static _DynamicRuleCacheItem*
+_DynamicRuleCache_find(_DynamicRuleCache* self, _RegExpMatchGroups* contextData)
+{
+    size_t i;
+
+    for (i = 0; i < self->size; i++)
+    {
+        if (_RegExpMatchGroups_equal(self->items[i].contextData, contextData))
+        {
+            if (i > 0)
+            {
+                _DynamicRuleCacheItem item = self->items[i];
+                memmove(&self->items[1], &self->items[0], i * sizeof(_DynamicRuleCacheItem));
+                self->items[0] = item;
+            }
+            _dynamicRuleCacheHits++;
+            return &self->items[0];
+        }
+    }
+
+    _dynamicRuleCacheMisses++;
+    return NULL;
+}
+
+// Adds empty item for the context data as the most recently used. Least recently used item is dropped
+static _DynamicRuleCacheItem*
+_DynamicRuleCache_add(_DynamicRuleCache* self, _RegExpMatchGroups* contextData)
+{
+    if (QUTEPART_DYNAMIC_RULE_CACHE_SIZE == self->size)
+    {
+        _DynamicRuleCacheItem_free(&self->items[self->size - 1]);
+        self->size--;
+    }
+
+    memmove(&self->items[1], &self->items[0], self->size * sizeof(_DynamicRuleCacheItem));
+    self->size++;
+
+    memset(&self->items[0], 0, sizeof(_DynamicRuleCacheItem));
+    self->items[0].contextData = _RegExpMatchGroups_duplicate(contextData);
+    return &self->items[0];
+}
+
+static PyObject*
+cParser_dynamicRuleCacheInfo(PyObject* self, PyObject* args)
+{
+    return Py_BuildValue("(kk)", _dynamicRuleCacheHits, _dynamicRuleCacheMisses);
+}
+
+
+/********************************************************************************
+ *                                Rule profiling
+ ********************************************************************************/
+
+static bool _ruleProfilingEnabled = false;
+
+static double
+_profilerTime(void)
+{
+#ifdef _WIN32
+    LARGE_INTEGER frequency;
+    LARGE_INTEGER counter;
+    QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (double)counter.QuadPart / (double)frequency.QuadPart;
+#else
+    struct timespec now;
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return (double)now.tv_sec + (double)now.tv_nsec * 1e-9;
+#endif
+}
+
+static PyObject*
+cParser_setRuleProfilingEnabled(PyObject* self, PyObject* args)
+{
+    PyObject* enabledObject = NULL;
+    int enabled;
+
+    if (! PyArg_ParseTuple(args, "O", &enabledObject))
+        return NULL;
+
+    enabled = PyObject_IsTrue(enabledObject);
+    if (enabled < 0)
+        return NULL;
+
+    _ruleProfilingEnabled = enabled;
+
+    Py_RETURN_NONE;
+}
+
 
 // used only by unit test. C code uses AbstractRule_tryMatch_internal
 static PyObject*
@@ -1198,6 +1435,7 @@ typedef struct {
     /* Type-specific fields go here. */
     char* utf8String;
     size_t stringLen; // without \0
+    _DynamicRuleCache dynamicCache;
 } StringDetect;
 
 
@@ -1206,6 +1444,7 @@ StringDetect_dealloc_fields(StringDetect* self)
 {
     if (NULL != self->utf8String)
         PyMem_Free(self->utf8String);
+    _DynamicRuleCache_free(&self->dynamicCache);
 }
 
 static RuleTryMatchResult_internal
@@ -1213,14 +1452,27 @@ StringDetect_tryMatch(StringDetect* self, TextToMatchObject_internal* textToMatc
 {
     if (self->abstractRuleParams->dynamic)
     {
-        char buffer[QUTEPART_DYNAMIC_STRING_MAX_LENGTH];
-        size_t stringLen = _makeDynamicSubstitutions(self->utf8String, self->stringLen,
-                                                     buffer, sizeof(buffer) - 1,
-                                                     textToMatchObject->contextData,
-                                                     false);
+        _DynamicRuleCacheItem* item = _DynamicRuleCache_find(&self->dynamicCache, textToMatchObject->contextData);
+        if (NULL == item)
+        {
+            char buffer[QUTEPART_DYNAMIC_STRING_MAX_LENGTH];
+            int stringLen = _makeDynamicSubstitutions(self->utf8String, self->stringLen,
+                                                      buffer, sizeof(buffer) - 1,
+                                                      textToMatchObject->contextData,
+                                                      false);
+
+            item = _DynamicRuleCache_add(&self->dynamicCache, textToMatchObject->contextData);
+            if (stringLen > 0)  // failed substitution is cached as NULL string
+            {
+                item->stringLen = stringLen;
+                item->utf8String = PyMem_Malloc(stringLen + 1);
+                strcpy(item->utf8String, buffer);
+            }
+        }
 
-        if (stringLen > 0 && 0 == strncmp(buffer, textToMatchObject->utf8Text, stringLen))
-            return MakeTryMatchResult(self, stringLen, NULL);
+        if (NULL != item->utf8String &&
+            0 == strncmp(item->utf8String, textToMatchObject->utf8Text, item->stringLen))
+            return MakeTryMatchResult(self, item->stringLen, NULL);
     }
     else
     {
@@ -1541,6 +1793,7 @@ typedef struct {
     bool lineStart;
     pcre* regExp;
     pcre_extra* extra;
+    _DynamicRuleCache dynamicCache;
 } RegExpr;
 
 static void
@@ -1552,6 +1805,7 @@ RegExpr_dealloc_fields(RegExpr* self)
         pcre_free(self->regExp);
     if (NULL != self->extra)
         pcre_free(self->extra);
+    _DynamicRuleCache_free(&self->dynamicCache);
 }
 
 static pcre*
@@ -1588,14 +1842,36 @@ _compileRegExp(const char* utf8String, bool insensitive, pcre_extra** pExtra)
     return regExp;
 }
 
+// Match reg exp at startOffset of utf8Text. The pattern sees the whole text, so ^, \b and look-behind work as in Kate
 static int
-_matchRegExp(pcre* regExp, pcre_extra* extra, const char* utf8Text, size_t textLen, _RegExpMatchGroups** pGroups)
+_matchRegExp(pcre* regExp, pcre_extra* extra,
+             const char* utf8Text, size_t textLen, size_t startOffset,
+             bool releaseGil,
+             _RegExpMatchGroups** pGroups)
 {
     int ovector[30];
-    int rc = pcre_exec(regExp, extra,
+    int rc;
+
+    /* Matching doesn't touch Python objects. When parsing in a background thread,
+       the GIL is released, so that the main thread is not blocked by parsing.
+       The main thread doesn't release it, it would only slow down parsing
+     */
+    if (releaseGil)
+    {
+        Py_BEGIN_ALLOW_THREADS
+        rc = pcre_exec(regExp, extra,
+                       utf8Text, textLen,
+                       startOffset, PCRE_NOTEMPTY | PCRE_NO_UTF8_CHECK,
+                       ovector, sizeof ovector / sizeof ovector[0]);
+        Py_END_ALLOW_THREADS
+    }
+    else
+    {
+        rc = pcre_exec(regExp, extra,
                        utf8Text, textLen,
-                       0, PCRE_NOTEMPTY | PCRE_NO_UTF8_CHECK,
+                       startOffset, PCRE_NOTEMPTY | PCRE_NO_UTF8_CHECK,
                        ovector, sizeof ovector / sizeof ovector[0]);
+    }
 
     if (rc > 0)
     {
@@ -1619,13 +1895,42 @@ _matchRegExp(pcre* regExp, pcre_extra* extra, const char* utf8Text, size_t textL
     }
 }
 
+// Compile reg exp for dynamic RegExpr. Returns NULL if failed
+static _DynamicRegExp*
+_DynamicRegExp_compile(const char* utf8String, bool insensitive)
+{
+    _DynamicRegExp* self;
+    pcre_extra* extra = NULL;
+    pcre* regExp = _compileRegExp(utf8String, insensitive, &extra);
+
+    if (NULL == regExp)
+        return NULL;
+
+    self = PyMem_Malloc(sizeof(_DynamicRegExp));
+    if (NULL == self)
+    {
+        pcre_free(regExp);
+        if (NULL != extra)
+            pcre_free(extra);
+        return NULL;
+    }
+
+    self->regExp = regExp;
+    self->extra = extra;
+    self->refCount = 1;
+    return self;
+}
+
 static RuleTryMatchResult_internal
 RegExpr_tryMatch(RegExpr* self, TextToMatchObject_internal* textToMatchObject)
 {
     size_t matchLen;
     pcre* regExp = NULL;
     pcre_extra* extra = NULL;
+    _DynamicRegExp* dynamicRegExp = NULL;
     _RegExpMatchGroups* groups = NULL;
+    const char* wholeLineUtf8Text;
+    size_t startOffset;
 
     // Special case. if pattern starts with \b, we have to check it manually,
     //because string is passed to .match(..) without beginning
@@ -1640,15 +1945,28 @@ RegExpr_tryMatch(RegExpr* self, TextToMatchObject_internal* textToMatchObject)
 
     if (self->abstractRuleParams->dynamic)
     {
-        char buffer[QUTEPART_DYNAMIC_STRING_MAX_LENGTH];
-        size_t stringLen = _makeDynamicSubstitutions(self->utf8String, self->stringLen,
-                                                     buffer, sizeof buffer - 1,
-                                                     textToMatchObject->contextData,
-                                                     true);
-        if (stringLen <= 0)
+        _DynamicRuleCacheItem* item = _DynamicRuleCache_find(&self->dynamicCache, textToMatchObject->contextData);
+        if (NULL == item)
+        {
+            char buffer[QUTEPART_DYNAMIC_STRING_MAX_LENGTH];
+            int stringLen = _makeDynamicSubstitutions(self->utf8String, self->stringLen,
+                                                      buffer, sizeof buffer - 1,
+                                                      textToMatchObject->contextData,
+                                                      true);
+
+            item = _DynamicRuleCache_add(&self->dynamicCache, textToMatchObject->contextData);
+            if (stringLen > 0)  // failed substitution is cached as NULL reg exp
+                item->regExp = _DynamicRegExp_compile(buffer, self->insensitive);
+        }
+
+        if (NULL == item->regExp)
             return MakeEmptyTryMatchResult();
 
-        regExp = _compileRegExp(buffer, self->insensitive, NULL);
+        // the item might be dropped from the cache by other thread, while the reg exp is matched
+        dynamicRegExp = item->regExp;
+        dynamicRegExp->refCount++;
+        regExp = dynamicRegExp->regExp;
+        extra = dynamicRegExp->extra;
     }
     else
     {
@@ -1659,7 +1977,14 @@ RegExpr_tryMatch(RegExpr* self, TextToMatchObject_internal* textToMatchObject)
     if (NULL == regExp)
         return MakeEmptyTryMatchResult();
 
-    matchLen = _matchRegExp(regExp, extra, textToMatchObject->utf8Text, textToMatchObject->textLen, &groups);
+    // match the whole line from the current position, as the Python parser does
+    wholeLineUtf8Text = PyBytes_AS_STRING(textToMatchObject->wholeLineUtf8Text);
+    startOffset = textToMatchObject->utf8Text - wholeLineUtf8Text;
+    matchLen = _matchRegExp(regExp, extra,
+                            wholeLineUtf8Text, startOffset + textToMatchObject->textLen, startOffset,
+                            textToMatchObject->releaseGil,
+                            &groups);
+    _DynamicRegExp_release(dynamicRegExp);
 
     if (matchLen != 0)
         return MakeTryMatchResult(self, matchLen, groups);
@@ -1833,16 +2158,15 @@ AbstractNumberRule_tryMatch(AbstractRule* self,
         return MakeEmptyTryMatchResult();
 
     matchEndIndex = textToMatchObject->currentColumnIndex + index;
-    if (matchEndIndex < PyUnicode_GET_SIZE(textToMatchObject->wholeLineUnicodeText))
+    if (childRulesSize > 0 &&
+        matchEndIndex < PyUnicode_GET_SIZE(textToMatchObject->wholeLineUnicodeText))
     {
         size_t i;
         bool haveMatch = false;
         Parser* parentParser;
 
-        TextToMatchObject_internal newTextToMatchObject =
-                TextToMatchObject_internal_make(textToMatchObject->currentColumnIndex + index,
-                                                textToMatchObject->wholeLineUnicodeText,
-                                                textToMatchObject->contextData);
+        // The copy shares whole line buffers, therefore it is not freed
+        TextToMatchObject_internal newTextToMatchObject = *textToMatchObject;
 
         parentParser = AbstractRule_parentParser(self->abstractRuleParams);
         TextToMatchObject_internal_update(&newTextToMatchObject,
@@ -1861,8 +2185,6 @@ AbstractNumberRule_tryMatch(AbstractRule* self,
             }
             // child rule context and attribute is ignored
         }
-
-        TextToMatchObject_internal_free(&newTextToMatchObject);
     }
 
     return MakeTryMatchResult(self, index, NULL);
@@ -2375,8 +2697,8 @@ static RuleTryMatchResult_internal
 IncludeRules_tryMatch(IncludeRules* self, TextToMatchObject_internal* textToMatchObject)
 {
     size_t i;
-    AbstractRule** rules = self->context->rulesC;
-    for (i = 0; i < self->context->rulesSize; i++)
+    AbstractRule** rules = self->context->flatRulesC;
+    for (i = 0; i < self->context->flatRulesSize; i++)
     {
         RuleTryMatchResult_internal ruleTryMatchResult = AbstractRule_tryMatch_internal(rules[i], textToMatchObject);
         if (NULL != ruleTryMatchResult.rule)
@@ -2509,31 +2831,137 @@ DECLARE_RULE_METHODS_AND_TYPE(DetectIdentifier);
 
 /********************************************************************************
  *                                Context stack
+ * Stacks are interned. Equal stacks are the same object, therefore stacks are compared by
+ * pointer and lines share common parts of their stacks.
  ********************************************************************************/
+#define QUTEPART_CONTEXT_STACK_TABLE_MIN_SIZE 256
+
+static ContextStack** _contextStackTable = NULL;  // hash table of all existing stacks
+static size_t _contextStackTableSize = 0;  // count of buckets. Power of 2
+static size_t _contextStackCount = 0;
+
+static Py_hash_t
+_RegExpMatchGroups_hash(_RegExpMatchGroups* self)
+{
+    size_t hash = 2166136261u;  // FNV-1a
+    size_t i;
+    const char* c;
+
+    for (i = 0; i < _RegExpMatchGroups_size(self); i++)
+    {
+        for (c = _RegExpMatchGroups_getItem(self, i); *c != '\0'; c++)
+            hash = (hash ^ (unsigned char)*c) * 16777619u;
+        hash = (hash ^ 0xff) * 16777619u;  // group separator
+    }
+
+    return (Py_hash_t)hash;
+}
+
+static Py_hash_t
+_ContextStack_hash(ContextStack* parent, Context* context, _RegExpMatchGroups* data)
+{
+    size_t hash = (size_t)parent;
+    hash = hash * 1000003u ^ (size_t)context;
+    hash = hash * 1000003u ^ (size_t)_RegExpMatchGroups_hash(data);
+    return (Py_hash_t)hash;
+}
+
+static bool
+_ContextStack_resizeTable(size_t newSize)
+{
+    ContextStack** newTable = PyMem_Malloc(newSize * sizeof(ContextStack*));
+    size_t i;
+
+    if (NULL == newTable)
+        return false;
+
+    memset(newTable, 0, newSize * sizeof(ContextStack*));
+
+    for (i = 0; i < _contextStackTableSize; i++)
+    {
+        ContextStack* stack = _contextStackTable[i];
+        while (NULL != stack)
+        {
+            ContextStack* next = stack->_nextInBucket;
+            size_t bucket = (size_t)stack->_hash & (newSize - 1);
+            stack->_nextInBucket = newTable[bucket];
+            newTable[bucket] = stack;
+            stack = next;
+        }
+    }
+
+    PyMem_Free(_contextStackTable);
+    _contextStackTable = newTable;
+    _contextStackTableSize = newSize;
+    return true;
+}
+
 static void
 ContextStack_dealloc(ContextStack* self)
 {
-    size_t i;
-    for (i = 0; i < self->_size; i++)
-        _RegExpMatchGroups_release(self->_data[i]);
+    ContextStack** pStack = &_contextStackTable[(size_t)self->_hash & (_contextStackTableSize - 1)];
+
+    while (*pStack != self)
+        pStack = &((*pStack)->_nextInBucket);
+    *pStack = self->_nextInBucket;
+    _contextStackCount--;
+
+    _RegExpMatchGroups_release(self->_data);
+    Py_XDECREF(self->_parent);
 
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
 
 DECLARE_TYPE_WITHOUT_CONSTRUCTOR(ContextStack, NULL, "Context stack");
 
+// Get stack with parent (or NULL), context on the top and context data. Not a constructor, just C function.
+// Returns new reference or NULL on memory error
 static ContextStack*
-ContextStack_new(Context** contexts, _RegExpMatchGroups** data, size_t size)  // not a constructor, just C function
+ContextStack_make(ContextStack* parent, Context* context, _RegExpMatchGroups* data)
 {
-    size_t i;
-    ContextStack* contextStack = PyObject_New(ContextStack, &ContextStackType);
+    Py_hash_t hash = _ContextStack_hash(parent, context, data);
+    ContextStack* contextStack;
+    size_t bucket;
 
-    for (i = 0; i < size; i++)
+    if (NULL == _contextStackTable &&
+        ( ! _ContextStack_resizeTable(QUTEPART_CONTEXT_STACK_TABLE_MIN_SIZE)))
+    {
+        PyErr_NoMemory();
+        return NULL;
+    }
+
+    bucket = (size_t)hash & (_contextStackTableSize - 1);
+    for (contextStack = _contextStackTable[bucket];
+         NULL != contextStack;
+         contextStack = contextStack->_nextInBucket)
     {
-        contextStack->_contexts[i] = contexts[i];
-        contextStack->_data[i] = _RegExpMatchGroups_duplicate(data[i]);
+        if (contextStack->_hash == hash &&
+            contextStack->_parent == parent &&
+            contextStack->_context == context &&
+            _RegExpMatchGroups_equal(contextStack->_data, data))
+        {
+            Py_INCREF(contextStack);
+            return contextStack;
+        }
     }
-    contextStack->_size = size;
+
+    contextStack = PyObject_New(ContextStack, &ContextStackType);
+    if (NULL == contextStack)
+        return NULL;
+
+    Py_XINCREF(parent);
+    contextStack->_parent = parent;
+    contextStack->_context = context;
+    contextStack->_data = _RegExpMatchGroups_duplicate(data);
+    contextStack->_size = (NULL != parent) ? parent->_size + 1 : 1;
+    contextStack->_hash = hash;
+
+    contextStack->_nextInBucket = _contextStackTable[bucket];
+    _contextStackTable[bucket] = contextStack;
+    _contextStackCount++;
+
+    if (_contextStackCount > _contextStackTableSize)
+        _ContextStack_resizeTable(_contextStackTableSize * 2);  // on failure the table just remains dense
 
     return contextStack;
 }
@@ -2541,13 +2969,13 @@ ContextStack_new(Context** contexts, _RegExpMatchGroups** data, size_t size)  //
 static Context*
 ContextStack_currentContext(ContextStack* self)
 {
-    return self->_contexts[self->_size - 1];
+    return self->_context;
 }
 
 static _RegExpMatchGroups*
 ContextStack_currentData(ContextStack* self)
 {
-    return self->_data[self->_size - 1];
+    return self->_data;
 }
 
 /********************************************************************************
@@ -2579,43 +3007,49 @@ ContextSwitcher_init(ContextSwitcher *self, PyObject *args, PyObject *kwds)
 
 DECLARE_TYPE(ContextSwitcher, NULL, "Context switcher");
 
+// Returns new reference or NULL on error
 static ContextStack*
 ContextSwitcher_getNextContextStack(ContextSwitcher* self, ContextStack* contextStack, _RegExpMatchGroups* data)
 {
     bool haveContextToSwitch = Py_None != (PyObject*)self->_contextToSwitch;
-    ContextStack* newContextStack;
+    ContextStack* newContextStack = contextStack;
+    int i;
 
-    if (contextStack->_size - self->_popsCount < 0 ||
-        (contextStack->_size - self->_popsCount == 0 &&
+    if ((size_t)self->_popsCount > contextStack->_size ||
+        ((size_t)self->_popsCount == contextStack->_size &&
          ( ! haveContextToSwitch)))
     {
 #if 0  // Trace disabled because happens to often. It seems like it is normal behavior.
         fprintf(stderr, "Attempt to pop the last context\n");
 #endif
-        return ContextStack_new(contextStack->_contexts,
-                                contextStack->_data,
-                                1);
+        while (NULL != newContextStack->_parent)
+            newContextStack = newContextStack->_parent;
+        Py_INCREF(newContextStack);
+        return newContextStack;
     }
 
-    newContextStack = ContextStack_new(contextStack->_contexts,
-                                       contextStack->_data,
-                                       contextStack->_size - self->_popsCount);
+    for (i = 0; i < self->_popsCount; i++)
+        newContextStack = newContextStack->_parent;  // NULL if all frames popped
 
     if (haveContextToSwitch)
     {
-        if (newContextStack->_size < QUTEPART_MAX_CONTEXT_STACK_DEPTH)
-        {
-            Context* contextToSwitch = (Context*)self->_contextToSwitch;
-            newContextStack->_contexts[newContextStack->_size] = contextToSwitch;
+        Context* contextToSwitch = (Context*)self->_contextToSwitch;
 
-            if (contextToSwitch->dynamic)
-                newContextStack->_data[newContextStack->_size] = _RegExpMatchGroups_duplicate(data);
-            else
-                newContextStack->_data[newContextStack->_size] = NULL;
-
-            newContextStack->_size++;
+        if (NULL != contextToSwitch->loader &&
+            Py_None != contextToSwitch->loader)  // context is entered first time, see loader.lazyContextLoading
+        {
+            PyObject* result = PyObject_CallFunctionObjArgs(contextToSwitch->loader, (PyObject*)contextToSwitch, NULL);
+            if (NULL == result)
+            {
+                PyErr_Print();  // context is not loaded, don't switch to it
+                Py_INCREF(contextStack);
+                return contextStack;
+            }
+            Py_DECREF(result);
         }
-        else
+
+        if (NULL != newContextStack &&
+            newContextStack->_size >= QUTEPART_MAX_CONTEXT_STACK_DEPTH)
         {
             static bool messageShown = false;
             if ( ! messageShown)
@@ -2623,11 +3057,16 @@ ContextSwitcher_getNextContextStack(ContextSwitcher* self, ContextStack* context
                 fprintf(stderr, "qutepart: Max context stack depth %d reached\n", QUTEPART_MAX_CONTEXT_STACK_DEPTH);
                 messageShown = true;
             }
-            Py_XDECREF(newContextStack);
+            Py_INCREF(contextStack);
             return contextStack;
         }
+
+        return ContextStack_make(newContextStack,
+                                 contextToSwitch,
+                                 contextToSwitch->dynamic ? data : NULL);
     }
 
+    Py_INCREF(newContextStack);
     return newContextStack;
 }
 
@@ -2640,8 +3079,13 @@ static PyMemberDef Context_members[] = {
     {"name", T_OBJECT_EX, offsetof(Context, name), READONLY, "Name"},
     {"parser", T_OBJECT_EX, offsetof(Context, parser), READONLY, "Parser instance"},
     {"format", T_OBJECT_EX, offsetof(Context, format), READONLY, "Context format"},
+    {"attribute", T_OBJECT_EX, offsetof(Context, attribute), READONLY, "Attribute"},
     {"rules", T_OBJECT_EX, offsetof(Context, rulesPython), READONLY, "List of rules"},
+    {"flatRules", T_OBJECT_EX, offsetof(Context, flatRulesPython), READONLY, "List of rules with expanded IncludeRules"},
+    {"dispatchTable", T_OBJECT_EX, offsetof(Context, dispatchTablePython), READONLY,
+                "(ASCII table, non-ASCII rule indexes) or None"},
     {"textType", T_OBJECT_EX, offsetof(Context, textTypePython), READONLY, "Text type"},
+    {"loader", T_OBJECT, offsetof(Context, loader), READONLY, "Function, which loads not loaded context, or None"},
     {NULL}
 };
 
@@ -2658,8 +3102,15 @@ Context_dealloc(Context* self)
     Py_XDECREF(self->fallthroughContext);
     Py_XDECREF(self->rulesPython);
     Py_XDECREF(self->textTypePython);
+    Py_XDECREF(self->loader);
+
+    Py_XDECREF(self->flatRulesPython);
+    Py_XDECREF(self->dispatchTablePython);
 
     PyMem_Free(self->rulesC);
+    PyMem_Free(self->flatRulesC);
+    PyMem_Free(self->dispatchTableBuffer);
+    PyMem_Free(self->ruleProfile);
 
     Py_TYPE(self)->tp_free((PyObject*)self);
 }
@@ -2724,6 +3175,7 @@ static PyObject*
 Context_setRules(Context *self, PyObject *args)
 {
     PyObject* rulesPython = NULL;
+    size_t i;
 
     if (! PyArg_ParseTuple(args, "|O",
                            &rulesPython))
@@ -2734,72 +3186,328 @@ Context_setRules(Context *self, PyObject *args)
 
     self->rulesC = (AbstractRule**)_listToDynamicallyAllocatedArray(rulesPython, &self->rulesSize);
 
+    // until dispatch table is set, all rules are tried for every character
+    ASSIGN_VALUE(PyObject, self->flatRulesPython, rulesPython);
+    PyMem_Free(self->flatRulesC);
+    self->flatRulesC = (AbstractRule**)_listToDynamicallyAllocatedArray(rulesPython, &self->flatRulesSize);
+    ASSIGN_VALUE(PyObject, self->dispatchTablePython, Py_None);
+
+    PyMem_Free(self->dispatchTableBuffer);
+    self->dispatchTableBuffer = PyMem_Malloc(sizeof(size_t) * (self->rulesSize + 1));
+    for (i = 0; i < self->rulesSize; i++)
+        self->dispatchTableBuffer[i] = i;
+
+    self->nonAsciiRules.indexes = self->dispatchTableBuffer;
+    self->nonAsciiRules.size = self->rulesSize;
+    for (i = 0; i < QUTEPART_DISPATCH_TABLE_SIZE; i++)
+        self->dispatchTable[i] = self->nonAsciiRules;
+
+    PyMem_Free(self->ruleProfile);  // indexed by flat rule index
+    self->ruleProfile = NULL;
+
     Py_RETURN_NONE;
 }
 
+static PyObject*
+Context_setDispatchTable(Context *self, PyObject *args)
+{
+    PyObject* flatRulesPython = NULL;
+    PyObject* asciiTable = NULL;
+    PyObject* nonAsciiRuleIndexes = NULL;
+    PyObject* indexTuples[QUTEPART_DISPATCH_TABLE_SIZE + 1];
+    _RuleIndexes dispatchTable[QUTEPART_DISPATCH_TABLE_SIZE + 1];
+    size_t* buffer;
+    size_t bufferSize = 0;
+    size_t i, j;
+
+    if (! PyArg_ParseTuple(args, "|OOO",
+                           &flatRulesPython, &asciiTable, &nonAsciiRuleIndexes))
+        return NULL;
+
+    LIST_CHECK(flatRulesPython, NULL);
+    TUPLE_CHECK(asciiTable, NULL);
+    TUPLE_CHECK(nonAsciiRuleIndexes, NULL);
+
+    if (QUTEPART_DISPATCH_TABLE_SIZE != PyTuple_Size(asciiTable))
+    {
+        PyErr_SetString(PyExc_ValueError, "asciiTable must contain item for each ASCII character");
+        return NULL;
+    }
+
+    for (i = 0; i < QUTEPART_DISPATCH_TABLE_SIZE; i++)
+        indexTuples[i] = PyTuple_GetItem(asciiTable, i);
+    indexTuples[QUTEPART_DISPATCH_TABLE_SIZE] = nonAsciiRuleIndexes;
+
+    // Equal index lists are usually the same tuple object. Store it only once
+    for (i = 0; i < QUTEPART_DISPATCH_TABLE_SIZE + 1; i++)
+    {
+        PyObject* indexTuple = indexTuples[i];
+        TUPLE_CHECK(indexTuple, NULL);
+
+        for (j = 0; j < i && indexTuples[j] != indexTuple; j++);
+        if (j == i)
+            bufferSize += PyTuple_Size(indexTuple);
+    }
+
+    buffer = PyMem_Malloc(sizeof(size_t) * (bufferSize + 1));
+    bufferSize = 0;
+
+    for (i = 0; i < QUTEPART_DISPATCH_TABLE_SIZE + 1; i++)
+    {
+        PyObject* indexTuple = indexTuples[i];
+
+        for (j = 0; j < i && indexTuples[j] != indexTuple; j++);
+        if (j < i)
+        {
+            dispatchTable[i] = dispatchTable[j];
+            continue;
+        }
+
+        dispatchTable[i].indexes = buffer + bufferSize;
+        dispatchTable[i].size = PyTuple_Size(indexTuple);
+
+        for (j = 0; j < dispatchTable[i].size; j++)
+        {
+            size_t index = PyLong_AsSize_t(PyTuple_GetItem(indexTuple, j));
+
+            if (index >= (size_t)PyList_Size(flatRulesPython))
+            {
+                if ( ! PyErr_Occurred())
+                    PyErr_SetString(PyExc_ValueError, "Invalid rule index in dispatch table");
+                PyMem_Free(buffer);
+                return NULL;
+            }
+
+            dispatchTable[i].indexes[j] = index;
+        }
+
+        bufferSize += dispatchTable[i].size;
+    }
+
+    ASSIGN_FIELD(PyObject, flatRulesPython);
+    PyMem_Free(self->flatRulesC);
+    self->flatRulesC = (AbstractRule**)_listToDynamicallyAllocatedArray(flatRulesPython, &self->flatRulesSize);
+    Py_XDECREF(self->dispatchTablePython);
+    self->dispatchTablePython = PyTuple_Pack(2, asciiTable, nonAsciiRuleIndexes);
+
+    PyMem_Free(self->dispatchTableBuffer);
+    self->dispatchTableBuffer = buffer;
+
+    for (i = 0; i < QUTEPART_DISPATCH_TABLE_SIZE; i++)
+        self->dispatchTable[i] = dispatchTable[i];
+    self->nonAsciiRules = dispatchTable[QUTEPART_DISPATCH_TABLE_SIZE];
+
+    PyMem_Free(self->ruleProfile);  // indexed by flat rule index
+    self->ruleProfile = NULL;
+
+    Py_RETURN_NONE;
+}
+
+
+static PyObject*
+Context_setLoader(Context *self, PyObject *args)
+{
+    PyObject* loader = NULL;
+
+    if (! PyArg_ParseTuple(args, "O",
+                           &loader))
+        return NULL;
+
+    if (Py_None != loader && ! PyCallable_Check(loader))
+    {
+        PyErr_SetString(PyExc_TypeError, "loader must be callable or None");
+        return NULL;
+    }
+
+    ASSIGN_PYOBJECT_FIELD(loader);
+
+    Py_RETURN_NONE;
+}
+
+
+static PyObject*
+Context_ruleProfile(Context *self, PyObject *args)
+{
+    PyObject* result = PyList_New(0);
+    size_t i;
+
+    if (NULL == result || NULL == self->ruleProfile)
+        return result;
+
+    for (i = 0; i < self->flatRulesSize; i++)
+    {
+        _RuleProfileItem* item = &self->ruleProfile[i];
+        PyObject* row;
+
+        if (0 == item->attempts)
+            continue;
+
+        row = Py_BuildValue("(OKKd)", self->flatRulesC[i], item->attempts, item->successes, item->time);
+        if (NULL == row || 0 != PyList_Append(result, row))
+        {
+            Py_XDECREF(row);
+            Py_DECREF(result);
+            return NULL;
+        }
+        Py_DECREF(row);
+    }
+
+    return result;
+}
+
+static PyObject*
+Context_resetRuleProfile(Context *self, PyObject *args)
+{
+    PyMem_Free(self->ruleProfile);
+    self->ruleProfile = NULL;
+
+    Py_RETURN_NONE;
+}
 
 static PyMethodDef Context_methods[] = {
     {"setValues", (PyCFunction)Context_setValues, METH_VARARGS,  "Initialize context object with values"},
     {"setRules", (PyCFunction)Context_setRules, METH_VARARGS,  "Set list of rules"},
+    {"setDispatchTable", (PyCFunction)Context_setDispatchTable, METH_VARARGS,  "Set flat rule list and first character to rule indexes table"},
+    {"setLoader", (PyCFunction)Context_setLoader, METH_VARARGS,  "Set function, which is called, when the context is entered first time"},
+    {"ruleProfile", (PyCFunction)Context_ruleProfile, METH_NOARGS,
+            "Get list of (rule, attempts, successes, time in seconds) for tried flat rules"},
+    {"resetRuleProfile", (PyCFunction)Context_resetRuleProfile, METH_NOARGS,  "Reset rule match statistics"},
     {NULL}  /* Sentinel */
 };
 
 DECLARE_TYPE_WITH_MEMBERS(Context, Context_methods, "Parsing context");
 
-static void
+// Highlighted segment is (length << QUTEPART_STYLE_INDEX_BITS) | styleIndex. See qutepart.syntax.STYLE_INDEX_BITS
+#define QUTEPART_STYLE_INDEX_BITS 16
+#define QUTEPART_STYLE_INDEX_MASK ((1 << QUTEPART_STYLE_INDEX_BITS) - 1)
+
+// Append segment to the list. Adjacent segments of the same style are merged.
+// Segments are unsigned long long, because length << QUTEPART_STYLE_INDEX_BITS overflows 32-bit Py_ssize_t
+// Returns false and sets the error, if failed
+static bool
 Context_appendSegment(PyObject* segmentList, size_t count, PyObject* format)
 {
-    if (Py_None != segmentList)
+    Py_ssize_t listSize;
+    Py_ssize_t styleIndex;
+    unsigned long long shiftedCount;
+    PyObject* segment;
+
+    if (Py_None == segmentList || 0 == count)
+        return true;
+
+    styleIndex = PyLong_AsSsize_t(format);
+    if (-1 == styleIndex && PyErr_Occurred())
+        return false;
+
+    shiftedCount = (unsigned long long)count << QUTEPART_STYLE_INDEX_BITS;
+
+    listSize = PyList_GET_SIZE(segmentList);
+    if (listSize > 0)
+    {
+        unsigned long long lastSegment = PyLong_AsUnsignedLongLong(PyList_GET_ITEM(segmentList, listSize - 1));
+        if ((unsigned long long)-1 == lastSegment && PyErr_Occurred())
+            return false;
+
+        if ((lastSegment & QUTEPART_STYLE_INDEX_MASK) == (unsigned long long)styleIndex)
+        {
+            segment = PyLong_FromUnsignedLongLong(lastSegment + shiftedCount);
+            if (NULL == segment)
+                return false;
+
+            PyList_SetItem(segmentList, listSize - 1, segment);  // steals the reference
+            return true;
+        }
+    }
+
+    segment = PyLong_FromUnsignedLongLong(shiftedCount | (unsigned long long)styleIndex);
+    if (NULL == segment)
+        return false;
+
+    if (-1 == PyList_Append(segmentList, segment))
     {
-        PyObject* segment = Py_BuildValue("iO", count, format);
-        PyList_Append(segmentList, segment);
+        Py_DECREF(segment);
+        return false;
     }
+
+    Py_DECREF(segment);
+    return true;
 }
 
 static void
-Context_appendTextType(size_t fromIndex, size_t count, PyObject* textTypeMap, Py_UNICODE textType)
+Context_appendTextType(size_t fromIndex, size_t count, char* textTypeMap, Py_UNICODE textType)
 {
-    size_t i;
-    for (i = fromIndex; i < fromIndex + count; i++)
-        PyUnicode_WriteChar(textTypeMap, i, textType);
+    memset(textTypeMap + fromIndex, (char)textType, count);
 }
 
 
 static size_t
 Context_parseBlock(Context* self,
                    size_t currentColumnIndex,
-                   PyObject* unicodeText,
+                   size_t untilColumnIndex,
+                   TextToMatchObject_internal* pTextToMatchObject,
                    PyObject* segmentList,
-                   PyObject* textTypeMap,
+                   char* textTypeMap,
                    ContextStack** pContextStack,
                    bool* pLineContinue)
 {
     size_t startColumnIndex = currentColumnIndex;
-    size_t wholeLineLen;
     size_t countOfNotMatchedSymbols = 0;
+    _RuleProfileItem* ruleProfile = NULL;
 
-    TextToMatchObject_internal textToMatchObject =
-                    TextToMatchObject_internal_make(currentColumnIndex,
-                                                    unicodeText,
-                                                    ContextStack_currentData(*pContextStack));
+    if (_ruleProfilingEnabled)
+    {
+        if (NULL == self->ruleProfile)
+            self->ruleProfile = PyMem_Calloc(self->flatRulesSize + 1, sizeof(_RuleProfileItem));
+        ruleProfile = self->ruleProfile;  // NULL, if failed to allocate
+    }
 
-    wholeLineLen = PyUnicode_GET_SIZE(textToMatchObject.wholeLineUnicodeText);
+    pTextToMatchObject->contextData = ContextStack_currentData(*pContextStack);
 
     *pLineContinue = false;
 
-    while (currentColumnIndex < wholeLineLen)
+    while (currentColumnIndex < untilColumnIndex)
     {
         size_t i;
+        size_t ruleIndex = 0;
+        Py_UCS4 currentChar;
+        _RuleIndexes* candidateRules;
         RuleTryMatchResult_internal result;
 
         Parser* parentParser = (Parser*)self->parser;
-        TextToMatchObject_internal_update(&textToMatchObject, currentColumnIndex, &parentParser->deliminatorSet);
+        TextToMatchObject_internal_update(pTextToMatchObject, currentColumnIndex, &parentParser->deliminatorSet);
+
+        currentChar = pTextToMatchObject->unicodeText[0];
+        if (currentChar < QUTEPART_DISPATCH_TABLE_SIZE)
+            candidateRules = &self->dispatchTable[currentChar];
+        else
+            candidateRules = &self->nonAsciiRules;
 
         result.rule = NULL;
 
-        for (i = 0; i < self->rulesSize; i++)
+        for (i = 0; i < candidateRules->size; i++)
         {
-            result = AbstractRule_tryMatch_internal((AbstractRule*)self->rulesC[i], &textToMatchObject);
+            ruleIndex = candidateRules->indexes[i];
+            if (NULL == ruleProfile)
+            {
+                result = AbstractRule_tryMatch_internal((AbstractRule*)self->flatRulesC[ruleIndex], pTextToMatchObject);
+            }
+            else
+            {
+                double startTime = _profilerTime();
+                result = AbstractRule_tryMatch_internal((AbstractRule*)self->flatRulesC[ruleIndex], pTextToMatchObject);
+                // the rule might release the GIL. Other thread might reset the profile meanwhile
+                if (ruleProfile == self->ruleProfile)
+                {
+                    ruleProfile[ruleIndex].time += _profilerTime() - startTime;
+                    ruleProfile[ruleIndex].attempts++;
+                    if (NULL != result.rule)
+                        ruleProfile[ruleIndex].successes++;
+                }
+                else
+                {
+                    ruleProfile = NULL;  // don't profile the rest of the block
+                }
+            }
 
             if (NULL != result.rule)
                 break;
@@ -2815,12 +3523,16 @@ Context_parseBlock(Context* self,
             {
                 fprintf(stderr, "qutepart: \t");
                 PyObject_Print(self->name, stderr, 0);
-                fprintf(stderr, ": matched rule %zu at %zu\n", i, currentColumnIndex);
+                fprintf(stderr, ": matched rule %zu at %zu\n", ruleIndex, currentColumnIndex);
             }
 
             if (countOfNotMatchedSymbols > 0)
             {
-                Context_appendSegment(segmentList, countOfNotMatchedSymbols, self->format);
+                if (!Context_appendSegment(segmentList, countOfNotMatchedSymbols, self->format))
+                {
+                    RuleTryMatchResult_internal_free(&result);
+                    break; // while. Error is set
+                }
                 Context_appendTextType(currentColumnIndex - countOfNotMatchedSymbols, countOfNotMatchedSymbols,
                                        textTypeMap, self->textType);
                 countOfNotMatchedSymbols = 0;
@@ -2836,9 +3548,13 @@ Context_parseBlock(Context* self,
             else
                 textType = self->textType;
 
-            Context_appendSegment(segmentList,
-                                  result.length,
-                                  format);
+            if (!Context_appendSegment(segmentList,
+                                       result.length,
+                                       format))
+            {
+                RuleTryMatchResult_internal_free(&result);
+                break; // while. Error is set
+            }
             Context_appendTextType(currentColumnIndex, result.length,
                                    textTypeMap,
                                    textType);
@@ -2853,12 +3569,18 @@ Context_parseBlock(Context* self,
 
                 RuleTryMatchResult_internal_free(&result);
 
+                if (NULL == newContextStack)
+                    break; // while. Error is set
+
                 if (newContextStack != *pContextStack)
                 {
-                    ASSIGN_VALUE(ContextStack, *pContextStack, newContextStack);
+                    Py_DECREF(*pContextStack);
+                    *pContextStack = newContextStack;
                     break; // while
                 }
-                else if (0 == result.length)
+
+                Py_DECREF(newContextStack);
+                if (0 == result.length)
                 {
                     // Parsed didn't switch context or consume character. The same situation will occur on next step
                     fprintf(stderr, "qutepart: loop detected\n");
@@ -2876,11 +3598,16 @@ Context_parseBlock(Context* self,
                         ContextSwitcher_getNextContextStack(self->fallthroughContext,
                                                             *pContextStack,
                                                             NULL);
+                if (NULL == newContextStack)
+                    break; // while. Error is set
+
                 if (newContextStack != *pContextStack)
                 {
-                    ASSIGN_VALUE(ContextStack, *pContextStack, newContextStack);
+                    Py_DECREF(*pContextStack);
+                    *pContextStack = newContextStack;
                     break; // while
                 }
+                Py_DECREF(newContextStack);
             }
 
             countOfNotMatchedSymbols++;
@@ -2889,17 +3616,15 @@ Context_parseBlock(Context* self,
 
     }
 
-    if (countOfNotMatchedSymbols > 0)
+    if (countOfNotMatchedSymbols > 0 && !PyErr_Occurred())
     {
-        Context_appendSegment(segmentList, countOfNotMatchedSymbols, self->format);
+        Context_appendSegment(segmentList, countOfNotMatchedSymbols, self->format);  // error is checked by the caller
         Context_appendTextType(currentColumnIndex - countOfNotMatchedSymbols, countOfNotMatchedSymbols,
                                textTypeMap, self->textType);
 
         countOfNotMatchedSymbols = 0;
     }
 
-    TextToMatchObject_internal_free(&textToMatchObject);
-
     return currentColumnIndex - startColumnIndex;
 }
 
@@ -2912,6 +3637,7 @@ static PyMemberDef Parser_members[] = {
     {"syntax", T_OBJECT_EX, offsetof(Parser, syntax), READONLY, "Parent Syntax object"},
     {"defaultContext", T_OBJECT_EX, offsetof(Parser, defaultContext), READONLY, "Default context"},
     {"lists", T_OBJECT_EX, offsetof(Parser, lists), READONLY, "Dictionary of lists of keywords"},
+    {"keywordsCaseSensitive", T_BOOL, offsetof(Parser, keywordsCaseSensitive), READONLY, "Keywords are case sensitive"},
     {"deliminatorSet", T_OBJECT_EX, offsetof(Parser, deliminatorSet.setAsUnicodeString), READONLY,
                 "Set of deliminator characters (as string)"},
     {NULL}
@@ -2960,9 +3686,7 @@ Parser_init(Parser *self, PyObject *args, PyObject *kwds)
 static ContextStack*
 _makeDefaultContextStack(Context* defaultContext)
 {
-    _RegExpMatchGroups* data = NULL;
-
-    return ContextStack_new(&defaultContext, &data, 1);
+    return ContextStack_make(NULL, defaultContext, NULL);
 }
 
 
@@ -2982,7 +3706,10 @@ Parser_setConexts(Parser *self, PyObject *args)
     ASSIGN_PYOBJECT_FIELD(contexts);
     ASSIGN_FIELD(Context, defaultContext);
 
+    Py_XDECREF(self->defaultContextStack);
     self->defaultContextStack = _makeDefaultContextStack(self->defaultContext);
+    if (NULL == self->defaultContextStack)
+        return NULL;
 
     Py_RETURN_NONE;
 }
@@ -2997,54 +3724,126 @@ Parser_contextStackEqualToDefault(Context* defaultContext, ContextStack* context
 }
 
 
+// Lines of a single not code text type share a map of one run, which ends after any column.
+// See _WHOLE_LINE_TEXT_TYPE_MAPS in parser.py. Made on first use
+#define QUTEPART_WHOLE_LINE_RUN_END (PY_SSIZE_T_MAX >> 8)
+static PyObject* _wholeLineTextTypeMaps[256] = {NULL};
+
+// Append runs of text types of columns [fromColumnIndex, toColumnIndex) to the list of runs.
+// Run is (runEnd << 8) | textType. Adjacent runs of the same type are merged
+static bool
+_appendTextTypeRuns(PyObject* textTypeRuns, const char* textTypes, size_t fromColumnIndex, size_t toColumnIndex)
+{
+    size_t i;
+
+    for (i = fromColumnIndex; i < toColumnIndex; i++)
+    {
+        if (i + 1 == toColumnIndex || textTypes[i] != textTypes[i + 1])
+        {
+            Py_ssize_t runsCount = PyList_GET_SIZE(textTypeRuns);
+            PyObject* run = PyLong_FromSize_t(((i + 1) << 8) | (unsigned char)textTypes[i]);
+            if (NULL == run)
+                return false;
+
+            if (runsCount > 0 &&
+                (PyLong_AsSize_t(PyList_GET_ITEM(textTypeRuns, runsCount - 1)) & 0xff) == (unsigned char)textTypes[i])
+            {
+                PyList_SetItem(textTypeRuns, runsCount - 1, run);  // steals the reference
+            }
+            else
+            {
+                int res = PyList_Append(textTypeRuns, run);
+                Py_DECREF(run);
+                if (0 != res)
+                    return false;
+            }
+        }
+    }
+
+    return true;
+}
+
+// Make text type map of the line from the list of runs. See Syntax._getTextType()
+// Returns new reference
 static PyObject*
-Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
+_makeTextTypeMap(PyObject* textTypeRuns)
 {
-    PyObject* unicodeText = NULL;
-    ContextStack* prevContextStack = NULL;
-    Context* currentContext;
-    PyObject* segmentList = NULL;
-    bool lineContinue = false;
-    size_t currentColumnIndex = 0;
-    size_t textLen;
+    Py_ssize_t runsCount = PyList_GET_SIZE(textTypeRuns);
+    Py_ssize_t i;
     PyObject* textTypeMap;
-    ContextStack* contextStack;
 
-    if (! PyArg_ParseTuple(args, "|OO",
-                           &unicodeText,
-                           &prevContextStack))
-        return NULL;
+    if (1 == runsCount &&
+        (PyLong_AsSize_t(PyList_GET_ITEM(textTypeRuns, 0)) & 0xff) != ' ')  // whole line is of one type
+    {
+        size_t textType = PyLong_AsSize_t(PyList_GET_ITEM(textTypeRuns, 0)) & 0xff;
 
-    UNICODE_CHECK(unicodeText, NULL);
-    if (Py_None != (PyObject*)(prevContextStack))
-        TYPE_CHECK(prevContextStack, ContextStack, NULL);
+        if (NULL == _wholeLineTextTypeMaps[textType])
+        {
+            PyObject* run = PyLong_FromSsize_t((QUTEPART_WHOLE_LINE_RUN_END << 8) | (Py_ssize_t)textType);
+            if (NULL == run)
+                return NULL;
+
+            _wholeLineTextTypeMaps[textType] = PyTuple_Pack(1, run);
+            Py_DECREF(run);
+            if (NULL == _wholeLineTextTypeMaps[textType])
+                return NULL;
+        }
 
-    if (Py_None != (PyObject*)prevContextStack)
-        contextStack = prevContextStack;
-    else
-        contextStack = self->defaultContextStack;
+        textTypeMap = _wholeLineTextTypeMaps[textType];
+        Py_INCREF(textTypeMap);
+        return textTypeMap;
+    }
 
-    Py_INCREF(contextStack);
+    if (runsCount > 0 &&
+        (PyLong_AsSize_t(PyList_GET_ITEM(textTypeRuns, runsCount - 1)) & 0xff) == ' ')
+        runsCount--;  // trailing code is not stored
 
-    currentContext = ContextStack_currentContext(contextStack);
+    textTypeMap = PyTuple_New(runsCount);
+    if (NULL == textTypeMap)
+        return NULL;
 
-    segmentList = NULL;
-    if (returnSegments)
+    for (i = 0; i < runsCount; i++)
     {
-        segmentList = PyList_New(0);
+        PyObject* run = PyList_GET_ITEM(textTypeRuns, i);
+        Py_INCREF(run);
+        PyTuple_SET_ITEM(textTypeMap, i, run);
     }
-    else
+
+    return textTypeMap;
+}
+
+// Parse text from *pCurrentColumnIndex until untilColumnIndex or a bit further, if a rule matches across it.
+// pTextToMatchObject is made once for the line and is shared by all contexts and parts, which parse it. Column only grows.
+// Appends segments to segmentList (if not None) and text type runs to textTypeRuns.
+// Switches line end contexts when reached end of the line
+// Returns false on error
+static bool
+Parser_parseBlockPart_internal(Parser* self,
+                               TextToMatchObject_internal* pTextToMatchObject,
+                               size_t* pCurrentColumnIndex,
+                               size_t untilColumnIndex,
+                               ContextStack** pContextStack,
+                               PyObject* segmentList,
+                               PyObject* textTypeRuns)
+{
+    Context* currentContext = ContextStack_currentContext(*pContextStack);
+    bool lineContinue = false;
+    size_t startColumnIndex = *pCurrentColumnIndex;
+    size_t currentColumnIndex = startColumnIndex;
+    size_t textLen = pTextToMatchObject->wholeLineLen;
+    char* textTypeMap;
+    bool ok;
+
+    // Indexed by column. Only the parsed part is written and read
+    textTypeMap = PyMem_Malloc(textLen + 1);
+    if (NULL == textTypeMap)
     {
-        segmentList = Py_None;
-        Py_INCREF(Py_None);
+        PyErr_NoMemory();
+        return false;
     }
+    memset(textTypeMap + startColumnIndex, ' ', untilColumnIndex - startColumnIndex);
 
-    textLen = PyUnicode_GET_SIZE(unicodeText);
-    textTypeMap = PyUnicode_New(textLen, 65535);
-    if (textLen > 0)
-        PyUnicode_Fill(textTypeMap, 0, textLen, ' ');
-
-    while (currentColumnIndex < textLen)
+    while (currentColumnIndex < untilColumnIndex)
     {
         size_t length;
 
@@ -3057,77 +3856,173 @@ Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
 
         length = Context_parseBlock( currentContext,
                                      currentColumnIndex,
-                                     unicodeText,
+                                     untilColumnIndex,
+                                     pTextToMatchObject,
                                      segmentList,
                                      textTypeMap,
-                                     &contextStack,
+                                     pContextStack,
                                      &lineContinue);
         currentColumnIndex += length;
-        currentContext = ContextStack_currentContext(contextStack);
+        currentContext = ContextStack_currentContext(*pContextStack);
+
+        if (PyErr_Occurred())
+            break;
     }
 
-    if ( ! lineContinue)
+    if (currentColumnIndex >= textLen && ( ! lineContinue) && ( ! PyErr_Occurred()))
     {
         while (currentContext->lineEndContext != Py_None)
         {
             ContextStack* newContextStack =
                            ContextSwitcher_getNextContextStack((ContextSwitcher*)currentContext->lineEndContext,
-                                                               contextStack,
+                                                               *pContextStack,
                                                                NULL);
-            ASSIGN_VALUE(ContextStack, contextStack, newContextStack);
+            if (NULL == newContextStack)
+                break;
+
+            Py_DECREF(*pContextStack);
+            *pContextStack = newContextStack;
 
-            if (currentContext == ContextStack_currentContext(contextStack))
+            if (currentContext == ContextStack_currentContext(*pContextStack))
             {
                 // current context not changed.
                 // probably, ContextSwitcher_getNextContextStack failed to switch context because max context stack depth reached
                 // break for avoid infinite loop
                 break;
             }
-            currentContext = ContextStack_currentContext(contextStack);
+            currentContext = ContextStack_currentContext(*pContextStack);
         }
 
         // this code is not tested, because lineBeginContext is not defined by any xml file
-        if (currentContext->lineBeginContext != Py_None)
+        if (currentContext->lineBeginContext != Py_None && ( ! PyErr_Occurred()))
         {
             ContextStack* newContextStack =
                            ContextSwitcher_getNextContextStack((ContextSwitcher*)currentContext->lineBeginContext,
-                                                               contextStack,
+                                                               *pContextStack,
                                                                NULL);
-            ASSIGN_VALUE(ContextStack, contextStack, newContextStack);
+            if (NULL != newContextStack)
+            {
+                Py_DECREF(*pContextStack);
+                *pContextStack = newContextStack;
 
-            currentContext = ContextStack_currentContext(contextStack);
+                currentContext = ContextStack_currentContext(*pContextStack);
+            }
         }
     }
 
-    if (PyErr_Occurred())
+    ok = ( ! PyErr_Occurred()) &&
+         _appendTextTypeRuns(textTypeRuns, textTypeMap, startColumnIndex, currentColumnIndex);
+    PyMem_Free(textTypeMap);
+    pTextToMatchObject->contextData = NULL;  // borrowed from the context stack
+
+    *pCurrentColumnIndex = currentColumnIndex;
+    return ok;
+}
+
+// Make line data (contextStack, textTypeMap). Steals reference to contextStack
+static PyObject*
+Parser_makeLineData(Parser* self, ContextStack* contextStack, PyObject* textTypeRuns)
+{
+    PyObject* retStack;
+    PyObject* textTypeMap = _makeTextTypeMap(textTypeRuns);
+
+    if (NULL == textTypeMap)
     {
         Py_DECREF(contextStack);
-        Py_DECREF(textTypeMap);
         return NULL;
     }
+
+    if ( ! Parser_contextStackEqualToDefault(self->defaultContext, contextStack))
+    {
+        retStack = (PyObject*)contextStack;
+    }
     else
     {
-        PyObject* retStack = NULL;
-        PyObject* retContextData;
+        retStack = Py_None;
+        Py_INCREF(retStack);
+        Py_DECREF(contextStack);
+    }
 
-        if ( ! Parser_contextStackEqualToDefault(self->defaultContext, contextStack))
-        {
-            retStack = (PyObject*)contextStack;
-        }
-        else
-        {
-            retStack = Py_None;
-            Py_INCREF(retStack);
-            Py_DECREF(contextStack);
-        }
+    return Py_BuildValue("NN", retStack, textTypeMap);
+}
 
-        retContextData = Py_BuildValue("OO", retStack, textTypeMap);
+static ContextStack*
+Parser_getContextStack(Parser* self, PyObject* prevContextStack)
+{
+    if (Py_None == prevContextStack)
+        return self->defaultContextStack;
 
-        if (Py_None != segmentList)
-            return Py_BuildValue("OO", retContextData, segmentList);
-        else
-            return retContextData;
+    TYPE_CHECK(prevContextStack, ContextStack, NULL);
+    return (ContextStack*)prevContextStack;
+}
+
+static PyObject*
+Parser_parseBlock_internal(Parser *self, PyObject *args, bool returnSegments)
+{
+    PyObject* unicodeText = NULL;
+    PyObject* prevContextStack = NULL;
+    PyObject* segmentList = NULL;
+    PyObject* textTypeRuns = NULL;
+    PyObject* lineData = NULL;
+    ContextStack* contextStack;
+    TextToMatchObject_internal textToMatchObject;
+    size_t currentColumnIndex = 0;
+    int releaseGil = 0;
+
+    if (! PyArg_ParseTuple(args, "|OOp",
+                           &unicodeText,
+                           &prevContextStack,
+                           &releaseGil))
+        return NULL;
+
+    UNICODE_CHECK(unicodeText, NULL);
+    contextStack = Parser_getContextStack(self, prevContextStack);
+    if (NULL == contextStack)
+        return NULL;
+
+    Py_INCREF(contextStack);
+
+    if (returnSegments)
+    {
+        segmentList = PyList_New(0);
+    }
+    else
+    {
+        segmentList = Py_None;
+        Py_INCREF(Py_None);
+    }
+
+    textTypeRuns = PyList_New(0);
+    textToMatchObject = TextToMatchObject_internal_make(0, unicodeText, NULL);
+    textToMatchObject.releaseGil = releaseGil;
+
+    if (NULL != segmentList && NULL != textTypeRuns &&
+        Parser_parseBlockPart_internal(self, &textToMatchObject,
+                                       &currentColumnIndex, PyUnicode_GET_SIZE(unicodeText),
+                                       &contextStack, segmentList, textTypeRuns))
+    {
+        lineData = Parser_makeLineData(self, contextStack, textTypeRuns);
     }
+    else
+    {
+        Py_DECREF(contextStack);
+    }
+
+    TextToMatchObject_internal_free(&textToMatchObject);
+
+    Py_XDECREF(textTypeRuns);
+
+    if (NULL == lineData)
+    {
+        Py_XDECREF(segmentList);
+        return NULL;
+    }
+
+    if (returnSegments)
+        return Py_BuildValue("NN", lineData, segmentList);
+
+    Py_DECREF(segmentList);
+    return lineData;
 }
 
 
@@ -3143,11 +4038,111 @@ Parser_highlightBlock(Parser *self, PyObject *args)
     return Parser_parseBlock_internal(self, args, true);
 }
 
+static PyObject*
+Parser_highlightBlockPart(Parser *self, PyObject *args)
+{
+    PyObject* unicodeText = NULL;
+    PyObject* prevContextStack = NULL;
+    PyObject* partialLineState = NULL;
+    Py_ssize_t maxLength = 0;
+    PyObject* segmentList = NULL;
+    PyObject* textTypeRuns = NULL;
+    ContextStack* contextStack;
+    TextToMatchObject* textToMatchObject;
+    Py_ssize_t columnIndex = 0;
+    size_t currentColumnIndex;
+    size_t untilColumnIndex;
+    size_t textLen;
+    PyObject* result = NULL;
+    int releaseGil = 0;
+
+    if (! PyArg_ParseTuple(args, "|OOOnp",
+                           &unicodeText,
+                           &prevContextStack,
+                           &partialLineState,
+                           &maxLength,
+                           &releaseGil))
+        return NULL;
+
+    UNICODE_CHECK(unicodeText, NULL);
+
+    if (Py_None == partialLineState)
+    {
+        contextStack = Parser_getContextStack(self, prevContextStack);
+        if (NULL == contextStack)
+            return NULL;
+        textTypeRuns = PyList_New(0);
+        if (NULL == textTypeRuns)
+            return NULL;
+        textToMatchObject = TextToMatchObject_make(unicodeText);
+        if (NULL == textToMatchObject)
+        {
+            Py_DECREF(textTypeRuns);
+            return NULL;
+        }
+    }
+    else
+    {
+        // the state keeps the text to match, therefore the line is not converted again for every part
+        if (! PyArg_ParseTuple(partialLineState, "nO!O!O!",
+                               &columnIndex,
+                               &ContextStackType, &contextStack,
+                               &PyList_Type, &textTypeRuns,
+                               &TextToMatchObjectType, &textToMatchObject))
+            return NULL;
+        Py_INCREF(textTypeRuns);
+        Py_INCREF(textToMatchObject);
+    }
+
+    Py_INCREF(contextStack);
+    textToMatchObject->internal.releaseGil = releaseGil;
+
+    textLen = textToMatchObject->internal.wholeLineLen;
+    currentColumnIndex = columnIndex;
+    untilColumnIndex = currentColumnIndex + (maxLength > 0 ? maxLength : 1);
+    if (untilColumnIndex > textLen)
+        untilColumnIndex = textLen;
+
+    segmentList = PyList_New(0);
+
+    if (NULL != segmentList &&
+        Parser_parseBlockPart_internal(self, &textToMatchObject->internal,
+                                       &currentColumnIndex, untilColumnIndex,
+                                       &contextStack, segmentList, textTypeRuns))
+    {
+        if (currentColumnIndex >= textLen)
+        {
+            PyObject* lineData = Parser_makeLineData(self, contextStack, textTypeRuns);
+            if (NULL != lineData)
+                result = Py_BuildValue("NOO", lineData, Py_None, segmentList);
+        }
+        else
+        {
+            result = Py_BuildValue("O(nNOO)O", Py_None,
+                                   (Py_ssize_t)currentColumnIndex, contextStack, textTypeRuns, textToMatchObject,
+                                   segmentList);
+        }
+    }
+    else
+    {
+        Py_DECREF(contextStack);
+    }
+
+    Py_XDECREF(segmentList);
+    Py_DECREF(textTypeRuns);
+    Py_DECREF(textToMatchObject);
+    return result;
+}
+
 static PyMethodDef Parser_methods[] = {
     {"setContexts", (PyCFunction)Parser_setConexts, METH_VARARGS,  "Set list of parser contexts"},
     {"parseBlock", (PyCFunction)Parser_parseBlock, METH_VARARGS,  "Parse line of text and return line data"},
     {"highlightBlock", (PyCFunction)Parser_highlightBlock, METH_VARARGS,
-            "Parse line of text and return line data and highlighted segments"},
+            "Parse line of text and return line data and highlighted segments. "
+            "Optional releaseGil argument releases the GIL while matching reg exps"},
+    {"highlightBlockPart", (PyCFunction)Parser_highlightBlockPart, METH_VARARGS,
+            "Parse part of long line of text. Return line data or partial line state and highlighted segments. "
+            "Optional releaseGil argument releases the GIL while matching reg exps"},
     {NULL}  /* Sentinel */
 };
 
@@ -3160,6 +4155,10 @@ DECLARE_TYPE_WITH_MEMBERS(Parser, Parser_methods, "Parser");
 
 
 static PyMethodDef cParser_methods[] = {
+    {"dynamicRuleCacheInfo", (PyCFunction)cParser_dynamicRuleCacheInfo, METH_NOARGS,
+            "Get (hits, misses) of the cache of dynamic rules substitutions"},
+    {"setRuleProfilingEnabled", (PyCFunction)cParser_setRuleProfilingEnabled, METH_VARARGS,
+            "Enable or disable collecting of rule match statistics"},
     {NULL}  /* Sentinel */
 };
 
@@ -1,6 +1,8 @@
 """Default color theme
 """
 
+import copy
+
 class ColorTheme:
     """Color theme.
     """
@@ -50,3 +52,12 @@ class ColorTheme:
         """Returns TextFormat for particular style
         """
         return self.format[styleName]
+
+    def styleFormat(self, style):
+        """Returns TextFormat for highlighting style. See qutepart.syntax.Style
+        """
+        format = copy.copy(self.format[style.defaultStyleName])
+        for name, value in style.attributes:
+            setattr(format, name, value)
+        format.textType = style.textType
+        return format
@@ -1,85 +1,180 @@
 #!/usr/bin/env python3
+"""Regenerate syntax_db.json from the XML definitions
 
-import os.path
-import json
+Only the <language> element of every XML file is parsed. Headers are cached in the manifest
+syntax_db_manifest.json together with a hash of every XML file, therefore only changed files are
+parsed again. Changed files are parsed in a process pool.
+
+Usage: regenerate-definitions-db.py [--full] [--check] [--jobs N]
+"""
 
+import argparse
+import concurrent.futures
+import hashlib
+import json
+import os
+import os.path
 import sys
+import xml.etree.ElementTree
 
 _MY_PATH = os.path.abspath(os.path.dirname(__file__))
 sys.path.insert(0, os.path.join(_MY_PATH, '..', '..', '..'))
 
 
-from qutepart.syntax.loader import loadSyntax
-from qutepart.syntax import SyntaxManager, Syntax
+from qutepart.syntax.loader import _loadSyntaxDescription
+from qutepart.syntax import Syntax
+
+
+_DB_FILE_NAME = 'syntax_db.json'
+_MANIFEST_FILE_NAME = 'syntax_db_manifest.json'
+_MANIFEST_VERSION = 1
 
 
 def _add_php(targetFileName, srcFileName):
     os.system("./generate-php.pl > xml/{} < xml/{}".format(targetFileName, srcFileName))
 
 
+def _fileHash(filePath):
+    with open(filePath, 'rb') as file:
+        return hashlib.sha1(file.read()).hexdigest()
+
+
+def _readHeader(xmlFilePath):
+    """Parse only the <language> element of the XML file.
+    Returns dictionary with the attributes, which are used by the database
+    """
+    for event, root in xml.etree.ElementTree.iterparse(xmlFilePath, events=('start',)):
+        break  # the rest of the file is not parsed
+
+    syntax = Syntax(None)
+    _loadSyntaxDescription(root, syntax)
+    return {'name': syntax.name,
+            'priority': syntax.priority,
+            'extensions': syntax.extensions,
+            'mimetype': syntax.mimetype,
+            'firstLineGlobs': syntax.firstLineGlobs}
+
+
+def _loadManifest():
+    """Returns {xmlFileName: {'hash': hash, 'header': header}}.
+    Empty dictionary, if manifest doesn't exist or is not compatible
+    """
+    try:
+        with open(_MANIFEST_FILE_NAME, encoding='utf-8') as manifestFile:
+            manifest = json.load(manifestFile)
+    except (OSError, ValueError):
+        return {}
+
+    if manifest.get('version') != _MANIFEST_VERSION:
+        return {}
+    return manifest['files']
+
+
+def _readHeaders(xmlFilesPath, xmlFileNames, manifest, jobs):
+    """Read headers of XML files. Files, which hash is in the manifest, are not parsed.
+    Returns (new manifest, list of parsed file names)
+    """
+    hashes = {xmlFileName: _fileHash(os.path.join(xmlFilesPath, xmlFileName)) \
+                    for xmlFileName in xmlFileNames}
+    changed = [xmlFileName for xmlFileName in xmlFileNames \
+                    if xmlFileName not in manifest or manifest[xmlFileName]['hash'] != hashes[xmlFileName]]
+
+    changedPaths = [os.path.join(xmlFilesPath, xmlFileName) for xmlFileName in changed]
+    if jobs > 1 and len(changed) > 1:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=jobs) as executor:
+            headers = list(executor.map(_readHeader, changedPaths, chunksize=8))
+    else:
+        headers = [_readHeader(path) for path in changedPaths]
+
+    newManifest = {xmlFileName: manifest[xmlFileName] for xmlFileName in xmlFileNames \
+                        if xmlFileName not in changed}
+    for xmlFileName, header in zip(changed, headers):
+        newManifest[xmlFileName] = {'hash': hashes[xmlFileName], 'header': header}
+
+    return newManifest, changed
+
+
+def _makeDb(manifest, previousDb):
+    """Make the database from the headers.
+    If priorities are equal, the file from previousDb wins, then the first file in the name order.
+    Therefore the result doesn't depend on order of files in the directory
+    """
+    result = {'syntaxNameToXmlFileName': {},
+              'mimeTypeToXmlFileName': {},
+              'extensionToXmlFileName': {},
+              'firstLineToXmlFileName': {}}
+
+    def add(tableName, key, priority, xmlFileName):
+        dictionary = result[tableName]
+        wasThere = previousDb.get(tableName, {}).get(key) == xmlFileName
+        if key not in dictionary or \
+           dictionary[key][0] < (priority, wasThere):
+            dictionary[key] = ((priority, wasThere), xmlFileName)
+
+    for xmlFileName in sorted(manifest):
+        header = manifest[xmlFileName]['header']
+        priority = header['priority']
+        add('syntaxNameToXmlFileName', header['name'], priority, xmlFileName)
+        for mimetype in header['mimetype']:
+            add('mimeTypeToXmlFileName', mimetype, priority, xmlFileName)
+        for extension in header['extensions']:
+            add('extensionToXmlFileName', extension, priority, xmlFileName)
+        for glob in header['firstLineGlobs']:
+            add('firstLineToXmlFileName', glob, priority, xmlFileName)
+
+    # remove priority, leave only xml file names
+    for dictionary in result.values():
+        for key, item in dictionary.items():
+            dictionary[key] = item[1]
+
+    # Fix up php first line pattern. It contains <?php, but it is generated from html, and html doesn't contain it
+    result['firstLineToXmlFileName']['<?php*'] = 'html-php.xml'
+
+    return result
+
+
+def _dumpJson(data, filePath):
+    with open(filePath, 'w', encoding='utf-8') as jsonFile:
+        json.dump(data, jsonFile, sort_keys=True, indent=4)
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Regenerate ' + _DB_FILE_NAME)
+    parser.add_argument('--full', action='store_true', help='ignore the manifest and parse all files')
+    parser.add_argument('--check', action='store_true',
+                        help='do not write anything, exit with code 1 if {} is not up to date'.format(_DB_FILE_NAME))
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help='count of worker processes')
+    args = parser.parse_args()
+
     os.chdir(_MY_PATH)
-    _add_php('javascript-php.xml', 'javascript.xml')
-    _add_php('css-php.xml', 'css.xml')
-    _add_php('html-php.xml', 'html.xml')
+    if not args.check:
+        _add_php('javascript-php.xml', 'javascript.xml')
+        _add_php('css-php.xml', 'css.xml')
+        _add_php('html-php.xml', 'html.xml')
 
     xmlFilesPath = os.path.join(_MY_PATH, 'xml')
-    xmlFileNames = [fileName for fileName in os.listdir(xmlFilesPath) \
-                        if fileName.endswith('.xml')]
-
-    syntaxNameToXmlFileName = {}
-    mimeTypeToXmlFileName = {}
-    extensionToXmlFileName = {}
-    firstLineToXmlFileName = {}
-
-    for xmlFileName in xmlFileNames:
-        xmlFilePath = os.path.join(xmlFilesPath, xmlFileName)
-        syntax = Syntax(None)
-        loadSyntax(syntax, xmlFilePath)
-        if not syntax.name in syntaxNameToXmlFileName or \
-           syntaxNameToXmlFileName[syntax.name][0] < syntax.priority:
-            syntaxNameToXmlFileName[syntax.name] = (syntax.priority, xmlFileName)
-
-        if syntax.mimetype:
-            for mimetype in syntax.mimetype:
-                if not mimetype in mimeTypeToXmlFileName or \
-                   mimeTypeToXmlFileName[mimetype][0] < syntax.priority:
-                    mimeTypeToXmlFileName[mimetype] = (syntax.priority, xmlFileName)
-
-        if syntax.extensions:
-            for extension in syntax.extensions:
-                if extension not in extensionToXmlFileName or \
-                   extensionToXmlFileName[extension][0] < syntax.priority:
-                    extensionToXmlFileName[extension] = (syntax.priority, xmlFileName)
-
-        if syntax.firstLineGlobs:
-            for glob in syntax.firstLineGlobs:
-                if not glob in firstLineToXmlFileName or \
-                   firstLineToXmlFileName[glob][0] < syntax.priority:
-                    firstLineToXmlFileName[glob] = (syntax.priority, xmlFileName)
+    xmlFileNames = sorted(fileName for fileName in os.listdir(xmlFilesPath) \
+                            if fileName.endswith('.xml'))
 
-    # remove priority, leave only xml file names
-    for dictionary in (syntaxNameToXmlFileName,
-                       mimeTypeToXmlFileName,
-                       extensionToXmlFileName,
-                       firstLineToXmlFileName):
-        newDictionary = {}
-        for key, item in dictionary.items():
-            newDictionary[key] = item[1]
-        dictionary.clear()
-        dictionary.update(newDictionary)
+    manifest = {} if args.full else _loadManifest()
+    manifest, changed = _readHeaders(xmlFilesPath, xmlFileNames, manifest, args.jobs)
+    print('{} of {} definitions parsed'.format(len(changed), len(xmlFileNames)))
 
-    # Fix up php first line pattern. It contains <?php, but it is generated from html, and html doesn't contain it
-    firstLineToXmlFileName['<?php*'] = 'html-php.xml'
+    try:
+        with open(_DB_FILE_NAME, encoding='utf-8') as syntaxDbFile:
+            previousDb = json.load(syntaxDbFile)
+    except (OSError, ValueError):
+        previousDb = {}
+
+    result = _makeDb(manifest, previousDb)
 
-    result = {}
-    result['syntaxNameToXmlFileName'] = syntaxNameToXmlFileName
-    result['mimeTypeToXmlFileName'] = mimeTypeToXmlFileName
-    result['extensionToXmlFileName'] = extensionToXmlFileName
-    result['firstLineToXmlFileName'] = firstLineToXmlFileName
+    if args.check:
+        upToDate = previousDb == result
+        print('{} is {}'.format(_DB_FILE_NAME, 'up to date' if upToDate else 'out of date'))
+        sys.exit(0 if upToDate else 1)
 
-    with open('syntax_db.json', 'w', encoding='utf-8') as syntaxDbFile:
-        json.dump(result, syntaxDbFile, sort_keys=True, indent=4)
+    _dumpJson(result, _DB_FILE_NAME)
+    _dumpJson({'version': _MANIFEST_VERSION, 'files': manifest}, _MANIFEST_FILE_NAME)
 
     print('Done. Do not forget to commit the changes')
 
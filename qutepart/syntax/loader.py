@@ -1,14 +1,23 @@
 """This module is a set of functions, which load Parser from Kate XML files
 """
 
-import copy
+import marshal
+import os
 import sys
-import xml.etree.ElementTree
+import threading
 import re
 import logging
+import shutil
+import warnings
+import zlib
 
-from qutepart.syntax.colortheme import ColorTheme
-from qutepart.syntax import TextFormat
+try:
+    from re import _parser as _sreParse  # Python 3.11+
+except ImportError:
+    import sre_parse as _sreParse
+
+from qutepart.syntax import Style, NO_STYLE, styleIndex, defaultColorTheme
+import qutepart.version
 
 _logger = logging.getLogger('qutepart')
 
@@ -21,6 +30,187 @@ except ImportError:
     binaryParserAvailable = False
 
 
+def dynamicRuleCacheInfo():
+    """Get (hits, misses) of the parser cache of dynamic StringDetect and RegExpr rules substitutions
+    """
+    return _parserModule.dynamicRuleCacheInfo()
+
+
+_ruleProfilingEnabled = False
+
+
+def setRuleProfilingEnabled(enabled):
+    """Enable or disable collecting of rule match attempts, successes and time. See Syntax.ruleProfile()
+    Highlighting is much slower, while profiling is enabled.
+    Rule descriptions are made only for syntaxes, which are loaded while profiling is enabled
+    """
+    global _ruleProfilingEnabled
+    _ruleProfilingEnabled = bool(enabled)
+    _parserModule.setRuleProfilingEnabled(enabled)
+
+
+################################################################################
+##                               Syntax cache
+################################################################################
+# Parsed XML tree and precomputed dispatch data are saved to the cache directory.
+# Parser objects are constructed from the cached data, it is much quicker than parsing XML
+# and calculating first characters of rules.
+# Cache file is used only if it has been created for the same XML file modification time and size,
+# the same qutepart and Python versions, the same cache format version and optimizeRules value
+
+_CACHE_FORMAT_VERSION = 2
+
+
+def _defaultCacheDirectory():
+    if sys.platform.startswith('win'):
+        baseDir = os.environ.get('LOCALAPPDATA', os.path.expanduser('~'))
+    elif sys.platform == 'darwin':
+        baseDir = os.path.expanduser('~/Library/Caches')
+    else:
+        baseDir = os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache'))
+    return os.path.join(baseDir, 'qutepart', 'syntax')
+
+"""Directory, where loaded syntaxes are cached. Set to None to disable the cache
+"""
+cacheDirectory = _defaultCacheDirectory()
+
+_cacheHits = 0
+_cacheMisses = 0
+
+
+def syntaxCacheInfo():
+    """Get (hits, misses) of the on-disk syntax cache
+    """
+    return _cacheHits, _cacheMisses
+
+
+class _CachedElement:
+    """XML element, restored from the cache.
+    Implements the part of xml.etree.ElementTree.Element API, which is used by the loader
+    """
+    __slots__ = ('tag', 'attrib', 'text', '_children')
+
+    def __init__(self, data):
+        self.tag, self.attrib, self.text, children = data
+        self._children = [_CachedElement(child) for child in children]
+
+    def __iter__(self):
+        return iter(self._children)
+
+    def __len__(self):
+        return len(self._children)
+
+    def get(self, key, default=None):
+        return self.attrib.get(key, default)
+
+    def getchildren(self):
+        return self._children
+
+    def find(self, tag):
+        for child in self._children:
+            if child.tag == tag:
+                return child
+        return None
+
+    def findall(self, tag):
+        return [child for child in self._children if child.tag == tag]
+
+
+def _elementData(element):
+    """Convert XML element to data, which can be saved with marshal.
+    Whitespace between elements is not saved
+    """
+    text = element.text
+    if text is not None and len(element) and not text.strip():
+        text = None
+    return (element.tag, dict(element.attrib), text,
+            [_elementData(child) for child in element])
+
+
+# Cache subdirectory name is qutepart version, cache format version and Python version
+_cacheVersionTagRegExp = re.compile(r'^([\d.]+-\d+)-py\d+\.\d+$')
+
+
+def _cacheVersionPrefix():
+    return '%s-%d' % ('.'.join(str(part) for part in qutepart.version.VERSION), _CACHE_FORMAT_VERSION)
+
+
+def _cacheFilePath(filePath):
+    versionTag = '%s-py%d.%d' % (_cacheVersionPrefix(), sys.version_info[0], sys.version_info[1])
+    dirHash = '%08x' % zlib.crc32(os.path.dirname(filePath).encode('utf-8', 'surrogateescape'))
+    return os.path.join(cacheDirectory, versionTag,
+                        '%s-%s.cache' % (os.path.basename(filePath), dirHash))
+
+
+def _cacheKey(filePath):
+    stat = os.stat(filePath)
+    return (_CACHE_FORMAT_VERSION, optimizeRules, os.path.abspath(filePath), stat.st_mtime_ns, stat.st_size)
+
+
+def _readCache(filePath):
+    """Read cached data for the XML file.
+    Returns None, if the cache is disabled, missing or outdated
+    """
+    global _cacheHits, _cacheMisses
+
+    if cacheDirectory is None:
+        return None
+
+    try:
+        key = _cacheKey(filePath)
+        with open(_cacheFilePath(filePath), 'rb') as cacheFile:
+            cachedKey, data = marshal.loads(cacheFile.read())  # much quicker than marshal.load(cacheFile)
+    except (OSError, EOFError, ValueError, TypeError):
+        _cacheMisses += 1
+        return None
+
+    if cachedKey != key:
+        _cacheMisses += 1
+        return None
+
+    _cacheHits += 1
+    return data
+
+
+def _removeOldCacheDirectories():
+    """Remove cache subdirectories of other qutepart versions and cache format versions.
+    Subdirectories of other Python versions are kept, they are used by other interpreters
+    """
+    try:
+        names = os.listdir(cacheDirectory)
+    except OSError:
+        return
+
+    currentPrefix = _cacheVersionPrefix()
+    for name in names:
+        match = _cacheVersionTagRegExp.match(name)
+        if match is not None and match.group(1) != currentPrefix:
+            _logger.debug('Removing outdated syntax cache %s', name)
+            shutil.rmtree(os.path.join(cacheDirectory, name), ignore_errors=True)
+
+
+def _writeCache(filePath, key, data):
+    """Save data for the XML file to the cache. Errors are logged and ignored
+    Outdated cache subdirectories are removed, when the subdirectory for this version is created
+    """
+    cacheFilePath = _cacheFilePath(filePath)
+    tmpFilePath = '%s.%d.tmp' % (cacheFilePath, os.getpid())
+    try:
+        versionDirPath = os.path.dirname(cacheFilePath)
+        if not os.path.isdir(versionDirPath):
+            os.makedirs(versionDirPath, exist_ok=True)
+            _removeOldCacheDirectories()
+        with open(tmpFilePath, 'wb') as cacheFile:
+            cacheFile.write(marshal.dumps((key, data)))
+        os.replace(tmpFilePath, cacheFilePath)  # atomic, other processes never read partially written file
+    except OSError as ex:
+        _logger.debug('Failed to save syntax cache %s: %s', cacheFilePath, ex)
+        try:
+            os.remove(tmpFilePath)
+        except OSError:
+            pass
+
+
 _seqReplacer = re.compile('\\\\.')
 
 _escapeSequences = \
@@ -99,7 +289,7 @@ def _safeGetRequiredAttribute(xmlElement, name, default):
         return default
 
 
-def _getContext(contextName, parser, formatConverterFunction, defaultValue):
+def _getContext(contextName, parser, defaultValue):
     if not contextName:
         return defaultValue
     if contextName in parser.contexts:
@@ -107,21 +297,21 @@ def _getContext(contextName, parser, formatConverterFunction, defaultValue):
     elif contextName.startswith('##') and \
          parser.syntax.manager is not None:  # might be None, if loader is used by regenerate-definitions-db.py
         syntaxName = contextName[2:]
-        parser = parser.syntax.manager.getSyntax(formatConverterFunction, languageName = syntaxName).parser
+        parser = parser.syntax.manager.getSyntax(languageName = syntaxName).parser
         return parser.defaultContext
     elif (not contextName.startswith('##')) and \
          '##' in contextName and \
          contextName.count('##') == 1 and \
          parser.syntax.manager is not None:  # might be None, if loader is used by regenerate-definitions-db.py
         name, syntaxName = contextName.split('##')
-        parser = parser.syntax.manager.getSyntax(formatConverterFunction, languageName = syntaxName).parser
+        parser = parser.syntax.manager.getSyntax(languageName = syntaxName).parser
         return parser.contexts[name]
     else:
         _logger.warning('Invalid context name %s', repr(contextName))
         return parser.defaultContext
 
 
-def _makeContextSwitcher(contextOperation, parser, formatConverterFunction):
+def _makeContextSwitcher(contextOperation, parser):
     popsCount = 0
     contextToSwitch = None
 
@@ -134,7 +324,7 @@ def _makeContextSwitcher(contextOperation, parser, formatConverterFunction):
         if popsCount:
             _logger.warning("Invalid context operation '%s'", contextOperation)
     else:
-        contextToSwitch = _getContext(rest, parser, formatConverterFunction, None)
+        contextToSwitch = _getContext(rest, parser, None)
 
     if popsCount > 0 or contextToSwitch != None:
         return _parserModule.ContextSwitcher(popsCount, contextToSwitch, contextOperation)
@@ -146,58 +336,72 @@ def _makeContextSwitcher(contextOperation, parser, formatConverterFunction):
 ##                               Rules
 ################################################################################
 
-def _loadIncludeRules(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadIncludeRules(parentContext, xmlElement, attributeToStyleMap):
     contextName = _safeGetRequiredAttribute(xmlElement, "context", None)
 
-    context = _getContext(contextName, parentContext.parser, formatConverterFunction, parentContext.parser.defaultContext)
+    context = _getContext(contextName, parentContext.parser, parentContext.parser.defaultContext)
 
     abstractRuleParams = _loadAbstractRuleParams(parentContext,
                                                  xmlElement,
-                                                 attributeToFormatMap,
-                                                 formatConverterFunction)
+                                                 attributeToStyleMap)
     return _parserModule.IncludeRules(abstractRuleParams, context)
 
 def _simpleLoader(classObject):
-    def _load(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+    def _load(parentContext, xmlElement, attributeToStyleMap):
         abstractRuleParams = _loadAbstractRuleParams(parentContext,
                                                      xmlElement,
-                                                     attributeToFormatMap,
-                                                     formatConverterFunction)
+                                                     attributeToStyleMap)
         return classObject(abstractRuleParams)
     return _load
 
-def _loadChildRules(context, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadChildRules(context, xmlElement, attributeToStyleMap):
     """Extract rules from Context or Rule xml element
     """
+    return _loadRuleElements(context, xmlElement.getchildren(), attributeToStyleMap)
+
+def _ruleDescription(ruleElement):
+    """Short description of the rule for reports, i.e. 'RegExpr(\\w+)'
+    """
+    attrib = ruleElement.attrib
+    if 'String' in attrib:
+        value = attrib['String']
+    elif 'char' in attrib:
+        value = attrib['char'] + attrib.get('char1', '')
+    else:
+        value = attrib.get('context', '')
+    return '%s(%s)' % (ruleElement.tag, value)
+
+def _loadRuleElements(context, ruleElements, attributeToStyleMap):
+    """Create rules from list of rule xml elements
+    """
     rules = []
-    for ruleElement in xmlElement.getchildren():
+    for ruleElement in ruleElements:
         if not ruleElement.tag in _ruleClassDict:
             raise ValueError("Not supported rule '%s'" % ruleElement.tag)
-        rule = _ruleClassDict[ruleElement.tag](context, ruleElement, attributeToFormatMap, formatConverterFunction)
+        rule = _ruleClassDict[ruleElement.tag](context, ruleElement, attributeToStyleMap)
         rules.append(rule)
     return rules
 
-def _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap):
     # attribute
     attribute = xmlElement.attrib.get("attribute", None)
     if attribute is not None:
         attribute = attribute.lower()  # not case sensitive
         try:
-            format = attributeToFormatMap[attribute]
-            textType = format.textType if format is not None else ' '
-            if formatConverterFunction is not None and format is not None:
-                format = formatConverterFunction(format)
+            style = attributeToStyleMap[attribute]
+            format = styleIndex(style)
+            textType = style.textType
         except KeyError:
             _logger.warning('Unknown rule attribute %s', attribute)
             format = parentContext.format
             textType = parentContext.textType
     else:
-        format = None
+        format = NO_STYLE
         textType = None
 
     # context
     contextText = xmlElement.attrib.get("context", '#stay')
-    context = _makeContextSwitcher(contextText, parentContext.parser, formatConverterFunction)
+    context = _makeContextSwitcher(contextText, parentContext.parser)
 
     lookAhead = _parseBoolAttribute(xmlElement.attrib.get("lookAhead", "false"))
     firstNonSpace = _parseBoolAttribute(xmlElement.attrib.get("firstNonSpace", "false"))
@@ -214,8 +418,8 @@ def _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, for
 
     return _parserModule.AbstractRuleParams(parentContext, format, textType, attribute, context, lookAhead, firstNonSpace, dynamic, column)
 
-def _loadDetectChar(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+def _loadDetectChar(parentContext, xmlElement, attributeToStyleMap):
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
 
     char = _safeGetRequiredAttribute(xmlElement, "char", None)
     if char is not None:
@@ -235,7 +439,7 @@ def _loadDetectChar(parentContext, xmlElement, attributeToFormatMap, formatConve
 
     return _parserModule.DetectChar(abstractRuleParams, str(char), index)
 
-def _loadDetect2Chars(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadDetect2Chars(parentContext, xmlElement, attributeToStyleMap):
     char = _safeGetRequiredAttribute(xmlElement, 'char', None)
     char1 = _safeGetRequiredAttribute(xmlElement, 'char1', None)
     if char is None or char1 is None:
@@ -243,30 +447,30 @@ def _loadDetect2Chars(parentContext, xmlElement, attributeToFormatMap, formatCon
     else:
         string = _processEscapeSequences(char) + _processEscapeSequences(char1)
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.Detect2Chars(abstractRuleParams, string)
 
-def _loadAnyChar(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadAnyChar(parentContext, xmlElement, attributeToStyleMap):
     string = _safeGetRequiredAttribute(xmlElement, 'String', '')
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.AnyChar(abstractRuleParams, string)
 
-def _loadStringDetect(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadStringDetect(parentContext, xmlElement, attributeToStyleMap):
     string = _safeGetRequiredAttribute(xmlElement, 'String', None)
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.StringDetect(abstractRuleParams,
                                       string)
 
-def _loadWordDetect(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadWordDetect(parentContext, xmlElement, attributeToStyleMap):
     word = _safeGetRequiredAttribute(xmlElement, "String", "")
     insensitive = _parseBoolAttribute(xmlElement.attrib.get("insensitive", "false"))
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
 
     return _parserModule.WordDetect(abstractRuleParams, word, insensitive)
 
-def _loadKeyword(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadKeyword(parentContext, xmlElement, attributeToStyleMap):
     string = _safeGetRequiredAttribute(xmlElement, 'String', None)
     try:
         words = parentContext.parser.lists[string]
@@ -277,22 +481,22 @@ def _loadKeyword(parentContext, xmlElement, attributeToFormatMap, formatConverte
 
     insensitive = _parseBoolAttribute(xmlElement.attrib.get("insensitive", "false"))
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.keyword(abstractRuleParams, words, insensitive)
 
-def _loadRegExpr(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
-    def _processCraracterCodes(text):
-        """QRegExp use \0ddd notation for character codes, where d in octal digit
-        i.e. \0377 is character with code 255 in the unicode table
-        Convert such notation to unicode text
-        """
-        text = str(text)
-        def replFunc(matchObj):
-            matchText = matchObj.group(0)
-            charCode = eval('0o' + matchText[2:])
-            return chr(charCode)
-        return re.sub(r"\\0\d\d\d", replFunc, text)
-
+def _processCraracterCodes(text):
+    """QRegExp use \0ddd notation for character codes, where d in octal digit
+    i.e. \0377 is character with code 255 in the unicode table
+    Convert such notation to unicode text
+    """
+    text = str(text)
+    def replFunc(matchObj):
+        matchText = matchObj.group(0)
+        charCode = eval('0o' + matchText[2:])
+        return chr(charCode)
+    return re.sub(r"\\0\d\d\d", replFunc, text)
+
+def _loadRegExpr(parentContext, xmlElement, attributeToStyleMap):
     insensitive = _parseBoolAttribute(xmlElement.attrib.get('insensitive', 'false'))
     string = _safeGetRequiredAttribute(xmlElement, 'String', None)
 
@@ -310,29 +514,29 @@ def _loadRegExpr(parentContext, xmlElement, attributeToFormatMap, formatConverte
         wordStart = False
         lineStart = False
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.RegExpr(abstractRuleParams,
                                  string, insensitive, wordStart, lineStart)
 
 def _loadAbstractNumberRule(rule, parentContext, xmlElement):
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.NumberRule(abstractRuleParams, childRules)
 
-def _loadInt(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
-    childRules = _loadChildRules(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+def _loadInt(parentContext, xmlElement, attributeToStyleMap):
+    childRules = _loadChildRules(parentContext, xmlElement, attributeToStyleMap)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.Int(abstractRuleParams, childRules)
 
-def _loadFloat(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
-    childRules = _loadChildRules(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+def _loadFloat(parentContext, xmlElement, attributeToStyleMap):
+    childRules = _loadChildRules(parentContext, xmlElement, attributeToStyleMap)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.Float(abstractRuleParams, childRules)
 
-def _loadRangeDetect(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction):
+def _loadRangeDetect(parentContext, xmlElement, attributeToStyleMap):
     char = _safeGetRequiredAttribute(xmlElement, "char", 'char is not set')
     char1 = _safeGetRequiredAttribute(xmlElement, "char1", 'char1 is not set')
 
-    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToFormatMap, formatConverterFunction)
+    abstractRuleParams = _loadAbstractRuleParams(parentContext, xmlElement, attributeToStyleMap)
     return _parserModule.RangeDetect(abstractRuleParams, char, char1)
 
 
@@ -358,12 +562,472 @@ _ruleClassDict = \
     'DetectIdentifier': _simpleLoader(_parserModule.DetectIdentifier)
 }
 
+################################################################################
+##                               Rule optimizer
+################################################################################
+# Rule XML elements are rewritten to cheaper equivalent rules before the rules are created:
+#   RegExpr, which matches a literal string or a character set -> StringDetect, DetectChar or AnyChar
+#   keyword with a list of one word -> WordDetect
+#   consecutive DetectChar rules, which differ only in the character -> AnyChar
+# Rewritten rules match exactly the same text as the original rules with both Python and C parser.
+# Therefore only ASCII strings are rewritten (C DetectChar and StringDetect compare UTF-8 bytes),
+# and RegExpr is not rewritten, if it switches to a dynamic context, which receives the matched groups.
+# Rule order is not changed
+
+"""Rewrite rules to cheaper equivalent rules when loading
+"""
+optimizeRules = True
+
+_DETECT_CHAR_MERGE_IGNORED_ATTRIBUTES = ('char', )
+
+
+def _isOptimizableString(chars, insensitive):
+    """Rule, which matches chars, may be replaced with a rule, which doesn't support non-ASCII and case insensitivity
+    """
+    return len(chars) > 0 and \
+           all(0 < ord(char) < 128 for char in chars) and \
+           ((not insensitive) or all(char.lower() == char.upper() for char in chars))
+
+def _regExpLiteral(items):
+    """Characters of literal string, which parsed reg exp matches. None, if it is not a literal
+    """
+    chars = []
+    for opcode, value in items:
+        if opcode is _sreParse.LITERAL:
+            chars.append(chr(value))
+        elif opcode is _sreParse.SUBPATTERN:
+            group, addFlags, delFlags, subPattern = value
+            if addFlags or delFlags:
+                return None
+            subPatternChars = _regExpLiteral(subPattern)
+            if subPatternChars is None:
+                return None
+            chars += subPatternChars
+        else:
+            return None
+    return chars
+
+def _regExpCharSet(items):
+    """Characters, one of which parsed reg exp matches. None, if it is not a single character set
+    """
+    if len(items) != 1:
+        return None
+
+    opcode, value = items[0]
+    if opcode is _sreParse.SUBPATTERN:
+        group, addFlags, delFlags, subPattern = value
+        if addFlags or delFlags:
+            return None
+        return _regExpCharSet(subPattern)
+    elif opcode is not _sreParse.IN:
+        return None
+
+    chars = []
+    for setOpcode, setValue in value:
+        if setOpcode is _sreParse.LITERAL:
+            chars.append(chr(setValue))
+        elif setOpcode is _sreParse.RANGE and setValue[1] < 128:
+            low, high = setValue
+            chars += [chr(code) for code in range(low, high + 1)]
+        else:  # NEGATE, CATEGORY or non-ASCII range
+            return None
+
+    return sorted(set(chars))
+
+def _switchesToStaticContext(ruleElement, staticContextNames):
+    """Rule doesn't push a dynamic context, which would receive reg exp match groups
+    """
+    contextOperation = ruleElement.attrib.get('context', '#stay')
+    while contextOperation.startswith('#pop'):
+        contextOperation = contextOperation[len('#pop'):]
+    return contextOperation in ('', '#stay') or \
+           contextOperation in staticContextNames
+
+def _optimizeRegExpr(ruleElement, staticContextNames):
+    """Returns (tag, attributes) of equivalent rule or None.
+    Rules with child rules are not rewritten, the children would be lost
+    """
+    attrib = ruleElement.attrib
+    string = attrib.get('String', None)
+    if string is None or \
+       len(ruleElement) or \
+       _parseBoolAttribute(attrib.get('dynamic', 'false')) or \
+       not _switchesToStaticContext(ruleElement, staticContextNames):
+        return None
+
+    string = _processCraracterCodes(string)
+    if '[:' in string or \
+       re.search(r'\\[0-9A-Za-z]', string) is not None:  # escapes, which differ in Python re and PCRE
+        return None
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            items = _sreParse.parse(string)
+    except (re.error, AssertionError):
+        return None
+
+    flags = (items.state if hasattr(items, 'state') else items.pattern).flags  # attribute renamed in Python 3.8
+    if flags & ~re.UNICODE:
+        return None
+
+    insensitive = _parseBoolAttribute(attrib.get('insensitive', 'false'))
+    newAttrib = {key: value for key, value in attrib.items() \
+                    if key not in ('String', 'insensitive', 'minimal', 'dynamic')}
+
+    literal = _regExpLiteral(items)
+    if literal is not None and _isOptimizableString(literal, insensitive):
+        if len(literal) == 1:
+            newAttrib['char'] = literal[0].replace('\\', '\\\\')  # see _processEscapeSequences()
+            return 'DetectChar', newAttrib
+        else:
+            newAttrib['String'] = ''.join(literal)
+            return 'StringDetect', newAttrib
+
+    charSet = _regExpCharSet(items)
+    if charSet is not None and _isOptimizableString(charSet, insensitive):
+        newAttrib['String'] = ''.join(charSet)
+        return 'AnyChar', newAttrib
+
+    return None
+
+def _optimizeKeyword(ruleElement, parser):
+    """Returns (tag, attributes) of equivalent rule or None.
+    Rules with child rules are not rewritten, the children would be lost
+    """
+    words = set(parser.lists.get(ruleElement.attrib.get('String', None), []))
+    if len(ruleElement) or \
+       len(words) != 1:
+        return None
+
+    word = words.pop()
+    if not _isOptimizableString(word, False):  # case of ASCII words is handled by both rules in the same way
+        return None
+
+    newAttrib = dict(ruleElement.attrib)
+    newAttrib['String'] = word
+    return 'WordDetect', newAttrib
+
+def _detectCharToMerge(ruleElement):
+    """Returns (character, other attributes) of DetectChar rule, which can be merged with others to AnyChar,
+    or None
+    """
+    if ruleElement.tag != 'DetectChar' or \
+       len(ruleElement) or \
+       _parseBoolAttribute(ruleElement.attrib.get('dynamic', 'false')):
+        return None
+
+    char = _processEscapeSequences(ruleElement.attrib.get('char', ''))
+    if len(char) != 1 or not _isOptimizableString(char, False):
+        return None
+
+    otherAttributes = sorted((key, value) for key, value in ruleElement.attrib.items() \
+                                if key not in _DETECT_CHAR_MERGE_IGNORED_ATTRIBUTES)
+    return char, otherAttributes
+
+def _optimizeRules(ruleElements, parser, staticContextNames):
+    """Rewrite list of rule XML elements. Returns new list
+    """
+    result = []
+    for ruleElement in ruleElements:
+        rewritten = None
+        if ruleElement.tag == 'RegExpr':
+            rewritten = _optimizeRegExpr(ruleElement, staticContextNames)
+        elif ruleElement.tag == 'keyword':
+            rewritten = _optimizeKeyword(ruleElement, parser)
+
+        if rewritten is not None:
+            tag, attrib = rewritten
+            ruleElement = _CachedElement((tag, attrib, None, []))
+        result.append(ruleElement)
+
+    # merge consecutive DetectChar rules. Rules are not moved, therefore the order is preserved
+    merged = []
+    previousChars = None
+    for ruleElement in result:
+        detectChar = _detectCharToMerge(ruleElement)
+        if detectChar is not None and \
+           previousChars is not None and \
+           previousChars[1] == detectChar[1]:
+            chars = previousChars[0] + detectChar[0]
+            attrib = dict(detectChar[1])
+            attrib['String'] = chars
+            merged[-1] = _CachedElement(('AnyChar', attrib, None, []))
+            previousChars = (chars, detectChar[1])
+        else:
+            merged.append(ruleElement)
+            previousChars = detectChar
+
+    return merged
+
+################################################################################
+##                               Rule dispatch table
+################################################################################
+# Characters, on which a rule may start to match, are described with a tuple
+#   (set of ASCII characters, may start with a non-ASCII character)
+
+_ASCII_CHARS = frozenset(chr(code) for code in range(128))
+_ANY_CHAR = (_ASCII_CHARS, True)
+
+_ASCII_DIGITS = frozenset('0123456789')
+_ASCII_SPACES = frozenset(char for char in _ASCII_CHARS if char.isspace())
+_ASCII_LETTERS = frozenset(char for char in _ASCII_CHARS if char.isalpha())
+
+_STATIC_RULE_FIRST_CHARS = \
+{
+    'Int': (_ASCII_DIGITS, True),
+    'Float': (_ASCII_DIGITS | frozenset('.eE'), True),
+    'HlCOct': (frozenset('0'), False),
+    'HlCHex': (frozenset('0'), False),
+    'HlCStringChar': (frozenset('\\'), False),
+    'HlCChar': (frozenset("'"), False),
+    'LineContinue': (frozenset('\\'), False),
+    'DetectSpaces': (_ASCII_SPACES, True),
+    'DetectIdentifier': (_ASCII_LETTERS, True),
+}
+
+_REG_EXP_CATEGORY_FIRST_CHARS = \
+{
+    _sreParse.CATEGORY_DIGIT: _ASCII_DIGITS,
+    _sreParse.CATEGORY_SPACE: _ASCII_SPACES,
+    _sreParse.CATEGORY_WORD: _ASCII_LETTERS | _ASCII_DIGITS | frozenset('_'),
+}
+
+_REG_EXP_REPEAT_OPCODES = (_sreParse.MAX_REPEAT,
+                           _sreParse.MIN_REPEAT,
+                           getattr(_sreParse, 'POSSESSIVE_REPEAT', None))
+
+def _makeFirstChars(chars, insensitive=False):
+    """Make first characters description from characters
+    """
+    asciiChars = set()
+    nonAscii = insensitive  # i.e. KELVIN SIGN matches 'k' if case is ignored
+    for char in chars:
+        if char in _ASCII_CHARS:
+            asciiChars.add(char)
+            if insensitive:
+                asciiChars.update((char.lower(), char.upper()))
+        elif insensitive:
+            return _ANY_CHAR  # non-ASCII character might match ASCII character
+        else:
+            nonAscii = True
+
+    return frozenset(asciiChars), nonAscii
+
+def _regExpSetFirstChars(items):
+    """Characters, matched by [...] item of parsed regular expression.
+    Returns (chars, nonAscii, nullable) or None if unknown
+    """
+    chars = set()
+    nonAscii = False
+    negate = False
+    for opcode, value in items:
+        if opcode is _sreParse.NEGATE:
+            negate = True
+        elif opcode is _sreParse.LITERAL:
+            if value < 128:
+                chars.add(chr(value))
+            else:
+                nonAscii = True
+        elif opcode is _sreParse.RANGE:
+            low, high = value
+            chars.update(chr(code) for code in range(low, min(high, 127) + 1))
+            if high >= 128:
+                nonAscii = True
+        elif opcode is _sreParse.CATEGORY and \
+             value in _REG_EXP_CATEGORY_FIRST_CHARS and \
+             not negate:  # Python and PCRE categories differ a little. Can't invert it
+            chars.update(_REG_EXP_CATEGORY_FIRST_CHARS[value])
+            nonAscii = True
+        else:
+            return None
+
+    if negate:
+        return _ASCII_CHARS - chars, True, False
+    else:
+        return chars, nonAscii, False
+
+def _regExpItemFirstChars(opcode, value):
+    """Characters, on which item of parsed regular expression may start to match.
+    Returns (chars, nonAscii, nullable) or None if unknown
+    """
+    if opcode is _sreParse.LITERAL:
+        if value < 128:
+            return set(chr(value)), False, False
+        else:
+            return set(), True, False
+    elif opcode is _sreParse.IN:
+        return _regExpSetFirstChars(value)
+    elif opcode is _sreParse.BRANCH:
+        chars = set()
+        nonAscii = False
+        nullable = False
+        for alternative in value[1]:
+            res = _regExpSequenceFirstChars(alternative)
+            if res is None:
+                return None
+            chars.update(res[0])
+            nonAscii = nonAscii or res[1]
+            nullable = nullable or res[2]
+        return chars, nonAscii, nullable
+    elif opcode is _sreParse.SUBPATTERN:
+        group, addFlags, delFlags, subPattern = value
+        if addFlags or delFlags:
+            return None
+        return _regExpSequenceFirstChars(subPattern)
+    elif opcode in _REG_EXP_REPEAT_OPCODES:
+        minCount, maxCount, subPattern = value
+        if maxCount == 0:
+            return set(), False, True
+        res = _regExpSequenceFirstChars(subPattern)
+        if res is None:
+            return None
+        chars, nonAscii, nullable = res
+        return chars, nonAscii, nullable or minCount == 0
+    elif opcode in (_sreParse.AT, _sreParse.ASSERT, _sreParse.ASSERT_NOT):  # zero-width
+        return set(), False, True
+    else:
+        return None
+
+def _regExpSequenceFirstChars(items):
+    """Characters, on which sequence of parsed regular expression items may start to match.
+    Returns (chars, nonAscii, nullable) or None if unknown
+    """
+    chars = set()
+    nonAscii = False
+    for opcode, value in items:
+        res = _regExpItemFirstChars(opcode, value)
+        if res is None:
+            return None
+        chars.update(res[0])
+        nonAscii = nonAscii or res[1]
+        if not res[2]:
+            return chars, nonAscii, False
+
+    return chars, nonAscii, True
+
+def _regExpFirstChars(string, insensitive):
+    """Characters, on which regular expression may start to match.
+    The same description is used for Python re and PCRE patterns, therefore it is conservative
+    """
+    if '[:' in string:  # POSIX character class. Supported by PCRE, but not by Python
+        return _ANY_CHAR
+
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            items = _sreParse.parse(string)
+    except (re.error, AssertionError):
+        return _ANY_CHAR
+
+    flags = (items.state if hasattr(items, 'state') else items.pattern).flags  # attribute renamed in Python 3.8
+
+    res = _regExpSequenceFirstChars(items)
+    if res is None or res[2]:  # unknown or may match empty string
+        return _ANY_CHAR
+
+    chars, nonAscii, nullable = res
+    asciiChars, nonAsciiForCase = _makeFirstChars(chars, insensitive or bool(flags & re.IGNORECASE))
+    return asciiChars, nonAscii or nonAsciiForCase
+
+def _ruleFirstChars(xmlElement, parser):
+    """Characters, on which rule, loaded from xmlElement, may start to match
+    """
+    tag = xmlElement.tag
+    if tag in _STATIC_RULE_FIRST_CHARS:
+        return _STATIC_RULE_FIRST_CHARS[tag]
+
+    dynamic = _parseBoolAttribute(xmlElement.attrib.get('dynamic', 'false'))
+    insensitive = _parseBoolAttribute(xmlElement.attrib.get('insensitive', 'false'))
+
+    if tag in ('DetectChar', 'Detect2Chars'):
+        char = xmlElement.attrib.get('char', None)
+        if dynamic or not char:
+            return _ANY_CHAR
+        return _makeFirstChars(_processEscapeSequences(char)[0])
+    elif tag == 'RangeDetect':
+        char = xmlElement.attrib.get('char', None)
+        if not char:
+            return _ANY_CHAR
+        return _makeFirstChars(char[0])
+    elif tag == 'AnyChar':
+        return _makeFirstChars(xmlElement.attrib.get('String', ''))
+    elif tag == 'StringDetect':
+        string = xmlElement.attrib.get('String', None)
+        if dynamic or not string:
+            return _ANY_CHAR
+        return _makeFirstChars(string[0])
+    elif tag == 'WordDetect':
+        word = xmlElement.attrib.get('String', None)
+        if not word:
+            return _ANY_CHAR
+        return _makeFirstChars(word[0], insensitive or not parser.keywordsCaseSensitive)
+    elif tag == 'keyword':
+        words = parser.lists.get(xmlElement.attrib.get('String', None), [])
+        return _makeFirstChars([word[0] for word in words if word],
+                               insensitive or not parser.keywordsCaseSensitive)
+    elif tag == 'RegExpr':
+        string = xmlElement.attrib.get('String', None)
+        if dynamic or string is None:
+            return _ANY_CHAR
+        return _regExpFirstChars(_processCraracterCodes(string), insensitive)
+    else:  # IncludeRules
+        return _ANY_CHAR
+
+def _dispatchTableFirstChars(context):
+    """Restore first characters of context.flatRules from the dispatch table of the context
+    """
+    if context.dispatchTable is None:
+        return [_ANY_CHAR for rule in context.flatRules]
+
+    asciiTable, nonAsciiIndexes = context.dispatchTable
+    asciiChars = [set() for rule in context.flatRules]
+    for code, indexes in enumerate(asciiTable):
+        for index in indexes:
+            asciiChars[index].add(chr(code))
+
+    nonAsciiIndexes = set(nonAsciiIndexes)
+    return [(frozenset(chars), index in nonAsciiIndexes) \
+                for index, chars in enumerate(asciiChars)]
+
+def _makeDispatchTable(rulesFirstChars):
+    """Make table "first character": "indexes of rules, which may match text, started with the character".
+    Rule order is preserved.
+    Returns (ASCII table, indexes for non-ASCII characters) where ASCII table is a tuple of
+    128 tuples of indexes, one for each character code
+    """
+    indexesForCode = [[] for code in range(128)]
+    nonAsciiIndexes = []
+    for index, (asciiChars, nonAscii) in enumerate(rulesFirstChars):
+        for char in asciiChars:
+            indexesForCode[ord(char)].append(index)
+        if nonAscii:
+            nonAsciiIndexes.append(index)
+
+    uniqueIndexes = {}
+    def _unique(indexes):
+        indexes = tuple(indexes)
+        return uniqueIndexes.setdefault(indexes, indexes)
+
+    return tuple([_unique(indexes) for indexes in indexesForCode]), _unique(nonAsciiIndexes)
+
+
 ################################################################################
 ##                               Context
 ################################################################################
 
 
-def _loadContexts(highlightingElement, parser, attributeToFormatMap, formatConverterFunction):
+"""Load a context only when the parser enters it first time, or when it is included by a loaded context.
+Memory usage and loading time are proportional to the language features, which are actually used.
+Not loaded contexts in parser.contexts have loader attribute set
+"""
+lazyContextLoading = False
+
+
+def _loadContexts(highlightingElement, parser, attributeToStyleMap, cachedData):
+    """Load contexts. Dispatch data is taken from cachedData, if it is valid.
+    Returns _ContextLoader
+    """
     contextsElement = highlightingElement.find('contexts')
 
     xmlElementList = contextsElement.findall('context')
@@ -383,49 +1047,238 @@ def _loadContexts(highlightingElement, parser, attributeToFormatMap, formatConve
 
     parser.setContexts(contextDict, defaultContext)
 
-    # parse contexts stage 2: load contexts
-    for xmlElement, context in zip(xmlElementList, contextList):
-        _loadContext(context, xmlElement, attributeToFormatMap, formatConverterFunction)
+    contextLoader = _ContextLoader(parser, contextList, xmlElementList,
+                                   attributeToStyleMap, cachedData)
+    if lazyContextLoading:
+        for context in contextList:
+            context.setLoader(contextLoader.load)
+        contextLoader.load(defaultContext)
+    else:
+        contextLoader.loadAll()
+
+    return contextLoader
 
 
-def _loadContext(context, xmlElement, attributeToFormatMap, formatConverterFunction):
-    """Construct context from XML element
+def _loadContext(context, xmlElement, ruleElements, attributeToStyleMap):
+    """Construct context from XML element and rule XML elements of the context
     Contexts are at first constructed, and only then loaded, because when loading context,
     _makeContextSwitcher must have references to all defined contexts
+    Returns values, passed to context.setValues()
     """
     attribute = _safeGetRequiredAttribute(xmlElement, 'attribute', '<not set>').lower()
     if attribute != '<not set>':  # there are no attributes for internal contexts, used by rules. See perl.xml
         try:
-            format = attributeToFormatMap[attribute]
+            style = attributeToStyleMap[attribute]
         except KeyError:
             _logger.warning('Unknown context attribute %s', attribute)
-            format = TextFormat()
+            style = Style('dsNormal', (), ' ')
+        format = styleIndex(style)
+        textType = style.textType
     else:
-        format = None
-
-    textType = format.textType if format is not None else ' '
-    if formatConverterFunction is not None and format is not None:
-        format = formatConverterFunction(format)
+        format = NO_STYLE
+        textType = ' '
 
     lineEndContextText = xmlElement.attrib.get('lineEndContext', '#stay')
-    lineEndContext = _makeContextSwitcher(lineEndContextText,  context.parser, formatConverterFunction)
+    lineEndContext = _makeContextSwitcher(lineEndContextText,  context.parser)
     lineBeginContextText = xmlElement.attrib.get('lineEndContext', '#stay')
-    lineBeginContext = _makeContextSwitcher(lineBeginContextText, context.parser, formatConverterFunction)
+    lineBeginContext = _makeContextSwitcher(lineBeginContextText, context.parser)
 
     if _parseBoolAttribute(xmlElement.attrib.get('fallthrough', 'false')):
         fallthroughContextText = _safeGetRequiredAttribute(xmlElement, 'fallthroughContext', '#stay')
-        fallthroughContext = _makeContextSwitcher(fallthroughContextText, context.parser, formatConverterFunction)
+        fallthroughContext = _makeContextSwitcher(fallthroughContextText, context.parser)
     else:
         fallthroughContext = None
 
     dynamic = _parseBoolAttribute(xmlElement.attrib.get('dynamic', 'false'))
 
-    context.setValues(attribute, format, lineEndContext, lineBeginContext, fallthroughContext, dynamic, textType)
+    values = (attribute, format, lineEndContext, lineBeginContext, fallthroughContext, dynamic, textType)
+    context.setValues(*values)
 
     # load rules
-    rules = _loadChildRules(context, xmlElement, attributeToFormatMap, formatConverterFunction)
+    rules = _loadRuleElements(context, ruleElements, attributeToStyleMap)
     context.setRules(rules)
 
+    return values
+
+class _ContextLoader:
+    """Loads values and rules of contexts of a parser, expands IncludeRules of the contexts
+    to flat rule lists and makes dispatch tables.
+
+    Rules of included context are inserted instead of IncludeRules. Rules, which are already in the list, are skipped.
+    Including context, which is being expanded, is ignored, so include cycles are broken.
+    includeAttrib="true" replaces attribute of the including context with attribute of the included context
+
+    First characters of rules and dispatch tables are taken from the cached data, if available.
+    Cached dispatch table is used only if the flat rule list is the same, as when it was created.
+    """
+    def __init__(self, parser, contextList, xmlElementList, attributeToStyleMap, cachedData):
+        self._parser = parser
+        self._contextList = contextList
+        self._xmlElementList = xmlElementList
+        self._attributeToStyleMap = attributeToStyleMap
+
+        if cachedData is not None:
+            self._rulesFirstChars, self._cachedDispatchTables = cachedData
+        else:
+            self._rulesFirstChars = [None for context in contextList]
+            self._cachedDispatchTables = [None for context in contextList]
+        self._dispatchTables = [None for context in contextList]
+        self._ruleElementLists = [None for context in contextList]
+        self._staticContextNames = set(context.name for context, xmlElement in zip(contextList, xmlElementList) \
+                                            if not _parseBoolAttribute(xmlElement.attrib.get('dynamic', 'false')))
+
+        self._contextIndexes = {context: index for index, context in enumerate(contextList)}
+        self._contextValues = {}  # context: values, passed to context.setValues(). Only contexts with loaded rules
+        self._ruleRefs = {}  # rule: (context index, rule index) for loaded rules of this parser
+        self._expanded = {}  # context: [(rule, first chars), ...]
+        self._loaded = set()
+        self._loading = set()  # contexts, which are being loaded. Breaks include cycles between syntaxes
+        self._lock = threading.RLock()  # contexts might be entered first time by parsers in different threads
+
+    def loadAll(self):
+        for context in self._contextList:
+            self._loadRules(context)
+
+        # expand IncludeRules, when all included contexts are loaded
+        for context in self._contextList:
+            self.load(context)
+
+    def load(self, context):
+        """Load the context completely. Used as the context loader, see lazyContextLoading
+        """
+        with self._lock:
+            if context in self._loaded or context in self._loading:
+                return
+
+            self._loading.add(context)
+            try:
+                self._loadRules(context)
+                self._makeDispatchTable(context)
+            finally:
+                self._loading.discard(context)
+
+            self._loaded.add(context)
+            if context.loader is not None:
+                context.setLoader(None)
+
+    def cacheData(self):
+        """Data for the syntax cache.
+        First characters are calculated for all rules, dispatch tables are saved for the loaded contexts
+        """
+        for index in range(len(self._contextList)):
+            self._contextRulesFirstChars(index)
+        return self._rulesFirstChars, self._dispatchTables
+
+    def _loadRules(self, context):
+        """Load values and rules of the context, but don't expand IncludeRules
+        """
+        if context in self._contextValues:
+            return
+
+        index = self._contextIndexes[context]
+        self._contextValues[context] = _loadContext(context, self._xmlElementList[index], self._ruleElements(index),
+                                                    self._attributeToStyleMap)
+        ruleDescriptions = self._parser.syntax._ruleDescriptions
+        for ruleIndex, (rule, ruleElement) in enumerate(zip(context.rules, self._ruleElements(index))):
+            self._ruleRefs[rule] = (index, ruleIndex)
+            if _ruleProfilingEnabled:  # descriptions are used only in profiles
+                ruleDescriptions[rule] = _ruleDescription(ruleElement)
+
+    def _ruleElements(self, index):
+        """Rule XML elements of the context, rewritten by the optimizer, if optimizeRules is set
+        """
+        if self._ruleElementLists[index] is None:
+            ruleElements = list(self._xmlElementList[index])
+            if optimizeRules:
+                ruleElements = _optimizeRules(ruleElements, self._parser, self._staticContextNames)
+            self._ruleElementLists[index] = ruleElements
+        return self._ruleElementLists[index]
+
+    def _contextRulesFirstChars(self, index):
+        if self._rulesFirstChars[index] is None:
+            self._rulesFirstChars[index] = \
+                [None if ruleElement.tag == 'IncludeRules' else _ruleFirstChars(ruleElement, self._parser) \
+                    for ruleElement in self._ruleElements(index)]
+        return self._rulesFirstChars[index]
+
+    def _expand(self, context, path):
+        """Returns ([(rule, first chars), ...], is complete)
+        Result is not complete, if a cycle was broken.
+        """
+        parser = self._parser
+
+        if context in self._expanded:
+            return self._expanded[context], True
+
+        if context.parser is not parser:  # other syntax is loaded and expanded completely
+            if context.loader is not None:
+                context.loader(context)
+            return list(zip(context.flatRules, _dispatchTableFirstChars(context))), True
+
+        self._loadRules(context)
+
+        contextIndex = self._contextIndexes[context]
+        result = []
+        complete = True
+        for ruleElement, rule, firstChars in zip(self._ruleElements(contextIndex),
+                                                 context.rules,
+                                                 self._contextRulesFirstChars(contextIndex)):
+            if ruleElement.tag != 'IncludeRules':
+                result.append((rule, firstChars))
+                continue
+
+            contextName = ruleElement.attrib.get('context', None)
+            includedContext = _getContext(contextName, parser, parser.defaultContext)
+            if includedContext in path:
+                complete = False
+                continue
+
+            includedRules, includedComplete = self._expand(includedContext, path + (includedContext, ))
+            result += includedRules
+            complete = complete and includedComplete
+
+            if _parseBoolAttribute(ruleElement.attrib.get('includeAttrib', 'false')):
+                contextValues = self._contextValues
+                if includedContext in contextValues:
+                    attribute, format, _, _, _, _, textType = contextValues[includedContext]
+                else:
+                    attribute, format, textType = includedContext.attribute, includedContext.format, includedContext.textType
+                contextValues[context] = (attribute, format) + contextValues[context][2:6] + (textType, )
+                context.setValues(*contextValues[context])
+
+        uniqueRules = set()
+        uniqueResult = []
+        for rule, firstChars in result:
+            if rule not in uniqueRules:  # rule, which didn't match before, will not match again
+                uniqueRules.add(rule)
+                uniqueResult.append((rule, firstChars))
+
+        if complete:
+            self._expanded[context] = uniqueResult
+        return uniqueResult, complete
+
+    def _makeDispatchTable(self, context):
+        index = self._contextIndexes[context]
+        rulesAndFirstChars = self._expand(context, (context, ))[0]
+        flatRules = [rule for rule, firstChars in rulesAndFirstChars]
+
+        # rules of other syntaxes can't be referenced from the cache
+        flatRuleRefs = [self._ruleRefs.get(rule) for rule in flatRules]
+        if None in flatRuleRefs:
+            flatRuleRefs = None
+
+        cachedDispatchTable = self._cachedDispatchTables[index]
+        if flatRuleRefs is not None and \
+           cachedDispatchTable is not None and \
+           cachedDispatchTable[0] == flatRuleRefs:
+            asciiTable, nonAsciiIndexes = cachedDispatchTable[1:]
+        else:
+            asciiTable, nonAsciiIndexes = _makeDispatchTable([firstChars for rule, firstChars in rulesAndFirstChars])
+
+        context.setDispatchTable(flatRules, asciiTable, nonAsciiIndexes)
+        if flatRuleRefs is not None:
+            self._dispatchTables[index] = (flatRuleRefs, asciiTable, nonAsciiIndexes)
+
 ################################################################################
 ##                               Syntax
 ################################################################################
@@ -446,10 +1299,8 @@ def _textTypeForDefStyleName(attribute, defStyleName):
     else:
         return ' '
 
-def _makeFormat(defaultTheme, defaultStyleName, textType, item=None):
-    format = copy.copy(defaultTheme.format[defaultStyleName])
-
-    format.textType = textType
+def _makeStyle(defaultStyleName, textType, item=None):
+    attributes = []
 
     if item is not None:
         caseInsensitiveAttributes = {}
@@ -457,25 +1308,27 @@ def _makeFormat(defaultTheme, defaultStyleName, textType, item=None):
             caseInsensitiveAttributes[key.lower()] = value.lower()
 
         if 'color' in caseInsensitiveAttributes:
-            format.color = caseInsensitiveAttributes['color']
+            attributes.append(('color', caseInsensitiveAttributes['color']))
         if 'selColor' in caseInsensitiveAttributes:
-            format.selectionColor = caseInsensitiveAttributes['selColor']
+            attributes.append(('selectionColor', caseInsensitiveAttributes['selColor']))
         if 'italic' in caseInsensitiveAttributes:
-            format.italic = _parseBoolAttribute(caseInsensitiveAttributes['italic'])
+            attributes.append(('italic', _parseBoolAttribute(caseInsensitiveAttributes['italic'])))
         if 'bold' in caseInsensitiveAttributes:
-            format.bold = _parseBoolAttribute(caseInsensitiveAttributes['bold'])
+            attributes.append(('bold', _parseBoolAttribute(caseInsensitiveAttributes['bold'])))
         if 'underline' in caseInsensitiveAttributes:
-            format.underline = _parseBoolAttribute(caseInsensitiveAttributes['underline'])
+            attributes.append(('underline', _parseBoolAttribute(caseInsensitiveAttributes['underline'])))
         if 'strikeout' in caseInsensitiveAttributes:
-            format.strikeOut = _parseBoolAttribute(caseInsensitiveAttributes['strikeout'])
+            attributes.append(('strikeOut', _parseBoolAttribute(caseInsensitiveAttributes['strikeout'])))
         if 'spellChecking' in caseInsensitiveAttributes:
-            format.spellChecking = _parseBoolAttribute(caseInsensitiveAttributes['spellChecking'])
+            attributes.append(('spellChecking', _parseBoolAttribute(caseInsensitiveAttributes['spellChecking'])))
 
-    return format
+    return Style(defaultStyleName, tuple(attributes), textType)
 
-def _loadAttributeToFormatMap(highlightingElement):
-    defaultTheme = ColorTheme(TextFormat)
-    attributeToFormatMap = {}
+def _loadAttributeToStyleMap(highlightingElement):
+    """Map attribute name: Style. Formats of the styles are defined by a color theme
+    """
+    defaultTheme = defaultColorTheme()
+    attributeToStyleMap = {}
 
     itemDatasElement = highlightingElement.find('itemDatas')
     if itemDatasElement is not None:
@@ -487,22 +1340,21 @@ def _loadAttributeToFormatMap(highlightingElement):
                 _logger.warning("Unknown default style '%s'", defaultStyleName)
                 defaultStyleName = 'dsNormal'
 
-            format = _makeFormat(defaultTheme,
-                                 defaultStyleName,
-                                 _textTypeForDefStyleName(attribute, defaultStyleName),
-                                 item)
+            style = _makeStyle(defaultStyleName,
+                               _textTypeForDefStyleName(attribute, defaultStyleName),
+                               item)
 
-            attributeToFormatMap[attribute] = format
+            attributeToStyleMap[attribute] = style
 
     # HACK not documented, but 'normal' attribute is used by some parsers without declaration
-    if not 'normal' in attributeToFormatMap:
-        attributeToFormatMap['normal'] = _makeFormat(defaultTheme, 'dsNormal',
-                                                     _textTypeForDefStyleName('normal', 'dsNormal'))
-    if not 'string' in attributeToFormatMap:
-        attributeToFormatMap['string'] = _makeFormat(defaultTheme, 'dsString',
-                                                     _textTypeForDefStyleName('string', 'dsString'))
+    if not 'normal' in attributeToStyleMap:
+        attributeToStyleMap['normal'] = _makeStyle('dsNormal',
+                                                   _textTypeForDefStyleName('normal', 'dsNormal'))
+    if not 'string' in attributeToStyleMap:
+        attributeToStyleMap['string'] = _makeStyle('dsString',
+                                                   _textTypeForDefStyleName('string', 'dsString'))
 
-    return attributeToFormatMap
+    return attributeToStyleMap
 
 def _loadLists(root, highlightingElement):
     lists = {}  # list name: list
@@ -539,14 +1391,27 @@ def _loadSyntaxDescription(root, syntax):
     syntax.indenter = root.attrib.get('indenter', None)
 
 
-def loadSyntax(syntax, filePath, formatConverterFunction = None):
+def loadSyntax(syntax, filePath):
     _logger.debug("Loading syntax %s", filePath)
-    with open(filePath, 'r', encoding='utf-8') as definitionFile:
+    cachedData = _readCache(filePath)
+    if cachedData is not None:
+        treeData, cachedDispatchData = cachedData
+        root = _CachedElement(treeData)
+    else:
+        cachedDispatchData = None
         try:
-            root = xml.etree.ElementTree.parse(definitionFile).getroot()
-        except Exception as ex:
-            print('When opening %s:' % filePath, file=sys.stderr)
-            raise
+            cacheKey = _cacheKey(filePath)
+        except OSError:
+            cacheKey = None  # let open() below raise the error
+
+        import xml.etree.ElementTree  # not needed, if the syntax is loaded from the cache
+
+        with open(filePath, 'r', encoding='utf-8') as definitionFile:
+            try:
+                root = xml.etree.ElementTree.parse(definitionFile).getroot()
+            except Exception as ex:
+                print('When opening %s:' % filePath, file=sys.stderr)
+                raise
 
     highlightingElement = root.find('highlighting')
 
@@ -585,12 +1450,16 @@ def loadSyntax(syntax, filePath, formatConverterFunction = None):
             syntax.indenter = indentationElement.attrib['mode']
 
     deliminatorSetAsString = ''.join(list(deliminatorSet))
-    debugOutputEnabled = _logger.isEnabledFor(logging.DEBUG)  # for cParser
+    debugOutputEnabled = _logger.isEnabledFor(logging.DEBUG)
     parser = _parserModule.Parser(syntax, deliminatorSetAsString, lists, keywordsCaseSensitive, debugOutputEnabled)
     syntax._setParser(parser)
-    attributeToFormatMap = _loadAttributeToFormatMap(highlightingElement)
+    attributeToStyleMap = _loadAttributeToStyleMap(highlightingElement)
 
     # parse contexts
-    _loadContexts(highlightingElement, syntax.parser, attributeToFormatMap, formatConverterFunction)
+    contextLoader = _loadContexts(highlightingElement, syntax.parser, attributeToStyleMap,
+                                  cachedDispatchData)
+
+    if cachedData is None and cacheDirectory is not None and cacheKey is not None:
+        _writeCache(filePath, cacheKey, (_elementData(root), contextLoader.cacheData()))
 
     return syntax
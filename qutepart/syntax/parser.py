@@ -15,46 +15,201 @@ contain not a text value, but ContextSwitcher object
 
 import re
 import logging
+import sys
+import warnings
+import functools
+import time
+import weakref
+
+from qutepart.syntax import STYLE_INDEX_BITS, STYLE_INDEX_MASK
 
 _logger = logging.getLogger('qutepart')
 
 _numSeqReplacer = re.compile('%\d+')
 
+# Reg exp, which never matches. Alternation pattern of rules, which never match
+_NEVER_MATCHING_PATTERN = '(?!)'
+# Back references and conditions refer groups by number and can't be embedded into other reg exp
+_notEmbeddableRegExpFeature = re.compile(r'\\[1-9]|\(\?P=|\(\?\(')
+_defaultRegExpFlags = re.compile('').flags
+# Compiling long word lists is slow. For such lists reg exp only checks the first character
+_MAX_ALTERNATION_WORDS = 200
+# Compiling rules alternation takes few milliseconds. It is compiled only for contexts,
+# which have parsed at least this count of characters
+_ALTERNATION_MIN_PARSED_LENGTH = 10000
+_DYNAMIC_RULE_CACHE_SIZE = 256
+
+
+@functools.lru_cache(maxsize=_DYNAMIC_RULE_CACHE_SIZE)
+def _makeDynamicRuleValue(rule, contextData):
+    """String of dynamic StringDetect or reg exp of dynamic RegExpr for the context data.
+    Cached, because the rules try to match every character of dynamic context, i.e. heredoc
+    """
+    return rule._makeDynamicValue(contextData)
+
+
+def dynamicRuleCacheInfo():
+    """Get (hits, misses) of the cache of dynamic rules substitutions
+    """
+    cacheInfo = _makeDynamicRuleValue.cache_info()
+    return cacheInfo.hits, cacheInfo.misses
+
+
+_ruleProfilingEnabled = False
+
+
+def setRuleProfilingEnabled(enabled):
+    """Enable or disable collecting of rule match statistics. See Context.ruleProfile()
+    Rules alternation is not used while profiling, all rules are tried one by one as in the C parser
+    """
+    global _ruleProfilingEnabled
+    _ruleProfilingEnabled = bool(enabled)
+
+
+# Lines of a single not code text type share a map of one run, which ends after any column.
+# The run end fits Py_ssize_t after packing, the C parser uses the same value
+_WHOLE_LINE_RUN_END = sys.maxsize >> 8
+_WHOLE_LINE_TEXT_TYPE_MAPS = tuple(((_WHOLE_LINE_RUN_END << 8) | textTypeCode, ) for textTypeCode in range(256))
+
+
+def _appendTextType(textTypeRuns, runEnd, textType):
+    """Append run (runEnd << 8) | ord(textType) to the list. Adjacent runs of the same type are merged
+    """
+    run = (runEnd << 8) | ord(textType)
+    if textTypeRuns and (textTypeRuns[-1] & 0xff) == (run & 0xff):
+        textTypeRuns[-1] = run
+    else:
+        textTypeRuns.append(run)
+
+
+def _makeTextTypeMap(textTypeRuns):
+    """Make text type map of the line from the list of runs.
+    The map is a tuple of ints (runEnd << 8) | ord(textType), see Syntax._getTextType().
+    Trailing code is not stored, therefore all code lines share an empty tuple
+    """
+    if len(textTypeRuns) == 1 and (textTypeRuns[0] & 0xff) != ord(' '):  # whole line is of one type
+        return _WHOLE_LINE_TEXT_TYPE_MAPS[textTypeRuns[0] & 0xff]
+
+    if textTypeRuns and (textTypeRuns[-1] & 0xff) == ord(' '):
+        del textTypeRuns[-1]
+
+    return tuple(textTypeRuns)
+
+
+def _appendSegment(highlightedSegments, length, styleIndex):
+    """Append segment (length << STYLE_INDEX_BITS) | styleIndex to the list.
+    Adjacent segments of the same style are merged
+    """
+    if highlightedSegments and highlightedSegments[-1] & STYLE_INDEX_MASK == styleIndex:
+        highlightedSegments[-1] += length << STYLE_INDEX_BITS
+    elif length > 0:
+        highlightedSegments.append((length << STYLE_INDEX_BITS) | styleIndex)
+
+
+def _isAscii(text):
+    return all(ord(char) < 128 for char in text)
+
+
+def _charSetPattern(chars):
+    """Chars, escaped for using inside of reg exp [] set
+    """
+    return ''.join([re.escape(char) for char in sorted(chars)])
+
+
+def _wordStartPattern(deliminatorSet):
+    """Reg exp, which matches if TextToMatchObject.isWordStart is True
+    """
+    return '(?<![^\\s%s])' % _charSetPattern(deliminatorSet)
+
+
+def _wordEndPattern(deliminatorSet):
+    """Reg exp, which matches if TextToMatchObject.word() ends at the position
+    """
+    return '(?![^%s])' % _charSetPattern(deliminatorSet)
+
+
+def _wordsPattern(words, insensitive, deliminatorSet):
+    """Alternation pattern for WordDetect and keyword rules
+    """
+    # word never contains deliminators
+    words = [word for word in words if word and deliminatorSet.isdisjoint(word)]
+    if not words:
+        return _NEVER_MATCHING_PATTERN, True
+
+    if insensitive and \
+       not all(_isAscii(word) for word in words):
+        return None  # str.lower() and re.IGNORECASE may give different results
+
+    if len(words) > _MAX_ALTERNATION_WORDS:
+        pattern = '[%s]' % _charSetPattern(set([word[0] for word in words]))
+        wordEndPattern = ''
+        exact = False
+    else:
+        pattern = '|'.join([re.escape(word) for word in sorted(words)])
+        wordEndPattern = _wordEndPattern(deliminatorSet)
+        exact = not insensitive  # str.lower() might change length of not ASCII text
+
+    if insensitive:
+        pattern = '(?i:%s)' % pattern
+    else:
+        pattern = '(?:%s)' % pattern
+
+    return _wordStartPattern(deliminatorSet) + pattern + wordEndPattern, exact
+
 
 class ContextStack:
-    def __init__(self, contexts, data):
-        """Create default context stack for syntax
-        Contains default context on the top
+    """Immutable context stack.
+    Every stack is a frame, which contains the top context, its data and the parent stack.
+    Stacks are interned, equal stacks are the same object. Therefore stacks are compared by identity,
+    and lines share common parts of their stacks.
+    Use make() to create a stack
+    """
+    _stacks = weakref.WeakValueDictionary()  # (parent, context, data): stack
+
+    __slots__ = ('_parent', '_context', '_data', '_depth', '__weakref__')
+
+    @classmethod
+    def make(cls, parent, context, data):
+        """Get stack with parent stack or None, context on the top and context data.
+        data must be hashable
         """
-        self._contexts = contexts
-        self._data = data
+        key = (parent, context, data)
+        stack = cls._stacks.get(key)
+        if stack is None:
+            stack = cls()
+            stack._parent = parent
+            stack._context = context
+            stack._data = data
+            stack._depth = parent._depth + 1 if parent is not None else 1
+            cls._stacks[key] = stack
+        return stack
 
     def pop(self, count):
-        """Returns new context stack, which doesn't contain few levels
+        """Returns context stack, which doesn't contain few levels
         """
-        if len(self._contexts) - 1 < count:
-            _logger.error("#pop value is too big %d", len(self._contexts))
-            if len(self._contexts) > 1:
-                return ContextStack(self._contexts[:1], self._data[:1])
-            else:
-                return self
+        stack = self
+        if self._depth - 1 < count:
+            _logger.error("#pop value is too big %d", self._depth)
+            count = self._depth - 1
 
-        return ContextStack(self._contexts[:-count], self._data[:-count])
+        for i in range(count):
+            stack = stack._parent
+        return stack
 
     def append(self, context, data):
-        """Returns new context, which contains current stack and new frame
+        """Returns context stack, which contains current stack and new frame
         """
-        return ContextStack(self._contexts + [context], self._data + [data])
+        return ContextStack.make(self, context, data)
 
     def currentContext(self):
         """Get current context
         """
-        return self._contexts[-1]
+        return self._context
 
     def currentData(self):
         """Get current data
         """
-        return self._data[-1]
+        return self._data
 
 
 class ContextSwitcher:
@@ -77,6 +232,8 @@ class ContextSwitcher:
             contextStack = contextStack.pop(self._popsCount)
 
         if self._contextToSwitch is not None:
+            if self._contextToSwitch.loader is not None:  # context is entered first time, see loader.lazyContextLoading
+                self._contextToSwitch.loader(self._contextToSwitch)
             if not self._contextToSwitch.dynamic:
                 data = None
             contextStack = contextStack.append(self._contextToSwitch, data)
@@ -85,35 +242,63 @@ class ContextSwitcher:
 
 
 class TextToMatchObject:
-    """Peace of text, which shall be matched.
+    """Line of text, which shall be matched, and current position in the line.
+    One object is created for a line and is moved along the line with setCurrentColumnIndex().
+    Rules match the text at the current position, line is never sliced.
     Contains pre-calculated and pre-checked data for performance optimization
     """
     def __init__(self, currentColumnIndex, wholeLineText, deliminatorSet, contextData):
-        self.currentColumnIndex = currentColumnIndex
         self.wholeLineText = wholeLineText
-        self.text = wholeLineText[currentColumnIndex:]
-        self.textLen = len(self.text)
+        self.textLen = len(wholeLineText)
+        self.deliminatorSet = deliminatorSet
+        self.contextData = contextData
 
-        self.firstNonSpace = not bool(wholeLineText[:currentColumnIndex].strip())
+        # Positions up to and including this index are first non-space
+        self._firstNonSpaceIndex = self.textLen - len(wholeLineText.lstrip())
+        # Index of deliminator, which ends a word, for every position. Calculated on first request
+        self._wordEnds = None
 
-        self.isWordStart = currentColumnIndex == 0 or \
-                         wholeLineText[currentColumnIndex - 1].isspace() or \
-                         wholeLineText[currentColumnIndex - 1] in deliminatorSet
+        self.setCurrentColumnIndex(currentColumnIndex)
 
-        self.word = None
-        if self.isWordStart:
-            wordEndIndex = 0
-            for index, char in enumerate(self.text):
-                if char in deliminatorSet:
-                    wordEndIndex = index
-                    break
-            else:
-                wordEndIndex = len(wholeLineText)
+    def setCurrentColumnIndex(self, currentColumnIndex):
+        """Move current position. Updates only O(1) data
+        """
+        self.currentColumnIndex = currentColumnIndex
 
-            if wordEndIndex != 0:
-                self.word = self.text[:wordEndIndex]
+        self.firstNonSpace = currentColumnIndex <= self._firstNonSpaceIndex
 
-        self.contextData = contextData
+        if currentColumnIndex == 0:
+            self.isWordStart = True
+        else:
+            prevChar = self.wholeLineText[currentColumnIndex - 1]
+            self.isWordStart = prevChar.isspace() or \
+                               prevChar in self.deliminatorSet
+
+    def word(self):
+        """Word, which starts at current position, or None
+        """
+        if not self.isWordStart:
+            return None
+
+        if self._wordEnds is None:
+            self._wordEnds = self._makeWordEnds()
+
+        wordEndIndex = self._wordEnds[self.currentColumnIndex]
+        if wordEndIndex == self.currentColumnIndex:
+            return None
+
+        return self.wholeLineText[self.currentColumnIndex:wordEndIndex]
+
+    def _makeWordEnds(self):
+        """Find closest deliminator for every position of the line in one pass
+        """
+        wordEnds = [0] * self.textLen
+        wordEndIndex = self.textLen
+        for index in range(self.textLen - 1, -1, -1):
+            if self.wholeLineText[index] in self.deliminatorSet:
+                wordEndIndex = index
+            wordEnds[index] = wordEndIndex
+        return wordEnds
 
 
 class RuleTryMatchResult:
@@ -145,7 +330,7 @@ class AbstractRule:
     """Base class for rule classes
     Public attributes:
         parentContext
-        format              May be None
+        format              Style index, see qutepart.syntax.styleIndex()
         textType            May be None
         attribute           May be None
         context
@@ -183,6 +368,24 @@ class AbstractRule:
         """
         raise NotImplementedError(str(self.__class__))
 
+    def alternationPattern(self, deliminatorSet):
+        """Reg exp for the context rules alternation. See Context.parseBlock()
+        Returns (pattern, exact) or None, if the rule can't be represented with a reg exp.
+        The pattern matches the text everywhere, where the rule matches.
+        If exact is True, it matches only there, and the match length is the rule match length.
+        Otherwise the match is checked with tryMatch()
+        """
+        alternationPattern = self._alternationPattern(deliminatorSet)
+        if alternationPattern is None:
+            return None
+
+        pattern, exact = alternationPattern
+        exact = exact and self.column == -1 and (not self.firstNonSpace)
+        return pattern, exact
+
+    def _alternationPattern(self, deliminatorSet):
+        return None
+
     def tryMatch(self, textToMatchObject):
         """Try to find themselves in the text.
         Returns (contextStack, count, matchedRule) or (contextStack, None, None) if doesn't match
@@ -215,6 +418,13 @@ class DetectChar(AbstractRule):
     def shortId(self):
         return 'DetectChar(%s, %d)' % (self.char, self.index)
 
+    def _alternationPattern(self, deliminatorSet):
+        if self.dynamic:
+            return None
+        if not self.char:
+            return _NEVER_MATCHING_PATTERN, True
+        return re.escape(self.char), len(self.char) == 1
+
     def _tryMatch(self, textToMatchObject):
         if self.char is None and self.index == 0:
             return None
@@ -233,7 +443,7 @@ class DetectChar(AbstractRule):
         else:
             string = self.char
 
-        if textToMatchObject.text[0] == string:
+        if textToMatchObject.wholeLineText[textToMatchObject.currentColumnIndex] == string:
             return RuleTryMatchResult(self, 1)
         return None
 
@@ -249,11 +459,16 @@ class Detect2Chars(AbstractRule):
     def shortId(self):
         return 'Detect2Chars(%s)' % self.string
 
+    def _alternationPattern(self, deliminatorSet):
+        if self.string is None:
+            return _NEVER_MATCHING_PATTERN, True
+        return re.escape(self.string), True
+
     def _tryMatch(self, textToMatchObject):
         if self.string is None:
             return None
 
-        if textToMatchObject.text.startswith(self.string):
+        if textToMatchObject.wholeLineText.startswith(self.string, textToMatchObject.currentColumnIndex):
             return RuleTryMatchResult(self, len(self.string))
 
         return None
@@ -270,8 +485,13 @@ class AnyChar(AbstractRule):
     def shortId(self):
         return 'AnyChar(%s)' % self.string
 
+    def _alternationPattern(self, deliminatorSet):
+        if not self.string:
+            return _NEVER_MATCHING_PATTERN, True
+        return '[%s]' % _charSetPattern(self.string), True
+
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text[0] in self.string:
+        if textToMatchObject.wholeLineText[textToMatchObject.currentColumnIndex] in self.string:
             return RuleTryMatchResult(self, 1)
 
         return None
@@ -288,20 +508,30 @@ class StringDetect(AbstractRule):
     def shortId(self):
         return 'StringDetect(%s)' % self.string
 
+    def _alternationPattern(self, deliminatorSet):
+        if self.dynamic:
+            return None
+        if self.string is None:
+            return _NEVER_MATCHING_PATTERN, True
+        return re.escape(self.string), True
+
     def _tryMatch(self, textToMatchObject):
         if self.string is None:
             return None
 
         if self.dynamic:
-            string = self._makeDynamicSubsctitutions(self.string, textToMatchObject.contextData)
+            string = _makeDynamicRuleValue(self, textToMatchObject.contextData)
         else:
             string = self.string
 
-        if textToMatchObject.text.startswith(string):
+        if textToMatchObject.wholeLineText.startswith(string, textToMatchObject.currentColumnIndex):
             return RuleTryMatchResult(self, len(string))
 
         return None
 
+    def _makeDynamicValue(self, contextData):
+        return self._makeDynamicSubsctitutions(self.string, contextData)
+
     @staticmethod
     def _makeDynamicSubsctitutions(string, contextData):
         """For dynamic rules, replace %d patterns with actual strings
@@ -330,15 +560,21 @@ class WordDetect(AbstractRule):
     def shortId(self):
         return 'WordDetect(%s, %d)' % (self.word, self.insensitive)
 
+    def _alternationPattern(self, deliminatorSet):
+        insensitive = self.insensitive or \
+                      (not self.parentContext.parser.keywordsCaseSensitive)
+        return _wordsPattern([self.word] if self.word else [], insensitive, deliminatorSet)
+
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.word is None:
+        word = textToMatchObject.word()
+        if word is None:
             return None
 
         if self.insensitive or \
            (not self.parentContext.parser.keywordsCaseSensitive):
-            wordToCheck = textToMatchObject.word.lower()
+            wordToCheck = word.lower()
         else:
-            wordToCheck = textToMatchObject.word
+            wordToCheck = word
 
         if wordToCheck == self.word:
             return RuleTryMatchResult(self, len(wordToCheck))
@@ -359,15 +595,21 @@ class keyword(AbstractRule):
     def shortId(self):
         return 'keyword(%s, %d)' % (' '.join(list(self.words)), self.insensitive)
 
+    def _alternationPattern(self, deliminatorSet):
+        insensitive = self.insensitive or \
+                      (not self.parentContext.parser.keywordsCaseSensitive)
+        return _wordsPattern(self.words, insensitive, deliminatorSet)
+
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.word is None:
+        word = textToMatchObject.word()
+        if word is None:
             return None
 
         if self.insensitive or \
            (not self.parentContext.parser.keywordsCaseSensitive):
-            wordToCheck = textToMatchObject.word.lower()
+            wordToCheck = word.lower()
         else:
-            wordToCheck = textToMatchObject.word
+            wordToCheck = word
 
         if wordToCheck in self.words:
             return RuleTryMatchResult(self, len(wordToCheck))
@@ -400,12 +642,26 @@ class RegExpr(AbstractRule):
     def shortId(self):
         return 'RegExpr( %s )' % self.string
 
+    def _alternationPattern(self, deliminatorSet):
+        if self.dynamic:
+            return None
+        if self.regExp is None:
+            return _NEVER_MATCHING_PATTERN, True
+        if self.regExp.flags != _defaultRegExpFlags or \
+           _notEmbeddableRegExpFeature.search(self.string) is not None:
+            return None
+
+        pattern = '(?:%s)' % self.string
+        if self.wordStart:
+            pattern = _wordStartPattern(deliminatorSet) + pattern
+        # lineStart is checked for whole pattern, i.e. for '^a|b', reg exp checks it only for 'a'
+        return pattern, not self.lineStart
+
     def _tryMatch(self, textToMatchObject):
         """Tries to parse text. If matched - saves data for dynamic context
         """
         if self.dynamic:
-            string = self._makeDynamicSubsctitutions(self.string, textToMatchObject.contextData)
-            regExp = self._compileRegExp(string, self.insensitive)
+            regExp = _makeDynamicRuleValue(self, textToMatchObject.contextData)
         else:
             regExp = self.regExp
 
@@ -423,13 +679,19 @@ class RegExpr(AbstractRule):
            textToMatchObject.currentColumnIndex > 0:
             return None
 
-        wholeMatch, groups = self._matchPattern(regExp, textToMatchObject.text)
+        wholeMatch, groups = self._matchPattern(regExp,
+                                                textToMatchObject.wholeLineText,
+                                                textToMatchObject.currentColumnIndex)
         if wholeMatch is not None:
             count = len(wholeMatch)
             return RuleTryMatchResult(self, count, groups)
         else:
             return None
 
+    def _makeDynamicValue(self, contextData):
+        string = self._makeDynamicSubsctitutions(self.string, contextData)
+        return self._compileRegExp(string, self.insensitive)
+
     @staticmethod
     def _makeDynamicSubsctitutions(string, contextData):
         """For dynamic rules, replace %d patterns with actual strings
@@ -462,13 +724,13 @@ class RegExpr(AbstractRule):
             return None
 
     @staticmethod
-    def _matchPattern(regExp, string):
-        """Try to match pattern.
+    def _matchPattern(regExp, string, pos):
+        """Try to match pattern at position pos of the string.
+        Pattern sees whole string, so ^, \\b and look-behind assertions work as in Kate
         Returns tuple (whole match, groups) or (None, None)
-        Python function, used by C code
         """
-        match = regExp.match(string)
-        if match is not None and match.group(0):
+        match = regExp.match(string, pos)
+        if match is not None and match.end() > pos:
             return match.group(0), (match.group(0), ) + match.groups()
         else:
             return None, None
@@ -494,41 +756,46 @@ class AbstractNumberRule(AbstractRule):
         if not textToMatchObject.isWordStart:
             return None
 
-        index = self._tryMatchText(textToMatchObject.text)
+        currentColumnIndex = textToMatchObject.currentColumnIndex
+        index = self._tryMatchText(textToMatchObject.wholeLineText,
+                                   currentColumnIndex,
+                                   textToMatchObject.textLen)
         if index is None:
             return None
 
-        if textToMatchObject.currentColumnIndex + index < len(textToMatchObject.wholeLineText):
-            newTextToMatchObject = TextToMatchObject(textToMatchObject.currentColumnIndex + index,
-                                                      textToMatchObject.wholeLineText,
-                                                      self.parentContext.parser.deliminatorSet,
-                                                      textToMatchObject.contextData)
+        if currentColumnIndex + index < textToMatchObject.textLen:
+            textToMatchObject.setCurrentColumnIndex(currentColumnIndex + index)
             for rule in self.childRules:
-                ruleTryMatchResult = rule.tryMatch(newTextToMatchObject)
+                ruleTryMatchResult = rule.tryMatch(textToMatchObject)
                 if ruleTryMatchResult is not None:
                     index += ruleTryMatchResult.length
                     break
                 # child rule context and attribute ignored
+            textToMatchObject.setCurrentColumnIndex(currentColumnIndex)
 
         return RuleTryMatchResult(self, index)
 
-    def _countDigits(self, text):
-        """Count digits at start of text
+    def _countDigits(self, text, startIndex, textLen):
+        """Count digits at startIndex of text
         """
-        index = 0
-        while index < len(text):
+        index = startIndex
+        while index < textLen:
             if not text[index].isdigit():
                 break
             index += 1
-        return index
+        return index - startIndex
 
 
 class Int(AbstractNumberRule):
     def shortId(self):
         return 'Int()'
 
-    def _tryMatchText(self, text):
-        matchedLength = self._countDigits(text)
+    def _alternationPattern(self, deliminatorSet):
+        # str.isdigit() is True for some not ASCII characters
+        return _wordStartPattern(deliminatorSet) + '(?:[0-9]|[^\\x00-\\x7f])', False
+
+    def _tryMatchText(self, text, startIndex, textLen):
+        matchedLength = self._countDigits(text, startIndex, textLen)
 
         if matchedLength:
             return matchedLength
@@ -540,50 +807,53 @@ class Float(AbstractNumberRule):
     def shortId(self):
         return 'Float()'
 
-    def _tryMatchText(self, text):
+    def _alternationPattern(self, deliminatorSet):
+        return _wordStartPattern(deliminatorSet) + '(?:[0-9.eE]|[^\\x00-\\x7f])', False
+
+    def _tryMatchText(self, text, startIndex, textLen):
 
         haveDigit = False
         havePoint = False
 
-        matchedLength = 0
+        index = startIndex
 
-        digitCount = self._countDigits(text[matchedLength:])
+        digitCount = self._countDigits(text, index, textLen)
         if digitCount:
             haveDigit = True
-            matchedLength += digitCount
+            index += digitCount
 
-        if len(text) > matchedLength and text[matchedLength] == '.':
+        if textLen > index and text[index] == '.':
             havePoint = True
-            matchedLength += 1
+            index += 1
 
-        digitCount = self._countDigits(text[matchedLength:])
+        digitCount = self._countDigits(text, index, textLen)
         if digitCount:
             haveDigit = True
-            matchedLength += digitCount
+            index += digitCount
 
-        if len(text) > matchedLength and text[matchedLength].lower() == 'e':
-            matchedLength += 1
+        if textLen > index and text[index].lower() == 'e':
+            index += 1
 
-            if len(text) > matchedLength and text[matchedLength] in '+-':
-                matchedLength += 1
+            if textLen > index and text[index] in '+-':
+                index += 1
 
             haveDigitInExponent = False
 
-            digitCount = self._countDigits(text[matchedLength:])
+            digitCount = self._countDigits(text, index, textLen)
             if digitCount:
                 haveDigitInExponent = True
-                matchedLength += digitCount
+                index += digitCount
 
             if not haveDigitInExponent:
                 return None
 
-            return matchedLength
+            return index - startIndex
         else:
             if not havePoint:
                 return None
 
-        if matchedLength and haveDigit:
-            return matchedLength
+        if index > startIndex and haveDigit:
+            return index - startIndex
         else:
             return None
 
@@ -592,67 +862,84 @@ class HlCOct(AbstractRule):
     def shortId(self):
         return 'HlCOct'
 
+    def _alternationPattern(self, deliminatorSet):
+        return '0[1-7]', False
+
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text[0] != '0':
+        text = textToMatchObject.wholeLineText
+        textLen = textToMatchObject.textLen
+        startIndex = textToMatchObject.currentColumnIndex
+
+        if text[startIndex] != '0':
             return None
 
-        index = 1
-        while index < len(textToMatchObject.text) and textToMatchObject.text[index] in '1234567':
+        index = startIndex + 1
+        while index < textLen and text[index] in '1234567':
             index += 1
 
-        if index == 1:
+        if index == startIndex + 1:
             return None
 
-        if index < len(textToMatchObject.text) and textToMatchObject.text[index].upper() in 'LU':
+        if index < textLen and text[index].upper() in 'LU':
             index += 1
 
-        return RuleTryMatchResult(self, index)
+        return RuleTryMatchResult(self, index - startIndex)
 
 
 class HlCHex(AbstractRule):
     def shortId(self):
         return 'HlCHex'
 
+    def _alternationPattern(self, deliminatorSet):
+        return '0[xX]', False
+
     def _tryMatch(self, textToMatchObject):
-        if len(textToMatchObject.text) < 3:
+        text = textToMatchObject.wholeLineText
+        textLen = textToMatchObject.textLen
+        startIndex = textToMatchObject.currentColumnIndex
+
+        if textLen - startIndex < 3:
             return None
 
-        if textToMatchObject.text[:2].upper() != '0X':
+        if text[startIndex] != '0' or \
+           text[startIndex + 1].upper() != 'X':
             return None
 
-        index = 2
-        while index < len(textToMatchObject.text) and textToMatchObject.text[index].upper() in '0123456789ABCDEF':
+        index = startIndex + 2
+        while index < textLen and text[index].upper() in '0123456789ABCDEF':
             index += 1
 
-        if index == 2:
+        if index == startIndex + 2:
             return None
 
-        if index < len(textToMatchObject.text) and textToMatchObject.text[index].upper() in 'LU':
+        if index < textLen and text[index].upper() in 'LU':
             index += 1
 
-        return RuleTryMatchResult(self, index)
+        return RuleTryMatchResult(self, index - startIndex)
 
 
-def _checkEscapedChar(text):
-    index = 0
-    if len(text) > 1 and text[0] == '\\':
-        index = 1
+def _checkEscapedChar(text, startIndex, textLen):
+    """Check if escaped char starts at startIndex.
+    Returns its length or None
+    """
+    if textLen - startIndex > 1 and text[startIndex] == '\\':
+        index = startIndex + 1
 
         if text[index] in "abefnrtv'\"?\\":
             index += 1
         elif text[index] == 'x':  # if it's like \xff, eat the x
             index += 1
-            while index < len(text) and text[index].upper() in '0123456789ABCDEF':
+            while index < textLen and text[index].upper() in '0123456789ABCDEF':
                 index += 1
-            if index == 2:  # no hex digits
+            if index == startIndex + 2:  # no hex digits
                 return None
         elif text[index] in '01234567':
-            while index < 4 and index < len(text) and text[index] in '01234567':
+            while index < startIndex + 4 and index < textLen and text[index] in '01234567':
                 index += 1
         else:
             return None
 
-        return index
+        return index - startIndex
 
     return None
 
@@ -661,8 +948,13 @@ class HlCStringChar(AbstractRule):
     def shortId(self):
         return 'HlCStringChar'
 
+    def _alternationPattern(self, deliminatorSet):
+        return '\\\\', False
+
     def _tryMatch(self, textToMatchObject):
-        res = _checkEscapedChar(textToMatchObject.text)
+        res = _checkEscapedChar(textToMatchObject.wholeLineText,
+                                textToMatchObject.currentColumnIndex,
+                                textToMatchObject.textLen)
         if res is not None:
             return RuleTryMatchResult(self, res)
         else:
@@ -673,15 +965,22 @@ class HlCChar(AbstractRule):
     def shortId(self):
         return 'HlCChar'
 
+    def _alternationPattern(self, deliminatorSet):
+        return "'", False
+
     def _tryMatch(self, textToMatchObject):
-        if len(textToMatchObject.text) > 2 and textToMatchObject.text[0] == "'" and textToMatchObject.text[1] != "'":
-            result = _checkEscapedChar(textToMatchObject.text[1:])
+        text = textToMatchObject.wholeLineText
+        textLen = textToMatchObject.textLen
+        startIndex = textToMatchObject.currentColumnIndex
+
+        if textLen - startIndex > 2 and text[startIndex] == "'" and text[startIndex + 1] != "'":
+            result = _checkEscapedChar(text, startIndex + 1, textLen)
             if result is not None:
                 index = 1 + result
             else:  # 1 not escaped character
                 index = 1 + 1
 
-            if index < len(textToMatchObject.text) and textToMatchObject.text[index] == "'":
+            if startIndex + index < textLen and text[startIndex + index] == "'":
                 return RuleTryMatchResult(self, index + 1)
 
         return None
@@ -700,11 +999,16 @@ class RangeDetect(AbstractRule):
     def shortId(self):
         return 'RangeDetect(%s, %s)' % (self.char, self.char1)
 
+    def _alternationPattern(self, deliminatorSet):
+        return re.escape(self.char), False
+
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text.startswith(self.char):
-            end = textToMatchObject.text.find(self.char1)
-            if end > 0:
-                return RuleTryMatchResult(self, end + 1)
+        text = textToMatchObject.wholeLineText
+        startIndex = textToMatchObject.currentColumnIndex
+        if text.startswith(self.char, startIndex):
+            end = text.find(self.char1, startIndex)
+            if end > startIndex:
+                return RuleTryMatchResult(self, end - startIndex + 1)
 
         return None
 
@@ -713,8 +1017,12 @@ class LineContinue(AbstractRule):
     def shortId(self):
         return 'LineContinue'
 
+    def _alternationPattern(self, deliminatorSet):
+        return '\\\\\\Z', True
+
     def _tryMatch(self, textToMatchObject):
-        if textToMatchObject.text == '\\':
+        if textToMatchObject.currentColumnIndex == textToMatchObject.textLen - 1 and \
+           textToMatchObject.wholeLineText[-1] == '\\':
             return RuleTryMatchResult(self, 1)
 
         return None
@@ -740,27 +1048,27 @@ class IncludeRules(AbstractRule):
         """Try to find themselves in the text.
         Returns (count, matchedRule) or (None, None) if doesn't match
         """
-        for rule in self.context.rules:
+        for rule in self.context.flatRules:
             ruleTryMatchResult = rule.tryMatch(textToMatchObject)
             if ruleTryMatchResult is not None:
-                _logger.debug('\tmatched rule %s at %d in included context %s/%s',
-                              rule.shortId(),
-                              textToMatchObject.currentColumnIndex,
-                              self.context.parser.syntax.name,
-                              self.context.name)
                 return ruleTryMatchResult
         else:
             return None
 
 
 class DetectSpaces(AbstractRule):
+    _regExp = re.compile('\\s+')
     def shortId(self):
         return 'DetectSpaces()'
 
+    def _alternationPattern(self, deliminatorSet):
+        return '\\s+', True
+
     def _tryMatch(self, textToMatchObject):
-        spaceLen = len(textToMatchObject.text) - len(textToMatchObject.text.lstrip())
-        if spaceLen:
-            return RuleTryMatchResult(self, spaceLen)
+        match = DetectSpaces._regExp.match(textToMatchObject.wholeLineText,
+                                           textToMatchObject.currentColumnIndex)
+        if match is not None:
+            return RuleTryMatchResult(self, match.end() - textToMatchObject.currentColumnIndex)
         else:
             return None
 
@@ -770,10 +1078,14 @@ class DetectIdentifier(AbstractRule):
     def shortId(self):
         return 'DetectIdentifier()'
 
+    def _alternationPattern(self, deliminatorSet):
+        return '[a-zA-Z][a-zA-Z0-9_]*', True
+
     def _tryMatch(self, textToMatchObject):
-        match = DetectIdentifier._regExp.match(textToMatchObject.text)
-        if match is not None and match.group(0):
-            return RuleTryMatchResult(self, len(match.group(0)))
+        match = DetectIdentifier._regExp.match(textToMatchObject.wholeLineText,
+                                               textToMatchObject.currentColumnIndex)
+        if match is not None:
+            return RuleTryMatchResult(self, match.end() - textToMatchObject.currentColumnIndex)
 
         return None
 
@@ -788,12 +1100,23 @@ class Context:
         fallthroughContext
         dynamic
         rules
+        flatRules    rules with expanded IncludeRules
+        dispatchTable
         textType     ' ' : code, 'c' : comment
+        loader       function, which loads not loaded context, or None
     """
     def __init__(self, parser, name):
         # Will be initialized later, after all context has been created
         self.parser = parser
         self.name = name
+        self.loader = None
+        self._ruleProfile = {}  # rule: [attempts, successes, time]
+
+    def setLoader(self, loader):
+        """Set function loader(context), which is called, when the context is entered first time.
+        The loader loads the context and resets it with setLoader(None)
+        """
+        self.loader = loader
 
     def setValues(self, attribute, format, lineEndContext, lineBeginContext, fallthroughContext, dynamic, textType):
         self.attribute = attribute
@@ -806,6 +1129,106 @@ class Context:
 
     def setRules(self, rules):
         self.rules = rules
+        self.flatRules = rules
+        self.dispatchTable = None
+        self._rulesForChar = {}
+        self._rulesForOtherChars = rules
+        self._ruleIndexes = {rule: index for index, rule in enumerate(rules)}
+        self._ruleAlternations = {}
+        self._parsedLength = 0
+
+    def setDispatchTable(self, flatRules, asciiTable, nonAsciiRuleIndexes):
+        """Set rules with expanded IncludeRules and
+        table "first character": "rules, which may match text, started with the character".
+        asciiTable is a tuple of 128 tuples of flatRules indexes, one for each ASCII character code.
+        Rules for all other characters are nonAsciiRuleIndexes
+        """
+        self.flatRules = flatRules
+        self.dispatchTable = (asciiTable, nonAsciiRuleIndexes)
+
+        rulesForIndexes = {}
+        def _rules(indexes):
+            if indexes not in rulesForIndexes:
+                rulesForIndexes[indexes] = tuple([flatRules[index] for index in indexes])
+            return rulesForIndexes[indexes]
+
+        self._rulesForChar = {chr(code): _rules(indexes) \
+                                for code, indexes in enumerate(asciiTable)}
+        self._rulesForOtherChars = _rules(nonAsciiRuleIndexes)
+        self._ruleIndexes = {rule: index for index, rule in enumerate(flatRules)}
+        self._ruleAlternations = {}
+        self._parsedLength = 0
+
+    def ruleProfile(self):
+        """Rule match statistics, collected while profiling is enabled. See setRuleProfilingEnabled()
+        Returns list of (rule, attempts, successes, time in seconds) for tried flatRules
+        """
+        return [(rule, ) + tuple(self._ruleProfile[rule]) \
+                    for rule in self.flatRules if rule in self._ruleProfile]
+
+    def resetRuleProfile(self):
+        self._ruleProfile = {}
+
+    def _profiledTryMatch(self, rule, textToMatchObject):
+        startTime = time.perf_counter()
+        ruleTryMatchResult = rule.tryMatch(textToMatchObject)
+        elapsed = time.perf_counter() - startTime
+
+        statistics = self._ruleProfile.get(rule)
+        if statistics is None:
+            statistics = self._ruleProfile[rule] = [0, 0, 0.]
+        statistics[0] += 1
+        if ruleTryMatchResult is not None:
+            statistics[1] += 1
+        statistics[2] += elapsed
+        return ruleTryMatchResult
+
+    def _ruleAlternation(self, deliminatorSet, textLength):
+        """Get reg exp, which contains all rules as alternatives, and list of alternatives.
+        Every alternative ends with an empty named group, therefore match.lastindex is the index
+        of the first alternative, which matched the text.
+        Alternative is (rule, rule index, exact, slice of match.groups(), which are groups of RegExpr rule, or None)
+        Compiled for every deliminator set, because rules might be used by other syntaxes.
+        Returns None, if some rules can't be represented with a reg exp, or if the context
+        hasn't parsed enough text yet. textLength is length of text, which is going to be parsed
+        """
+        if deliminatorSet in self._ruleAlternations:
+            return self._ruleAlternations[deliminatorSet]
+
+        self._parsedLength += textLength
+        if self._parsedLength < _ALTERNATION_MIN_PARSED_LENGTH:
+            return None
+
+        ruleAlternation = None
+        patterns = []
+        exactFlags = []
+        for index, rule in enumerate(self.flatRules):
+            alternationPattern = rule.alternationPattern(deliminatorSet)
+            if alternationPattern is None:
+                break
+            pattern, exact = alternationPattern
+            patterns.append('%s(?P<_rule%d>)' % (pattern, index))
+            exactFlags.append(exact)
+        else:
+            if patterns:
+                try:
+                    with warnings.catch_warnings():
+                        warnings.simplefilter('error')  # i.e. global flags not at the start of the pattern
+                        regExp = re.compile('|'.join(patterns))
+                except (re.error, AssertionError, Warning) as ex:
+                    _logger.debug("Failed to compile rules of context '%s': %s", self.name, str(ex))
+                else:
+                    alternatives = [None] * (regExp.groups + 1)
+                    for index, rule in enumerate(self.flatRules):
+                        groupIndex = regExp.groupindex['_rule%d' % index]
+                        groupsSlice = None
+                        if isinstance(rule, RegExpr) and rule.regExp is not None:
+                            groupsSlice = slice(groupIndex - 1 - rule.regExp.groups, groupIndex - 1)
+                        alternatives[groupIndex] = (rule, index, exactFlags[index], groupsSlice)
+                    ruleAlternation = (regExp, alternatives)
+
+        self._ruleAlternations[deliminatorSet] = ruleAlternation
+        return ruleAlternation
 
     def __str__(self):
         """Serialize.
@@ -823,69 +1246,120 @@ class Context:
             res += str(rule)
         return res
 
-    def parseBlock(self, contextStack, currentColumnIndex, text):
+    def parseBlock(self, contextStack, currentColumnIndex, untilColumnIndex, textToMatchObject,
+                   highlightedSegments, textTypeRuns):
         """Parse block
-        Exits, when reached end of the text, or when context is switched
-        Returns (length, newContextStack, highlightedSegments, lineContinue)
+        Exits, when reached untilColumnIndex, or when context is switched.
+        Matched rule might end after untilColumnIndex
+        textToMatchObject is shared by all contexts, which parse the line
+        Appends segments to highlightedSegments and text type runs to textTypeRuns
+        Returns (length, newContextStack, lineContinue)
         """
         startColumnIndex = currentColumnIndex
+        text = textToMatchObject.wholeLineText
+        textLen = textToMatchObject.textLen
+        rulesForChar = self._rulesForChar
+        rulesForOtherChars = self._rulesForOtherChars
+        flatRuleIndexes = self._ruleIndexes
+        profiling = _ruleProfilingEnabled
+        alternationSearch = None
+        if self.fallthroughContext is None and \
+           not profiling:  # otherwise every not matched character shall be checked
+            ruleAlternation = self._ruleAlternation(textToMatchObject.deliminatorSet,
+                                                    untilColumnIndex - currentColumnIndex)
+            if ruleAlternation is not None:
+                alternationSearch = ruleAlternation[0].search
+                alternatives = ruleAlternation[1]
+        debugOutputEnabled = self.parser.debugOutputEnabled
         countOfNotMatchedSymbols = 0
-        highlightedSegments = []
-        textTypeMap = []
         ruleTryMatchResult = None
-        while currentColumnIndex < len(text):
-            textToMatchObject = TextToMatchObject(currentColumnIndex,
-                                                   text,
-                                                   self.parser.deliminatorSet,
-                                                   contextStack.currentData())
-            for rule in self.rules:
-                ruleTryMatchResult = rule.tryMatch(textToMatchObject)
-                if ruleTryMatchResult is not None:  # if something matched
+        textToMatchObject.contextData = contextStack.currentData()
+        while currentColumnIndex < untilColumnIndex:
+            if alternationSearch is not None:
+                # One search() call instead of trying all the rules at every position.
+                # Rules can't match before the found position and before the found alternative.
+                # Following rules are tried only if the rule conditions, which are not checked by the reg exp, fail
+                match = alternationSearch(text, currentColumnIndex)
+                if match is None or \
+                   match.start() >= untilColumnIndex:  # rules are not tried at the end of the line
+                    countOfNotMatchedSymbols += untilColumnIndex - currentColumnIndex
+                    currentColumnIndex = untilColumnIndex
+                    ruleTryMatchResult = None
+                    break
+
+                countOfNotMatchedSymbols += match.start() - currentColumnIndex
+                currentColumnIndex = match.start()
+                rule, ruleIndex, exact, groupsSlice = alternatives[match.lastindex]
+                if exact and match.end() > currentColumnIndex:
+                    if groupsSlice is not None:
+                        data = (match.group(0), ) + match.groups()[groupsSlice]
+                    else:
+                        data = None
+                    ruleTryMatchResult = RuleTryMatchResult(rule, match.end() - currentColumnIndex, data)
+                else:
+                    textToMatchObject.setCurrentColumnIndex(currentColumnIndex)
+                    ruleTryMatchResult = rule.tryMatch(textToMatchObject)
+                    if ruleTryMatchResult is None:
+                        for rule in rulesForChar.get(text[currentColumnIndex], rulesForOtherChars):
+                            if flatRuleIndexes[rule] > ruleIndex:
+                                ruleTryMatchResult = rule.tryMatch(textToMatchObject)
+                                if ruleTryMatchResult is not None:
+                                    break
+            else:
+                textToMatchObject.setCurrentColumnIndex(currentColumnIndex)
+                ruleTryMatchResult = None
+                for rule in rulesForChar.get(text[currentColumnIndex], rulesForOtherChars):
+                    if profiling:
+                        ruleTryMatchResult = self._profiledTryMatch(rule, textToMatchObject)
+                    else:
+                        ruleTryMatchResult = rule.tryMatch(textToMatchObject)
+                    if ruleTryMatchResult is not None:
+                        break
+
+            if ruleTryMatchResult is not None:  # if something matched
+                if debugOutputEnabled:
                     _logger.debug('\tmatched rule %s at %d',
-                                  rule.shortId(),
+                                  ruleTryMatchResult.rule.shortId(),
                                   currentColumnIndex)
-                    if countOfNotMatchedSymbols > 0:
-                        highlightedSegments.append((countOfNotMatchedSymbols, self.format))
-                        textTypeMap += [self.textType for i in range(countOfNotMatchedSymbols)]
-                        countOfNotMatchedSymbols = 0
+                if countOfNotMatchedSymbols > 0:
+                    _appendSegment(highlightedSegments, countOfNotMatchedSymbols, self.format)
+                    _appendTextType(textTypeRuns, currentColumnIndex, self.textType)
+                    countOfNotMatchedSymbols = 0
 
-                    format = ruleTryMatchResult.rule.format if ruleTryMatchResult.rule.attribute else self.format
-                    textType = ruleTryMatchResult.rule.textType or self.textType
+                format = ruleTryMatchResult.rule.format if ruleTryMatchResult.rule.attribute else self.format
+                textType = ruleTryMatchResult.rule.textType or self.textType
 
-                    highlightedSegments.append((ruleTryMatchResult.length,
-                                                format))
-                    textTypeMap += textType * ruleTryMatchResult.length
+                _appendSegment(highlightedSegments, ruleTryMatchResult.length, format)
+                _appendTextType(textTypeRuns, currentColumnIndex + ruleTryMatchResult.length, textType)
 
-                    currentColumnIndex += ruleTryMatchResult.length
-                    if ruleTryMatchResult.rule.context is not None:
-                        newContextStack = ruleTryMatchResult.rule.context.getNextContextStack(contextStack,
-                                                                                              ruleTryMatchResult.data)
-                        if newContextStack != contextStack:
-                            lineContinue = isinstance(ruleTryMatchResult.rule, LineContinue)
-
-                            return currentColumnIndex - startColumnIndex, newContextStack, highlightedSegments, textTypeMap, lineContinue
+                currentColumnIndex += ruleTryMatchResult.length
+                if ruleTryMatchResult.rule.context is not None:
+                    newContextStack = ruleTryMatchResult.rule.context.getNextContextStack(contextStack,
+                                                                                          ruleTryMatchResult.data)
+                    if newContextStack != contextStack:
+                        lineContinue = isinstance(ruleTryMatchResult.rule, LineContinue)
 
-                    break  # for loop
+                        return currentColumnIndex - startColumnIndex, newContextStack, lineContinue
             else:  # no matched rules
                 if self.fallthroughContext is not None:
                     newContextStack = self.fallthroughContext.getNextContextStack(contextStack)
                     if newContextStack != contextStack:
                         if countOfNotMatchedSymbols > 0:
-                            highlightedSegments.append((countOfNotMatchedSymbols, self.format))
-                            textTypeMap += [self.textType for i in range(countOfNotMatchedSymbols)]
-                        return (currentColumnIndex - startColumnIndex, newContextStack, highlightedSegments, textTypeMap, False)
+                            _appendSegment(highlightedSegments, countOfNotMatchedSymbols, self.format)
+                            _appendTextType(textTypeRuns, currentColumnIndex, self.textType)
+                        return (currentColumnIndex - startColumnIndex, newContextStack, False)
 
                 currentColumnIndex += 1
                 countOfNotMatchedSymbols += 1
 
         if countOfNotMatchedSymbols > 0:
-            highlightedSegments.append((countOfNotMatchedSymbols, self.format))
-            textTypeMap += [self.textType for i in range(countOfNotMatchedSymbols)]
+            _appendSegment(highlightedSegments, countOfNotMatchedSymbols, self.format)
+            _appendTextType(textTypeRuns, currentColumnIndex, self.textType)
 
         lineContinue = ruleTryMatchResult is not None and \
                        isinstance(ruleTryMatchResult.rule, LineContinue)
 
-        return currentColumnIndex - startColumnIndex, contextStack, highlightedSegments, textTypeMap, lineContinue
+        return currentColumnIndex - startColumnIndex, contextStack, lineContinue
 
 
 class Parser:
@@ -904,15 +1378,15 @@ class Parser:
     """
     def __init__(self, syntax, deliminatorSetAsString, lists, keywordsCaseSensitive, debugOutputEnabled):
         self.syntax = syntax
-        self.deliminatorSet = set(deliminatorSetAsString)
+        self.deliminatorSet = frozenset(deliminatorSetAsString)
         self.lists = lists
         self.keywordsCaseSensitive = keywordsCaseSensitive
-        # debugOutputEnabled is used only by cParser
+        self.debugOutputEnabled = debugOutputEnabled
 
     def setContexts(self, contexts, defaultContext):
         self.contexts = contexts
         self.defaultContext = defaultContext
-        self._defaultContextStack = ContextStack([self.defaultContext], [None])
+        self._defaultContextStack = ContextStack.make(None, self.defaultContext, None)
 
     def __str__(self):
         """Serialize.
@@ -921,7 +1395,7 @@ class Parser:
         res = 'Parser\n'
         for name, value in vars(self).items():
             if not name.startswith('_') and \
-               not name in ('defaultContext', 'deliminatorSet', 'contexts', 'lists', 'syntax') and \
+               not name in ('defaultContext', 'deliminatorSet', 'contexts', 'lists', 'syntax', 'debugOutputEnabled') and \
                not value is None:
                 res += '\t%s: %s\n' % (name, value)
 
@@ -936,35 +1410,29 @@ class Parser:
 
         return res
 
-    def highlightBlock(self, text, prevContextStack):
-        """Parse block and return ParseBlockFullResult
+    def _parseBlockPart(self, textToMatchObject, contextStack, currentColumnIndex, untilColumnIndex,
+                        highlightedSegments, textTypeRuns):
+        """Parse text from currentColumnIndex until untilColumnIndex or a bit further,
+        if a rule matches across it. Switches line end contexts, when reached end of the line.
+        textToMatchObject is created once for the line and is reused by all parts of it
 
-        return (lineData, highlightedSegments)
-          where lineData is (contextStack, textTypeMap)
-            where textTypeMap is a string of textType characters
+        Returns (currentColumnIndex, contextStack)
         """
-        if prevContextStack is not None:
-            contextStack = prevContextStack
-        else:
-            contextStack = self._defaultContextStack
-
-        highlightedSegments = []
+        text = textToMatchObject.wholeLineText
         lineContinue = False
-        currentColumnIndex = 0
-        textTypeMap = []
-        while currentColumnIndex < len(text):
-            _logger.debug('In context %s', contextStack.currentContext().name)
+        while currentColumnIndex < untilColumnIndex:
+            if self.debugOutputEnabled:
+                _logger.debug('In context %s', contextStack.currentContext().name)
 
-            textType = contextStack.currentContext().textType
-            length, newContextStack, segments, textTypeMapPart, lineContinue = \
-                        contextStack.currentContext().parseBlock(contextStack, currentColumnIndex, text)
+            length, newContextStack, lineContinue = \
+                        contextStack.currentContext().parseBlock(contextStack, currentColumnIndex, untilColumnIndex,
+                                                                 textToMatchObject,
+                                                                 highlightedSegments, textTypeRuns)
 
-            highlightedSegments += segments
             contextStack = newContextStack
-            textTypeMap += textTypeMapPart
             currentColumnIndex += length
 
-        if not lineContinue:
+        if currentColumnIndex >= len(text) and not lineContinue:
             while contextStack.currentContext().lineEndContext is not None:
                 oldStack = contextStack
                 contextStack = contextStack.currentContext().lineEndContext.getNextContextStack(contextStack)
@@ -975,8 +1443,60 @@ class Parser:
             if contextStack.currentContext().lineBeginContext is not None:
                 contextStack = contextStack.currentContext().lineBeginContext.getNextContextStack(contextStack)
 
-        lineData = (contextStack, textTypeMap)
+        return currentColumnIndex, contextStack
+
+    def highlightBlock(self, text, prevContextStack, releaseGil=False):
+        """Parse block and return ParseBlockFullResult
+        releaseGil is ignored, Python code can't release the GIL
+
+        return (lineData, highlightedSegments)
+          where lineData is (contextStack, textTypeMap)
+            where textTypeMap is a tuple of text type runs, see Syntax._getTextType()
+        """
+        if prevContextStack is not None:
+            contextStack = prevContextStack
+        else:
+            contextStack = self._defaultContextStack
+
+        highlightedSegments = []
+        textTypeRuns = []
+        textToMatchObject = TextToMatchObject(0, text, self.deliminatorSet, None)
+        currentColumnIndex, contextStack = self._parseBlockPart(textToMatchObject, contextStack, 0, len(text),
+                                                                highlightedSegments, textTypeRuns)
+
+        lineData = (contextStack, _makeTextTypeMap(textTypeRuns))
         return lineData, highlightedSegments
 
+    def highlightBlockPart(self, text, prevContextStack, partialLineState, maxLength, releaseGil=False):
+        """Parse about maxLength characters of a long line.
+        partialLineState is None for the first part of the line, and the value returned for the previous part otherwise.
+        The state can be used only once, with the same text.
+
+        return (lineData, partialLineState, highlightedSegments)
+          where lineData is None, until the last part has been parsed
+                partialLineState is None, when the last part has been parsed
+                highlightedSegments are segments of this part
+        """
+        if partialLineState is not None:
+            # the state keeps the text to match, therefore the line is not scanned again for every part
+            currentColumnIndex, contextStack, textTypeRuns, textToMatchObject = partialLineState
+        else:
+            currentColumnIndex = 0
+            contextStack = prevContextStack if prevContextStack is not None else self._defaultContextStack
+            textTypeRuns = []
+            textToMatchObject = TextToMatchObject(0, text, self.deliminatorSet, None)
+
+        highlightedSegments = []
+        untilColumnIndex = min(currentColumnIndex + max(maxLength, 1), len(text))
+        currentColumnIndex, contextStack = self._parseBlockPart(textToMatchObject, contextStack,
+                                                                currentColumnIndex, untilColumnIndex,
+                                                                highlightedSegments, textTypeRuns)
+
+        if currentColumnIndex >= len(text):
+            lineData = (contextStack, _makeTextTypeMap(textTypeRuns))
+            return lineData, None, highlightedSegments
+        else:
+            return None, (currentColumnIndex, contextStack, textTypeRuns, textToMatchObject), highlightedSegments
+
     def parseBlock(self, text, prevContextStack):
         return self.highlightBlock(text, prevContextStack)[0]
@@ -2,14 +2,28 @@
 Uses syntax module for doing the job
 """
 
+import bisect
+import collections
+import functools
+import logging
+import queue
+import threading
 import time
 
-from PyQt5.QtCore import QObject, QTimer, Qt, pyqtSlot
-from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QObject, Qt, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QColor, QFont, \
-                        QTextBlockUserData, QTextCharFormat, QTextLayout
+                        QTextBlockUserData, QTextCharFormat, QTextFormat, QTextLayout
 
 import qutepart.syntax
+import qutepart.perf
+from qutepart.globaltimer import GlobalTimer, globalTimer, widgetPriority
+from qutepart.syntax import NO_STYLE, STYLE_INDEX_BITS, STYLE_INDEX_MASK, extendSegments
+
+
+_logger = logging.getLogger('qutepart')
+
+# Format property, which keeps style index of the format. Used to restyle highlighted blocks without parsing
+_STYLE_INDEX_PROPERTY = QTextFormat.UserProperty + 1
 
 
 def _cmpFormatRanges(a, b):
@@ -37,84 +51,270 @@ def _formatRangeListsEqual(a, b):
 
 
 class _TextBlockUserData(QTextBlockUserData):
-    def __init__(self, data):
+    """Line data of the block, and context stack and text hash, with which the block has been parsed.
+    If the block text and the context stack of the previous block are not changed, the block is not parsed again
+    """
+    def __init__(self, data, contextStack, textHash):
         QTextBlockUserData.__init__(self)
         self.data = data
+        self.contextStack = contextStack
+        self.textHash = textHash
+
+
+class FormatTable:
+    """Style index -> QTextCharFormat table for a color theme. See qutepart.syntax.styleIndex().
+    Formats of styles of syntaxes, loaded later, are made on first use
+    """
+
+    def __init__(self, colorTheme):
+        self._colorTheme = colorTheme
+        self._formats = [None]  # NO_STYLE
+
+    def colorTheme(self):
+        return self._colorTheme
+
+    def setColorTheme(self, colorTheme):
+        self._colorTheme = colorTheme
+        self._formats = [None]
+
+    def format(self, styleIndex):
+        """QTextCharFormat of the style. None, if the text is not formatted
+        """
+        if styleIndex >= len(self._formats):
+            for style in qutepart.syntax.styles()[len(self._formats):]:
+                format = SyntaxHighlighter.formatConverterFunction(self._colorTheme.styleFormat(style))
+                if format is not None:
+                    format.setProperty(_STYLE_INDEX_PROPERTY, len(self._formats))
+                self._formats.append(format)
+
+        return self._formats[styleIndex]
 
 
-class GlobalTimer:
-    """All parsing and highlighting is done in main loop thread.
-    If parsing is being done for long time, main loop gets blocked.
-    Therefore SyntaxHighlighter controls, how long parsign is going, and, if too long,
-    schedules timer and releases main loop.
-    One global timer is used by all Qutepart instances, because main loop time usage
-    must not depend on opened files count
+class _DirtyBlocks:
+    """Set of numbers of blocks, which shall be highlighted.
+    Stored as sorted list of disjoint intervals (first, last), last is included
     """
 
     def __init__(self):
-        self._timer = QTimer(QApplication.instance())
-        self._timer.setSingleShot(True)
-        self._timer.timeout.connect(self._onTimer)
+        self._intervals = []
 
-        self._scheduledCallbacks = []
+    def __bool__(self):
+        return bool(self._intervals)
 
-    def isActive(self):
-        return self._timer.isActive()
+    def __contains__(self, blockNumber):
+        index = bisect.bisect_right(self._intervals, (blockNumber, float('inf'))) - 1
+        return index >= 0 and self._intervals[index][1] >= blockNumber
 
-    def scheduleCallback(self, callback):
-        if not callback in self._scheduledCallbacks:
-            self._scheduledCallbacks.append(callback)
-            self._timer.start()
+    def intervals(self):
+        return list(self._intervals)
 
-    def unScheduleCallback(self, callback):
-        if callback in self._scheduledCallbacks:
-            self._scheduledCallbacks.remove(callback)
+    def first(self):
+        """Number of the first dirty block
+        """
+        return self._intervals[0][0]
 
-        if not self._scheduledCallbacks:
-            self._timer.stop()
+    def firstInterval(self):
+        return self._intervals[0]
 
-    def isCallbackScheduled(self, callback):
-        return callback in self._scheduledCallbacks
+    def add(self, first, last):
+        """Add blocks. Overlapping and adjacent intervals are merged
+        """
+        intervals = []
+        for intervalFirst, intervalLast in self._intervals:
+            if intervalLast < first - 1 or intervalFirst > last + 1:
+                intervals.append((intervalFirst, intervalLast))
+            else:
+                first = min(first, intervalFirst)
+                last = max(last, intervalLast)
 
-    def _onTimer(self):
-        if self._scheduledCallbacks:
-            callback = self._scheduledCallbacks.pop()
-            callback()
-        if self._scheduledCallbacks:
-            self._timer.start()
+        bisect.insort(intervals, (first, last))
+        self._intervals = intervals
 
+    def replaceBlocks(self, first, oldLast, newLast):
+        """Blocks first..oldLast have been replaced with blocks first..newLast.
+        Following blocks are renumbered, new blocks are dirty
+        """
+        delta = newLast - oldLast
+        intervals = []
+        for intervalFirst, intervalLast in self._intervals:
+            if intervalLast < first:
+                intervals.append((intervalFirst, intervalLast))
+            elif intervalFirst > oldLast:
+                intervals.append((intervalFirst + delta, intervalLast + delta))
+            else:  # overlaps replaced blocks
+                intervals.append((min(intervalFirst, first), max(intervalLast + delta, newLast)))
+
+        self._intervals = intervals
+        self.add(first, newLast)
+
+    def discardUntil(self, blockNumber):
+        """Remove blocks with numbers not bigger than blockNumber
+        """
+        while self._intervals and self._intervals[0][0] <= blockNumber:
+            first, last = self._intervals[0]
+            if last <= blockNumber:
+                del self._intervals[0]
+            else:
+                self._intervals[0] = (blockNumber + 1, last)
 
-"""Global var, because main loop time usage shall not depend on Qutepart instances count
+    def clear(self):
+        self._intervals = []
 
-Pyside crashes, if this variable is a class field
-"""
-_gLastChangeTime = -777.
+
+class _ParsingThread:
+    """Background thread, which parses snapshots of block texts when threaded highlighting is enabled.
+    One thread is used by all Qutepart instances. It is started on first use
+    """
+
+    def __init__(self):
+        self._tasks = queue.Queue()
+        self._thread = None
+
+    def addTask(self, task):
+        """Call the task in the thread
+        """
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='Qutepart parsing', daemon=True)
+            self._thread.start()
+
+        self._tasks.put(task)
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            try:
+                task()
+            except Exception:
+                _logger.exception('Failed to parse text in the background thread')
+
+
+class _ParsingJob:
+    """Parsing of a range of blocks in the background thread.
+
+    The main thread sends chunks of block snapshots
+    (blockNumber, revision, text, contextStackBeforeParsing, textHashBeforeParsing, lineDataBeforeParsing, dirty).
+    The thread parses them and emits parsed((job, results, finished)),
+    where results are (blockNumber, revision, textHash, contextStack, lineData, highlightedSegments).
+    contextStack is the stack, with which the block has been parsed.
+    A dirty block, which has been parsed before with the same text and context stack, is not parsed again,
+    its result has highlightedSegments None.
+    Parsing finishes at the end of the document, or at the first not dirty block, which is up to date
+    """
+
+    def __init__(self, syntax, prevLineData, longLinePartLength, parsed):
+        self.cancelled = False  # set by the main thread, if results are not needed anymore
+        self._syntax = syntax
+        self._contextStack = prevLineData[0] if prevLineData is not None else None
+        self._longLinePartLength = longLinePartLength
+        self._parsed = parsed
+        self._finished = False
+
+    def parseChunk(self, chunk, isLast):
+        """Parse chunk of snapshots. Called in the thread
+        """
+        if self.cancelled or self._finished:
+            return
+
+        results = []
+        for blockNumber, revision, text, oldContextStack, oldTextHash, oldLineData, dirty in chunk:
+            textHash = hash(text)
+            contextStack = self._contextStack
+            if oldTextHash == textHash and oldContextStack == contextStack:
+                if not dirty:
+                    self._finished = True  # this and following blocks are up to date
+                    break
+
+                # Qt reports an edit block as one range. Blocks in it might be not changed
+                results.append((blockNumber, revision, textHash, contextStack, oldLineData, None))
+                self._contextStack = oldLineData[0] if oldLineData is not None else None
+                continue
+
+            lineData, highlightedSegments = self._highlightBlock(text)
+            results.append((blockNumber, revision, textHash, contextStack, lineData, highlightedSegments))
+            self._contextStack = lineData[0] if lineData is not None else None
+
+        if not self.cancelled:
+            try:
+                self._parsed.emit((self, results, self._finished or isLast))
+            except RuntimeError:  # highlighter has been deleted
+                pass
+
+    def _highlightBlock(self, text):
+        # the last argument is releaseGil. The C parser releases the GIL while matching reg exps
+        if len(text) <= self._longLinePartLength:
+            return self._syntax.highlightBlock(text, self._contextStack, True)
+
+        # long lines are parsed by parts, the main thread may take the GIL between parts
+        partialLineState, highlightedSegments = None, []
+        while True:
+            lineData, partialLineState, segments = \
+                self._syntax.highlightBlockPart(text, self._contextStack, partialLineState, self._longLinePartLength,
+                                                True)
+            extendSegments(highlightedSegments, segments)
+            if partialLineState is None:
+                return lineData, highlightedSegments
 
 
 class SyntaxHighlighter(QObject):
 
-    # when initially parsing text, it is better, if highlighted text is drawn without flickering
+    # emitted by the parsing thread
+    _chunkParsed = pyqtSignal(object)
+
+    # when initially parsing text, it is better, if highlighted text is drawn without flickering.
+    # Parsing time is latency target multiplied by the factor, but not longer than the limit
+    _BIG_CHANGE_LATENCY_FACTOR = 8
     _MAX_PARSING_TIME_BIG_CHANGE_SEC = 0.4
-    # when user is typing text - response shall be quick
+    # when user is typing text - response shall be quick.
+    # Parsing time is the adaptive frame budget of the global timer, but not longer than the limit
     _MAX_PARSING_TIME_SMALL_CHANGE_SEC = 0.02
-
-    _globalTimer = GlobalTimer()
-
-    def __init__(self, syntax, textEdit):
+    # longer lines are parsed by parts, time is checked after every part
+    _LONG_LINE_PART_LENGTH = 4096
+    # context stack of every Nth parsed block is saved, it is used to highlight visible blocks speculatively
+    _CHECKPOINT_INTERVAL = 1000
+    # in threaded mode blocks are sent to the parsing thread by chunks
+    _THREAD_CHUNK_SIZE = 1000
+    # in threaded mode the main thread only applies parsing results. It shall not miss frames
+    _MAX_APPLYING_TIME_SEC = 0.005
+
+    _parsingThread = _ParsingThread()
+
+    def __init__(self, syntax, textEdit, formatTable=None):
         QObject.__init__(self, textEdit.document())
 
         self._syntax = syntax
         self._textEdit = textEdit
+        self._formatTable = formatTable or FormatTable(qutepart.syntax.defaultColorTheme())
         self._document = textEdit.document()
-
-        # can't store references to block, Qt crashes if block removed
-        self._pendingBlockNumber = None
-        self._pendingAtLeastUntilBlockNumber = None
-
+        self._globalTimer = globalTimer()
+
+        # can't store references to block, Qt crashes if block removed.
+        # Changed blocks. When a block is highlighted and its line data is changed, the next block becomes dirty
+        self._dirtyBlocks = _DirtyBlocks()
+        self._blockCount = self._document.blockCount()
+        # (partialLineState, highlightedSegments) of partially parsed long first dirty block
+        self._pendingPartialLine = None
+        # {blockNumber: contextStack} after the block. Only real (not speculative) parsing results
+        self._checkpoints = {}
+        # visible blocks, which have been highlighted before parsing reached them
+        self._speculativeBlockNumbers = set()
+        # threaded mode state
+        self._job = None
+        self._jobParsed = False  # the thread has parsed all blocks of the job
+        self._jobBlockNumber = None  # the next block, which result shall be applied
+        self._chunksInThread = 0
+        self._snapshotBlockNumber = None  # next block to be sent to the thread. None if all sent
+        self._parsedResults = collections.deque()
+        self._restyleBlockNumber = None  # the next block to be restyled after a color theme change
+        # performance counters, see qutepart.perf
+        self._counters = qutepart.perf.HighlightingCounters()
+        self._loadTime = time.time()  # time of the document load, None if fully highlighted after it
+        qutepart.perf._register(self)
+
+        self._chunkParsed.connect(self._onChunkParsed)
         self._document.contentsChange.connect(self._onContentsChange)
 
         charsAdded = self._document.lastBlock().position() + self._document.lastBlock().length()
-        self._onContentsChange(0, 0, charsAdded, zeroTimeout=self._wasChangedJustBefore())
+        self._onContentsChange(0, 0, charsAdded, zeroTimeout=self._globalTimer.wasChangedJustBefore())
 
     def terminate(self):
         try:
@@ -122,7 +322,15 @@ class SyntaxHighlighter(QObject):
         except TypeError:
             pass
 
+        qutepart.perf._unregister(self)
         self._globalTimer.unScheduleCallback(self._onContinueHighlighting)
+        self._globalTimer.unScheduleCallback(self._onContinueRestyling)
+        self._restyleBlockNumber = None
+        self._cancelJob()
+        self._dirtyBlocks.clear()
+        self._pendingPartialLine = None
+        self._checkpoints = {}
+        self._speculativeBlockNumbers = set()
         block = self._document.firstBlock()
         while block.isValid():
             block.layout().setAdditionalFormats([])
@@ -136,10 +344,46 @@ class SyntaxHighlighter(QObject):
         """
         return self._syntax
 
+    def counters(self):
+        """Copy of performance counters. See qutepart.perf.HighlightingCounters
+        """
+        return self._counters.copy()
+
+    def resetCounters(self):
+        self._counters = qutepart.perf.HighlightingCounters()
+
     def isInProgress(self):
-        """Highlighting is in progress
+        """Highlighting or restyling is in progress
         """
-        return self._globalTimer.isCallbackScheduled(self._onContinueHighlighting)
+        return self._job is not None or \
+               self._globalTimer.isCallbackScheduled(self._onContinueHighlighting) or \
+               self._restyleBlockNumber is not None
+
+    def updatePriority(self):
+        """Update priority of scheduled highlighting.
+        Called, when the editor has been shown, hidden, focused or unfocused
+        """
+        if self._globalTimer.isCallbackScheduled(self._onContinueHighlighting):
+            self._scheduleCallback()
+        if self._globalTimer.isCallbackScheduled(self._onContinueRestyling):
+            self._globalTimer.scheduleCallback(self._onContinueRestyling, widgetPriority(self._textEdit))
+
+    def restyle(self):
+        """Formats of the format table have been changed, i.e. color theme has been changed.
+        Apply new formats to highlighted blocks without parsing.
+        Visible blocks are restyled immediately, other blocks in the background
+        """
+        viewportBottom = self._textEdit.viewport().rect().bottom()
+        contentOffset = self._textEdit.contentOffset()
+
+        block = self._textEdit.firstVisibleBlock()
+        while block.isValid() and \
+              self._textEdit.blockBoundingGeometry(block).translated(contentOffset).top() <= viewportBottom:
+            self._restyleBlock(block)
+            block = block.next()
+
+        self._restyleBlockNumber = 0
+        self._globalTimer.scheduleCallback(self._onContinueRestyling, widgetPriority(self._textEdit))
 
     def isCode(self, block, column):
         """Check if character at column is a a code
@@ -200,120 +444,432 @@ class SyntaxHighlighter(QObject):
         else:
             return None
 
-    def _wasChangedJustBefore(self):
-        """Check if ANY Qutepart instance was changed just before"""
-        return time.time() <= _gLastChangeTime + 1
-
     @pyqtSlot(int, int, int)
     def _onContentsChange(self, from_, charsRemoved, charsAdded, zeroTimeout=False):
-        global _gLastChangeTime
-        firstBlock = self._document.findBlock(from_)
+        firstBlockNumber = self._document.findBlock(from_).blockNumber()
         untilBlock = self._document.findBlock(from_ + charsAdded)
+        if not untilBlock.isValid():
+            untilBlock = self._document.lastBlock()
+        untilBlockNumber = untilBlock.blockNumber()
+
+        if from_ == 0 and charsAdded > 0 and \
+           charsAdded >= self._document.characterCount() - 1:  # whole text has been replaced
+            self._loadTime = time.time()
+
+        blockCount = self._document.blockCount()
+        oldUntilBlockNumber = untilBlockNumber - (blockCount - self._blockCount)
+        self._blockCount = blockCount
+
+        if self._restyleBlockNumber is not None:  # blocks might be renumbered
+            self._restyleBlockNumber = min(self._restyleBlockNumber, firstBlockNumber)
+
+        self._globalTimer.unScheduleCallback(self._onContinueHighlighting)
+        self._cancelJob()
 
-        if self._globalTimer.isCallbackScheduled(self._onContinueHighlighting):  # have not finished task.
-            """ Intersect ranges. Might produce a lot of extra highlighting work
-            More complicated algorithm might be invented later
-            """
-            if self._pendingBlockNumber < firstBlock.blockNumber():
-                firstBlock = self._document.findBlockByNumber(self._pendingBlockNumber)
-            if self._pendingAtLeastUntilBlockNumber > untilBlock.blockNumber():
-                untilBlockNumber = min(self._pendingAtLeastUntilBlockNumber,
-                                       self._document.blockCount() - 1)
-                untilBlock = self._document.findBlockByNumber(untilBlockNumber)
-            self._globalTimer.unScheduleCallback(self._onContinueHighlighting)
+        if self._dirtyBlocks and firstBlockNumber <= self._dirtyBlocks.first():
+            self._pendingPartialLine = None  # partially parsed block might be changed
+
+        """Previously changed blocks, which haven't been highlighted yet, are kept separately from the new change.
+        Blocks after the change are renumbered, if blocks have been inserted or removed
+        """
+        self._dirtyBlocks.replaceBlocks(firstBlockNumber, oldUntilBlockNumber, untilBlockNumber)
+        self._dropCheckpoints(firstBlockNumber)
+        self._speculativeBlockNumbers = set()
 
         if zeroTimeout:
             timeout = 0  # no parsing, only schedule
         elif charsAdded > 20 and \
-             (not self._wasChangedJustBefore()):
+             (not self._globalTimer.wasChangedJustBefore()):
             """Use big timeout, if change is really big and previous big change was long time ago"""
-            timeout = self._MAX_PARSING_TIME_BIG_CHANGE_SEC
+            timeout = min(self._globalTimer.latencyTarget() * self._BIG_CHANGE_LATENCY_FACTOR,
+                          self._MAX_PARSING_TIME_BIG_CHANGE_SEC)
         else:
-            timeout = self._MAX_PARSING_TIME_SMALL_CHANGE_SEC
+            timeout = self._smallChangeTimeout()
+
+        if self._textEdit.threadedHighlighting:
+            timeout = min(timeout, self._smallChangeTimeout())  # the rest is parsed in the thread
+
+        self._globalTimer.notifyChange()
 
-        _gLastChangeTime = time.time()
+        self._highlightDirtyBlocks(timeout)
 
-        self._highlighBlocks(firstBlock, untilBlock, timeout)
+    def _smallChangeTimeout(self):
+        return min(self._globalTimer.frameBudget(), self._MAX_PARSING_TIME_SMALL_CHANGE_SEC)
 
     def _onContinueHighlighting(self):
-        self._highlighBlocks(self._document.findBlockByNumber(self._pendingBlockNumber),
-                             self._document.findBlockByNumber(self._pendingAtLeastUntilBlockNumber),
-                             self._MAX_PARSING_TIME_SMALL_CHANGE_SEC)
+        if self._textEdit.viewportFirstHighlighting:
+            self._highlightVisibleBlocksSpeculatively()
 
-    def _highlighBlocks(self, fromBlock, atLeastUntilBlock, timeout):
-        endTime = time.time() + timeout
+        if self._job is not None:
+            self._applyParsedResults()
+        else:
+            self._highlightDirtyBlocks(self._globalTimer.timeLeft())
 
-        block = fromBlock
-        lineData = self._lineData(block.previous())
+    def _highlightDirtyBlocks(self, timeout):
+        """Highlight dirty blocks from the first one.
+        After a dirty block following blocks are highlighted, while their text or context stack of the previous block
+        differs from the one, with which they were parsed last time
+        """
+        startTime = time.time()
+        endTime = startTime + timeout
+
+        while self._dirtyBlocks:
+            blockNumber = self._dirtyBlocks.first()
+            block = self._document.findBlockByNumber(blockNumber)
+            lineData = self._lineData(block.previous())
+
+            while True:
+                if time.time() >= endTime:  # time is over, schedule parsing later and release event loop
+                    if timeout > 0:  # zero timeout only schedules parsing, it is not a slice
+                        self._onSliceFinished(startTime, True)
+                    self._scheduleContinueHighlighting()
+                    return
+
+                finished, lineData = self._highlightBlock(block, lineData, endTime)
+                if not finished:
+                    self._onSliceFinished(startTime, True)
+                    self._scheduleContinueHighlighting()
+                    return
+
+                self._dirtyBlocks.discardUntil(blockNumber)
+                if blockNumber % self._CHECKPOINT_INTERVAL == 0:
+                    self._checkpoints[blockNumber] = lineData[0] if lineData is not None else None
+                block = block.next()
+                blockNumber += 1
+
+                if not block.isValid():
+                    break
+                if blockNumber not in self._dirtyBlocks:
+                    if self._isUpToDate(block, lineData):
+                        break  # following blocks are not affected, continue from the next dirty block
+                    self._dirtyBlocks.add(blockNumber, blockNumber)  # context stack has changed
+
+        if timeout > 0:
+            self._onSliceFinished(startTime, False)
+        self._onHighlightingFinished()
+
+    def _onSliceFinished(self, startTime, rescheduled):
+        sliceTime = time.time() - startTime
+        counters = self._counters
+        counters.slices += 1
+        counters.sliceTime += sliceTime
+        counters.maxSliceTime = max(counters.maxSliceTime, sliceTime)
+        if rescheduled:
+            counters.slicesRescheduled += 1
+        self._textEdit.highlightingSliceFinished.emit(sliceTime)
+
+    def _onHighlightingFinished(self):
+        # sucessfully finished, reset pending tasks
+        self._speculativeBlockNumbers = set()
 
-        while block.isValid() and block != atLeastUntilBlock:
-            if time.time() >= endTime:  # time is over, schedule parsing later and release event loop
-                self._pendingBlockNumber = block.blockNumber()
-                self._pendingAtLeastUntilBlockNumber = atLeastUntilBlock.blockNumber()
-                self._globalTimer.scheduleCallback(self._onContinueHighlighting)
-                return
+        if self._loadTime is not None:
+            fullHighlightingTime = time.time() - self._loadTime
+            self._loadTime = None
+            self._counters.fullHighlightings += 1
+            self._counters.fullHighlightingTime += fullHighlightingTime
+            self._counters.lastFullHighlightingTime = fullHighlightingTime
+            self._textEdit.highlightingFinished.emit(fullHighlightingTime)
 
-            contextStack = lineData[0] if lineData is not None else None
-            if block.length() < 4096:
-                lineData, highlightedSegments = self._syntax.highlightBlock(block.text(), contextStack)
-            else:
-                """Parser freezes for a long time, if line is too long
-                invalid parsing results are still better, than freeze
-                """
-                lineData, highlightedSegments = None, []
-            if lineData is not None:
-                block.setUserData(_TextBlockUserData(lineData))
-            else:
-                block.setUserData(None)
+        """Emit sizeChanged when highlighting finished, because document size might change.
+        See andreikop/enki issue #191
+        """
+        documentLayout = self._textEdit.document().documentLayout()
+        documentLayout.documentSizeChanged.emit(documentLayout.documentSize())
 
-            self._applyHighlightedSegments(block, highlightedSegments)
-            block = block.next()
+    def _scheduleContinueHighlighting(self):
+        if self._textEdit.threadedHighlighting:
+            self._startJob()
+        else:
+            self._scheduleCallback()
 
-        # reached atLeastUntilBlock, now parse next only while data changed
-        prevLineData = self._lineData(block)
-        while block.isValid():
-            if time.time() >= endTime:  # time is over, schedule parsing later and release event loop
-                self._pendingBlockNumber = block.blockNumber()
-                self._pendingAtLeastUntilBlockNumber = atLeastUntilBlock.blockNumber()
-                self._globalTimer.scheduleCallback(self._onContinueHighlighting)
+    def _scheduleCallback(self):
+        self._globalTimer.scheduleCallback(self._onContinueHighlighting, widgetPriority(self._textEdit))
+
+    def _startJob(self):
+        """Continue highlighting from the first dirty block in the parsing thread
+        """
+        self._pendingPartialLine = None  # the thread parses the block from the beginning
+        blockNumber = self._dirtyBlocks.first()
+        block = self._document.findBlockByNumber(blockNumber)
+        self._job = _ParsingJob(self._syntax,
+                                self._lineData(block.previous()),
+                                self._LONG_LINE_PART_LENGTH,
+                                self._chunkParsed)
+        self._jobParsed = False
+        self._jobBlockNumber = blockNumber
+        self._chunksInThread = 0
+        self._snapshotBlockNumber = blockNumber
+        self._parsedResults.clear()
+        self._sendChunks()
+
+    def _cancelJob(self):
+        if self._job is not None:
+            self._job.cancelled = True
+            self._job = None
+            self._parsedResults.clear()
+            if self._jobBlockNumber < self._document.blockCount():
+                # results of the job for this block and following have not been applied
+                self._dirtyBlocks.add(self._jobBlockNumber, self._jobBlockNumber)
+
+    def _sendChunks(self):
+        """Send snapshots of next blocks to the parsing thread.
+        Two chunks are kept in the thread, so that it doesn't wait for the main thread.
+        Parsing doesn't go too far ahead of applying results
+        """
+        while self._snapshotBlockNumber is not None and \
+              self._chunksInThread < 2 and \
+              len(self._parsedResults) < self._THREAD_CHUNK_SIZE:
+            blockNumber = self._snapshotBlockNumber
+            block = self._document.findBlockByNumber(blockNumber)
+            chunk = []
+            while block.isValid() and len(chunk) < self._THREAD_CHUNK_SIZE:
+                dataObject = block.userData()
+                if dataObject is not None:
+                    contextStack, textHash, lineData = dataObject.contextStack, dataObject.textHash, dataObject.data
+                else:
+                    contextStack, textHash, lineData = None, None, None
+                chunk.append((blockNumber, block.revision(), block.text(),
+                              contextStack, textHash, lineData, blockNumber in self._dirtyBlocks))
+                block = block.next()
+                blockNumber += 1
+
+            isLast = not block.isValid()
+            self._snapshotBlockNumber = None if isLast else blockNumber
+            self._chunksInThread += 1
+            self._parsingThread.addTask(functools.partial(self._job.parseChunk, chunk, isLast))
+
+    @pyqtSlot(object)
+    def _onChunkParsed(self, args):
+        job, results, finished = args
+        if job is not self._job:  # cancelled
+            return
+
+        self._chunksInThread -= 1
+        self._parsedResults.extend(results)
+        if finished:
+            self._jobParsed = True
+            self._snapshotBlockNumber = None
+
+        self._scheduleCallback()
+
+    def _applyParsedResults(self):
+        """Apply results of the parsing thread not longer than _MAX_APPLYING_TIME_SEC
+        and time left in the global timer frame
+        """
+        startTime = time.time()
+        endTime = startTime + min(self._MAX_APPLYING_TIME_SEC, self._globalTimer.timeLeft())
+
+        block = None
+        while self._parsedResults and time.time() < endTime:
+            blockNumber, revision, textHash, contextStack, lineData, highlightedSegments = \
+                self._parsedResults.popleft()
+            block = block.next() if block is not None else self._document.findBlockByNumber(blockNumber)
+
+            if block.revision() != revision:  # changed after snapshot was made. Parse it again
+                self._cancelJob()
+                self._scheduleContinueHighlighting()
                 return
-            contextStack = lineData[0] if lineData is not None else None
-            lineData, highlightedSegments = self._syntax.highlightBlock(block.text(), contextStack)
-            if lineData is not None:
-                block.setUserData(_TextBlockUserData(lineData))
-            else:
-                block.setUserData(None)
 
-            self._applyHighlightedSegments(block, highlightedSegments)
-            if prevLineData == lineData:
-                break
+            if highlightedSegments is None:  # up to date, not parsed
+                self._counters.blocksUpToDate += 1
+            else:
+                self._setLineData(block, lineData, contextStack, textHash)
+                self._applyHighlightedSegments(block, highlightedSegments)
+                self._counters.blocksParsed += 1
+                self._counters.charactersParsed += block.length() - 1
+            self._dirtyBlocks.discardUntil(blockNumber)
+            self._jobBlockNumber = blockNumber + 1
+
+        self._onSliceFinished(startTime, bool(self._parsedResults) or not self._jobParsed)
+
+        if self._parsedResults:
+            self._scheduleCallback()
+        elif self._jobParsed:
+            self._job = None
+            self._highlightDirtyBlocks(self._globalTimer.timeLeft())  # the next changed blocks, if any
+            return
+
+        self._sendChunks()
+
+    def _isUpToDate(self, block, prevLineData):
+        """Check if the block has been parsed with the same text and context stack of the previous block
+        """
+        dataObject = block.userData()
+        contextStack = prevLineData[0] if prevLineData is not None else None
+        return dataObject is not None and \
+               dataObject.contextStack == contextStack and \
+               dataObject.textHash == hash(block.text())
+
+    def _highlightBlock(self, block, prevLineData, endTime):
+        """Highlight the block and save its line data.
+        The block is not parsed, if it is up to date.
+        Long lines are parsed by parts. If the time is over before the last part,
+        the state is saved to continue parsing later.
+        Formats are applied only when the line has been parsed, because Qt lays out whole line on every change
+
+        Returns (finished, lineData)
+        """
+        if self._pendingPartialLine is None and self._isUpToDate(block, prevLineData):
+            self._counters.blocksUpToDate += 1
+            return True, self._lineData(block)
 
-            block = block.next()
-            prevLineData = self._lineData(block)
+        contextStack = prevLineData[0] if prevLineData is not None else None
+        text = block.text()
 
-        # sucessfully finished, reset pending tasks
-        self._pendingBlockNumber = None
-        self._pendingAtLeastUntilBlockNumber = None
+        if len(text) <= self._LONG_LINE_PART_LENGTH and self._pendingPartialLine is None:
+            lineData, highlightedSegments = self._syntax.highlightBlock(text, contextStack)
+        else:
+            if self._pendingPartialLine is not None:
+                partialLineState, highlightedSegments = self._pendingPartialLine
+                self._pendingPartialLine = None
+            else:
+                partialLineState, highlightedSegments = None, []
+
+            while True:
+                lineData, partialLineState, segments = \
+                    self._syntax.highlightBlockPart(text, contextStack, partialLineState, self._LONG_LINE_PART_LENGTH)
+                extendSegments(highlightedSegments, segments)
+                if partialLineState is None:
+                    break
+
+                if time.time() >= endTime:
+                    self._pendingPartialLine = (partialLineState, highlightedSegments)
+                    return False, None
+
+        self._counters.blocksParsed += 1  # count long lines once, not on every resumed slice
+        self._counters.charactersParsed += len(text)
+        self._setLineData(block, lineData, contextStack, hash(text))
+        self._applyHighlightedSegments(block, highlightedSegments)
+        return True, lineData
+
+    def _setLineData(self, block, lineData, contextStack, textHash):
+        block.setUserData(_TextBlockUserData(lineData, contextStack, textHash))
+
+    def _dropCheckpoints(self, fromBlockNumber):
+        """Drop checkpoints, which might be invalid after the block has been changed
+        """
+        for blockNumber in [number for number in self._checkpoints if number >= fromBlockNumber]:
+            del self._checkpoints[blockNumber]
 
-        """Emit sizeChanged when highlighting finished, because document size might change.
-        See andreikop/enki issue #191
+    def _speculativeContextStack(self, block):
+        """Guess context stack for the block, which hasn't been reached by parsing yet.
+        Previous block data is used if available (might be outdated or speculative),
+        then the nearest checkpoint, then the default context
         """
-        documentLayout = self._textEdit.document().documentLayout()
-        documentLayout.documentSizeChanged.emit(documentLayout.documentSize())
+        prevLineData = self._lineData(block.previous())
+        if prevLineData is not None:
+            return prevLineData[0]
+
+        blockNumber = block.blockNumber() - 1
+        checkpointNumber = blockNumber - blockNumber % self._CHECKPOINT_INTERVAL
+        while checkpointNumber >= 0:
+            if checkpointNumber in self._checkpoints:
+                return self._checkpoints[checkpointNumber]
+            checkpointNumber -= self._CHECKPOINT_INTERVAL
+
+        return None
+
+    def _highlightVisibleBlocksSpeculatively(self):
+        """Highlight visible dirty blocks, which haven't been reached by parsing yet,
+        so that a user doesn't wait until everything above them is parsed.
+        Context stack is guessed. The blocks stay dirty,
+        therefore parsing reaches them later and corrects highlighting, if the guess was wrong
+        """
+        if not self._dirtyBlocks:
+            return
+        firstDirtyBlockNumber = self._dirtyBlocks.first()
+
+        viewportBottom = self._textEdit.viewport().rect().bottom()
+        contentOffset = self._textEdit.contentOffset()
+
+        block = self._textEdit.firstVisibleBlock()
+        blockNumber = block.blockNumber()
+        contextStack = None
+        lastHighlightedBlockNumber = None
+
+        while block.isValid() and \
+              self._textEdit.blockBoundingGeometry(block).translated(contentOffset).top() <= viewportBottom:
+            if blockNumber > firstDirtyBlockNumber and \
+               blockNumber in self._dirtyBlocks and \
+               blockNumber not in self._speculativeBlockNumbers:
+                text = block.text()
+                if len(text) > self._LONG_LINE_PART_LENGTH:
+                    self._counters.longLinesSkipped += 1
+                    break  # too long for speculative highlighting, will be parsed later
+
+                if lastHighlightedBlockNumber != blockNumber - 1:
+                    contextStack = self._speculativeContextStack(block)
+
+                dataObject = block.userData()
+                if dataObject is not None and \
+                   dataObject.contextStack == contextStack and \
+                   dataObject.textHash == hash(text):
+                    lineData = dataObject.data  # parsed before with the same text and context stack
+                    self._counters.blocksUpToDate += 1
+                else:
+                    lineData, highlightedSegments = self._syntax.highlightBlock(text, contextStack)
+                    self._counters.blocksParsed += 1
+                    self._counters.charactersParsed += len(text)
+                    self._setLineData(block, lineData, contextStack, hash(text))
+                    self._applyHighlightedSegments(block, highlightedSegments)
+                contextStack = lineData[0] if lineData is not None else None
+
+                self._speculativeBlockNumbers.add(blockNumber)
+                lastHighlightedBlockNumber = blockNumber
+
+            block = block.next()
+            blockNumber += 1
 
     def _applyHighlightedSegments(self, block, highlightedSegments):
         ranges = []
         currentPos = 0
-
-        for length, format in highlightedSegments:
-            if format is not None:  # might be in incorrect syntax file
-                range = QTextLayout.FormatRange()
-                range.format = format
-                range.start = currentPos
-                range.length = length
-                ranges.append(range)
+        formatTable = self._formatTable
+
+        for segment in highlightedSegments:
+            length = segment >> STYLE_INDEX_BITS
+            styleIndex = segment & STYLE_INDEX_MASK
+            if styleIndex != NO_STYLE:
+                format = formatTable.format(styleIndex)
+                if format is not None:
+                    range = QTextLayout.FormatRange()
+                    range.format = format
+                    range.start = currentPos
+                    range.length = length
+                    ranges.append(range)
             currentPos += length
 
         if not _formatRangeListsEqual(block.layout().additionalFormats(), ranges):
             block.layout().setAdditionalFormats(ranges)
             self._document.markContentsDirty(block.position(), block.length())
+        else:
+            self._counters.formatsUnchanged += 1
+
+    def _restyleBlock(self, block):
+        """Replace formats of the highlighted block with formats of the format table
+        """
+        ranges = block.layout().additionalFormats()
+        changed = False
+        for range in ranges:
+            styleIndex = range.format.intProperty(_STYLE_INDEX_PROPERTY)
+            if styleIndex != NO_STYLE:
+                format = self._formatTable.format(styleIndex)
+                if format is not None and range.format != format:
+                    range.format = format
+                    changed = True
+
+        if changed:
+            block.layout().setAdditionalFormats(ranges)
+            self._document.markContentsDirty(block.position(), block.length())
+
+    def _onContinueRestyling(self):
+        endTime = time.time() + self._globalTimer.timeLeft()
+        block = self._document.findBlockByNumber(self._restyleBlockNumber)
+        while block.isValid():
+            self._restyleBlock(block)
+            block = block.next()
+            if block.isValid() and time.time() >= endTime:
+                self._restyleBlockNumber = block.blockNumber()
+                self._globalTimer.scheduleCallback(self._onContinueRestyling, widgetPriority(self._textEdit))
+                return
+
+        self._restyleBlockNumber = None
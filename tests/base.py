@@ -12,6 +12,11 @@ from PyQt5.QtCore import Qt
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 sys.path.insert(0, os.path.abspath('.'))
 
+import qutepart.syntax.loader
+
+# tests don't write to the user's cache
+qutepart.syntax.loader.cacheDirectory = None
+
 # Create a single, persistent QApplication for use in all tests.
 papp = QApplication(sys.argv)
 
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import os
+import subprocess
 import sys
 import unittest
 
@@ -343,5 +344,19 @@ class LinesWin(Lines):
         super(LinesWin, self).setUp()
         self.qpart.eol = '\r\n'
 
+
+class Import(unittest.TestCase):
+    def test_lazy_modules(self):
+        """Vim mode and the highlighter are not imported until used
+        """
+        script = 'import sys, qutepart; print(" ".join(sorted(sys.modules)))'
+        topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+        modules = subprocess.check_output([sys.executable, '-c', script],
+                                          cwd=topLevelPath, universal_newlines=True).split()
+        self.assertIn('qutepart', modules)
+        for name in ('qutepart.vim', 'qutepart.syntaxhlighter', 'qutepart.syntax.loader', 'platform'):
+            self.assertNotIn(name, modules)
+
+
 if __name__ == '__main__':
     unittest.main()
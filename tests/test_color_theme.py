@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import base
+
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QApplication
+
+from qutepart import Qutepart
+from qutepart.syntax import TextFormat, textFormat, unpackSegments
+from qutepart.syntax.colortheme import ColorTheme
+
+
+def _keywordColor(qpart, lineNumber):
+    """Color of the first format range of the line
+    """
+    block = qpart.document().findBlockByNumber(lineNumber)
+    return block.layout().additionalFormats()[0].format.foreground().color()
+
+
+class StyleTest(unittest.TestCase):
+    app = base.papp  # app crashes, if created more than once
+
+    def test_text_format(self):
+        qpart = Qutepart()
+        syntax = qpart._globalSyntaxManager.getSyntax(languageName='Python')
+        lineData, segments = syntax.highlightBlock('return 1', None)
+        length, styleIndex = next(unpackSegments(segments))
+        self.assertEqual(length, len('return'))
+        self.assertTrue(textFormat(styleIndex).bold)
+
+        theme = ColorTheme(TextFormat)
+        theme.format['dsControlFlow'] = TextFormat(color='#ff0000')
+        self.assertEqual(textFormat(styleIndex, theme).color, '#ff0000')
+        self.assertFalse(textFormat(styleIndex, theme).bold)
+        qpart.terminate()
+
+
+class ThemeTest(unittest.TestCase):
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        self.qpart = Qutepart()
+        self.qpart.lines = ['import os  # comment'] * 5000
+        self.qpart.detectSyntax(language='Python')
+        self.qpart.show()
+        self._waitHighlightingFinished()
+
+        self.syntax = self.qpart._highlighter.syntax()
+        self.parsedLines = []
+        highlightBlock = self.syntax.highlightBlock
+
+        def countingHighlightBlock(text, contextStack):
+            self.parsedLines.append(text)
+            return highlightBlock(text, contextStack)
+
+        self.syntax.highlightBlock = countingHighlightBlock
+
+    def tearDown(self):
+        del self.syntax.highlightBlock
+        self.qpart.terminate()
+
+    def _waitHighlightingFinished(self):
+        while self.qpart.isHighlightingInProgress():
+            QApplication.instance().processEvents()
+
+    def test_switch_theme(self):
+        oldColor = _keywordColor(self.qpart, 4999)
+
+        theme = ColorTheme(TextFormat)
+        theme.format['dsImport'] = TextFormat(color='#ff0000', bold=True)
+        self.qpart.colorTheme = theme
+        self.assertEqual(_keywordColor(self.qpart, 0), QColor('#ff0000'))  # visible line is restyled immediately
+        self.assertEqual(_keywordColor(self.qpart, 4999), oldColor)
+
+        self._waitHighlightingFinished()
+        self.assertEqual(_keywordColor(self.qpart, 4999), QColor('#ff0000'))
+        self.assertEqual(self.parsedLines, [])
+
+    def test_edit_while_restyling(self):
+        theme = ColorTheme(TextFormat)
+        theme.format['dsImport'] = TextFormat(color='#00ff00')
+        self.qpart.colorTheme = theme
+        del self.qpart.lines[1000:2000]
+        self.qpart.lines[3000] = 'import sys'
+        self._waitHighlightingFinished()
+
+        for lineNumber in (0, 999, 1000, 2999, 3999):
+            self.assertEqual(_keywordColor(self.qpart, lineNumber), QColor('#00ff00'))
+
+
+if __name__ == '__main__':
+    unittest.main()
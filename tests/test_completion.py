@@ -11,6 +11,7 @@ from PyQt5.QtTest import QTest
 
 from qutepart import Qutepart
 import qutepart.completer
+import qutepart.globaltimer
 qutepart.completer._GlobalUpdateWordSetTimer._IDLE_TIMEOUT_MS = 0
 
 
@@ -113,6 +114,26 @@ class Test(unittest.TestCase):
         QTest.keyPress(self.qpart, Qt.Key_Space, Qt.ControlModifier, 100)
         self.assertIsNotNone(self.qpart._completer._widget)
 
+    def test_word_sets_updated_by_global_timer(self):
+        """Idle timer doesn't update word sets of all editors at once, the updates share frames of the global timer
+        """
+        others = [Qutepart() for i in range(3)]
+        for index, qpart in enumerate(others):
+            qpart.text = 'word%d\n' % index
+        qutepart.completer.Completer._globalUpdateWordSetTimer._onTimer()
+
+        timer = qutepart.globaltimer.globalTimer()
+        for qpart in others:
+            self.assertIsNone(qpart._completer._wordSet)
+            self.assertTrue(timer.isCallbackScheduled(qpart._completer._continueWordSetUpdate))
+
+        while any(timer.isCallbackScheduled(qpart._completer._continueWordSetUpdate) for qpart in others):
+            self.app.processEvents()
+
+        for index, qpart in enumerate(others):
+            self.assertEqual(qpart._completer._wordSet, set(['word%d' % index]))
+            qpart.terminate()
+
 
 if __name__ == '__main__':
     unittest.main()
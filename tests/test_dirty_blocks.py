@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+
+import random
+import unittest
+
+import base
+
+from PyQt5.QtWidgets import QApplication
+
+from qutepart import Qutepart
+from qutepart.syntaxhlighter import _DirtyBlocks
+
+
+class DirtyBlocksTest(unittest.TestCase):
+    def test_add(self):
+        dirty = _DirtyBlocks()
+        dirty.add(10, 20)
+        dirty.add(30, 40)
+        dirty.add(0, 5)
+        self.assertEqual(dirty.intervals(), [(0, 5), (10, 20), (30, 40)])
+
+        dirty.add(6, 9)  # adjacent intervals are merged
+        self.assertEqual(dirty.intervals(), [(0, 20), (30, 40)])
+        dirty.add(15, 35)
+        self.assertEqual(dirty.intervals(), [(0, 40)])
+
+    def test_contains(self):
+        dirty = _DirtyBlocks()
+        dirty.add(10, 20)
+        dirty.add(30, 30)
+        self.assertEqual([number for number in range(40) if number in dirty],
+                         list(range(10, 21)) + [30])
+
+    def test_replace_blocks(self):
+        dirty = _DirtyBlocks()
+        dirty.add(10, 20)
+        dirty.add(100, 110)
+
+        dirty.replaceBlocks(50, 50, 52)  # 2 blocks inserted
+        self.assertEqual(dirty.intervals(), [(10, 20), (50, 52), (102, 112)])
+
+        dirty.replaceBlocks(0, 30, 0)  # 30 blocks removed
+        self.assertEqual(dirty.intervals(), [(0, 0), (20, 22), (72, 82)])
+
+        dirty.replaceBlocks(75, 75, 75)  # block inside of an interval changed
+        self.assertEqual(dirty.intervals(), [(0, 0), (20, 22), (72, 82)])
+
+        dirty.replaceBlocks(80, 90, 81)  # interval end removed
+        self.assertEqual(dirty.intervals(), [(0, 0), (20, 22), (72, 81)])
+
+    def test_discard_until(self):
+        dirty = _DirtyBlocks()
+        dirty.add(10, 20)
+        dirty.add(30, 40)
+        dirty.discardUntil(15)
+        self.assertEqual(dirty.intervals(), [(16, 20), (30, 40)])
+        dirty.discardUntil(30)
+        self.assertEqual(dirty.intervals(), [(31, 40)])
+        dirty.discardUntil(40)
+        self.assertFalse(dirty)
+
+
+class HighlightingTest(unittest.TestCase):
+    """Only changed blocks are parsed, highlighting is the same as after parsing of the whole text
+    """
+    app = base.papp  # app crashes, if created more than once
+    threaded = False
+
+    def setUp(self):
+        self.qpart = Qutepart()
+        self.qpart.threadedHighlighting = self.threaded
+        self.qpart.lines = ['x = 1  # comment %d' % i for i in range(5000)]
+        self.qpart.detectSyntax(language='Python')
+        self._waitHighlightingFinished(self.qpart)
+
+        self.syntax = self.qpart._highlighter.syntax()
+        self.parsedLines = []
+        highlightBlock = self.syntax.highlightBlock
+
+        def countingHighlightBlock(text, contextStack, releaseGil=False):
+            self.parsedLines.append(text)
+            return highlightBlock(text, contextStack, releaseGil)
+
+        self.syntax.highlightBlock = countingHighlightBlock
+
+    def tearDown(self):
+        del self.syntax.highlightBlock
+        self.qpart.terminate()
+
+    def _waitHighlightingFinished(self, qpart):
+        while qpart.isHighlightingInProgress():
+            QApplication.instance().processEvents()
+
+    def _assertSameAsFullHighlighting(self):
+        self._waitHighlightingFinished(self.qpart)
+        other = Qutepart()
+        other.lines = list(self.qpart.lines)
+        other.detectSyntax(language='Python')
+        self._waitHighlightingFinished(other)
+
+        for lineNumber in range(len(self.qpart.lines)):
+            self.assertEqual(self.qpart._highlighter._lineData(self.qpart.document().findBlockByNumber(lineNumber)),
+                             other._highlighter._lineData(other.document().findBlockByNumber(lineNumber)),
+                             lineNumber)
+        other.terminate()
+
+    def test_separate_edits(self):
+        """Edits at the top and at the bottom in one atomic operation don't cause parsing of blocks between them
+        """
+        with self.qpart:
+            self.qpart.lines[10] = 'y = 2'
+            self.qpart.lines[4990] = 'z = 3'
+        self._waitHighlightingFinished(self.qpart)
+        self.assertLess(len(self.parsedLines), 10)
+        self._assertSameAsFullHighlighting()
+
+    def test_slice_assignment(self):
+        lines = list(self.qpart.lines[100:4900])
+        lines[2000] = 's = """'
+        lines[2010] = '"""'
+        self.qpart.lines[100:4900] = lines
+        self._waitHighlightingFinished(self.qpart)
+        self.assertLess(len(self.parsedLines), 30)
+        self.assertFalse(self.qpart.isCode(2105, 0))
+        self._assertSameAsFullHighlighting()
+
+    def test_change_propagates(self):
+        """Blocks after a changed block are parsed, until their context stack converges
+        """
+        self.qpart.lines[1000] = 's = """'
+        self.qpart.lines[1500] = '"""'
+        self._waitHighlightingFinished(self.qpart)
+        self.assertFalse(self.qpart.isCode(1200, 0))
+        self.assertTrue(self.qpart.isCode(1600, 0))
+        self._assertSameAsFullHighlighting()
+
+    def test_random_edits(self):
+        random.seed(1)
+        texts = ['"""', 'a = 1', '# """', '', 'def f(x):']
+        for i in range(30):
+            with self.qpart:
+                for j in range(3):
+                    lineNumber = random.randrange(len(self.qpart.lines))
+                    action = random.randrange(3)
+                    if action == 0:
+                        self.qpart.lines[lineNumber] = random.choice(texts)
+                    elif action == 1:
+                        self.qpart.lines.insert(lineNumber, random.choice(texts))
+                    elif len(self.qpart.lines) > 1:
+                        del self.qpart.lines[lineNumber]
+            if i % 3 == 0:
+                self._waitHighlightingFinished(self.qpart)
+        self._assertSameAsFullHighlighting()
+
+
+class ThreadedHighlightingTest(HighlightingTest):
+    threaded = True
+
+    def setUp(self):
+        HighlightingTest.setUp(self)
+        # don't parse in the main thread, all changes are parsed by the thread
+        self.qpart._highlighter._smallChangeTimeout = lambda: 0
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+
+import time
+import unittest
+
+import base
+
+from PyQt5.QtCore import Qt
+from PyQt5.QtTest import QTest
+from PyQt5.QtWidgets import QApplication
+
+from qutepart import Qutepart
+from qutepart.globaltimer import GlobalTimer, globalTimer, \
+                                 PRIORITY_FOCUSED, PRIORITY_VISIBLE, PRIORITY_HIDDEN
+
+
+class _Task:
+    """Callback, which works for some time and schedules itself again, until its work is done
+    """
+    def __init__(self, timer, name, calls, priority, log, duration=0.):
+        self._timer = timer
+        self.name = name
+        self.calls = calls
+        self.priority = priority
+        self._log = log
+        self._duration = duration
+
+    def __call__(self):
+        self._log.append(self.name)
+        time.sleep(min(self._duration, self._timer.timeLeft()))
+        self.calls -= 1
+        if self.calls > 0:
+            self._timer.scheduleCallback(self, self.priority)
+
+
+class GlobalTimerTest(unittest.TestCase):
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        self.timer = GlobalTimer()
+        self.log = []
+
+    def tearDown(self):
+        self.timer._timer.stop()
+
+    def _schedule(self, name, calls, priority, duration=0.):
+        task = _Task(self.timer, name, calls, priority, self.log, duration)
+        self.timer.scheduleCallback(task, priority)
+        return task
+
+    def _runFrame(self):
+        self.timer._onTimer()
+
+    def _runAll(self):
+        while self.timer._priorities:
+            self._runFrame()
+
+    def test_priority_order(self):
+        self._schedule('hidden', 1, PRIORITY_HIDDEN)
+        self._schedule('visible', 1, PRIORITY_VISIBLE)
+        self._schedule('focused', 1, PRIORITY_FOCUSED)
+        self._runAll()
+        self.assertEqual(self.log, ['focused', 'visible', 'hidden'])
+
+    def test_round_robin(self):
+        """Callbacks with the same priority are called in turn, the first scheduled first
+        """
+        self._schedule('a', 3, PRIORITY_HIDDEN)
+        self._schedule('b', 3, PRIORITY_HIDDEN)
+        self._schedule('c', 3, PRIORITY_HIDDEN)
+        self._runAll()
+        self.assertEqual(self.log, ['a', 'b', 'c'] * 3)
+
+    def test_change_priority(self):
+        self._schedule('a', 1, PRIORITY_HIDDEN)
+        task = self._schedule('b', 1, PRIORITY_HIDDEN)
+        self.timer.scheduleCallback(task, PRIORITY_FOCUSED)
+        self._runAll()
+        self.assertEqual(self.log, ['b', 'a'])
+
+    def test_unschedule(self):
+        task = self._schedule('a', 1, PRIORITY_VISIBLE)
+        self.assertTrue(self.timer.isCallbackScheduled(task))
+        self.timer.unScheduleCallback(task)
+        self.assertFalse(self.timer.isCallbackScheduled(task))
+        self.assertFalse(self.timer.isActive())
+        self._runAll()
+        self.assertEqual(self.log, [])
+
+    def test_frame_budget(self):
+        """Frame is not longer than the budget, if callbacks respect timeLeft()
+        """
+        for i in range(50):
+            self._schedule('hidden%d' % i, 100, PRIORITY_HIDDEN, duration=0.01)
+
+        self._schedule('focused', 100, PRIORITY_FOCUSED, duration=0.005)
+        startTime = time.time()
+        self._runFrame()
+        self.assertLess(time.time() - startTime, self.timer.latencyTarget() * 2)
+        self.assertEqual(self.log[0], 'focused')
+
+        # the focused callback is the first in the next frame, regardless of count of other callbacks
+        self.log[:] = []
+        self._runFrame()
+        self.assertEqual(self.log[0], 'focused')
+
+
+class AdaptiveBudgetTest(unittest.TestCase):
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        self.timer = GlobalTimer()
+        self.timer.setLatencyTarget(0.05)
+
+    def _measureLag(self, lag, count=50):
+        for i in range(count):
+            self.timer._timerStartTime = 100.
+            self.timer._measureLag(100. + lag)
+
+    def test_lag(self):
+        """Budget is the target minus event loop lag
+        """
+        self._measureLag(0.)
+        self.assertAlmostEqual(self.timer.frameBudget(), 0.05, places=3)
+
+        self._measureLag(0.03)
+        self.assertAlmostEqual(self.timer.frameBudget(), 0.02, places=3)
+
+        self._measureLag(0.1)
+        self.assertEqual(self.timer.frameBudget(), GlobalTimer._MIN_FRAME_BUDGET_SEC)
+
+    def test_input_latency(self):
+        """Late keystroke reduces the budget, it recovers later
+        """
+        self._measureLag(0.)
+        self.timer.reportInputLatency(0.01)
+        self.assertAlmostEqual(self.timer.frameBudget(), 0.05, places=3)
+
+        self.timer.reportInputLatency(0.1)
+        self.assertAlmostEqual(self.timer.frameBudget(), 0.025, places=3)
+
+        self.timer.reportInputLatency(0.5)  # i.e. painted with cursor blinking, not delayed by callbacks
+        self.assertAlmostEqual(self.timer.frameBudget(), 0.025, places=3)
+
+        self._measureLag(0., count=100)
+        self.assertAlmostEqual(self.timer.frameBudget(), 0.05, places=3)
+
+    def test_target(self):
+        self._measureLag(0.)
+        self.timer.setLatencyTarget(0.2)
+        self.assertAlmostEqual(self.timer.frameBudget(), 0.2, places=3)
+
+        qpart = Qutepart()
+        with self.assertRaises(ValueError):
+            qpart.latencyTarget = 0
+        qpart.latencyTarget = 0.1
+        self.assertEqual(qpart.latencyTarget, 0.1)
+        qpart.terminate()
+
+
+class PriorityTest(unittest.TestCase):
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        self.qpart = Qutepart()
+
+    def tearDown(self):
+        self.qpart.terminate()
+
+    def test_hidden_editor(self):
+        self.qpart.lines = ['x = 1  # comment'] * 20000
+        self.qpart.detectSyntax(language='Python')
+        self.assertTrue(self.qpart.isHighlightingInProgress())
+
+        callback = self.qpart._highlighter._onContinueHighlighting
+        self.assertEqual(globalTimer()._priorities[callback], PRIORITY_HIDDEN)
+
+        self.qpart.show()
+        self.assertEqual(globalTimer()._priorities[callback], PRIORITY_VISIBLE)
+
+        while self.qpart.isHighlightingInProgress():
+            QApplication.instance().processEvents()
+        self.assertTrue(self.qpart.isComment(19999, 9))
+
+    def test_key_press_time(self):
+        """Latency is measured only for keys, which change text or cursor
+        """
+        self.qpart.text = 'abc'
+        self.qpart.cursorPosition = (0, 0)
+        for key in (Qt.Key_Shift, Qt.Key_Left, Qt.Key_Escape):
+            QTest.keyClick(self.qpart, key)
+            self.assertIsNone(self.qpart._keyPressTime, key)
+
+        QTest.keyClick(self.qpart, Qt.Key_Right)
+        self.assertIsNotNone(self.qpart._keyPressTime)
+
+        self.qpart._keyPressTime = None
+        QTest.keyClicks(self.qpart, 'x')
+        self.assertIsNotNone(self.qpart._keyPressTime)
+        self.assertEqual(self.qpart.text, 'axbc')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import base
+
+from PyQt5.QtWidgets import QApplication
+
+from qutepart import Qutepart
+from qutepart.syntaxhlighter import SyntaxHighlighter
+
+
+class Test(unittest.TestCase):
+    """Long lines are highlighted by parts
+    """
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        self.qpart = Qutepart()
+        # highlighting of the long line is continued after few parts
+        self._savedValues = (SyntaxHighlighter._LONG_LINE_PART_LENGTH,
+                             SyntaxHighlighter._MAX_PARSING_TIME_BIG_CHANGE_SEC,
+                             SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC)
+        SyntaxHighlighter._LONG_LINE_PART_LENGTH = 1000
+        SyntaxHighlighter._MAX_PARSING_TIME_BIG_CHANGE_SEC = 0.001
+        SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC = 0.001
+
+    def tearDown(self):
+        (SyntaxHighlighter._LONG_LINE_PART_LENGTH,
+         SyntaxHighlighter._MAX_PARSING_TIME_BIG_CHANGE_SEC,
+         SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC) = self._savedValues
+        self.qpart.terminate()
+
+    def _waitHighlightingFinished(self):
+        while self.qpart.isHighlightingInProgress():
+            QApplication.instance().processEvents()
+
+    def test_long_line(self):
+        longLine = 'x = [' + '1, "s", ' * 5000 + '0]  """ string'
+        self.qpart.lines = [longLine,
+                            'string """',
+                            'y = 1  # comment']
+        self.qpart.detectSyntax(language='Python')
+        self._waitHighlightingFinished()
+
+        self.assertTrue(self.qpart.isCode(0, 1))
+        self.assertFalse(self.qpart.isCode(0, longLine.index('"s"') + 1))
+        self.assertTrue(self.qpart.isCode(0, longLine.index('0]')))
+        self.assertFalse(self.qpart.isCode(0, longLine.index('"""') + 4))
+        self.assertFalse(self.qpart.isCode(1, 3))
+        self.assertTrue(self.qpart.isCode(2, 0))
+        self.assertTrue(self.qpart.isComment(2, 9))
+
+    def test_edit_long_line(self):
+        self.qpart.lines = ['x = [' + '1, ' * 10000 + '0]',
+                            'y = 1']
+        self.qpart.detectSyntax(language='Python')
+        self._waitHighlightingFinished()
+        self.assertTrue(self.qpart.isCode(1, 0))
+
+        self.qpart.lines[0] = self.qpart.lines[0] + '  """'
+        self._waitHighlightingFinished()
+        self.assertFalse(self.qpart.isCode(1, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import base
+
+from PyQt5.QtWidgets import QApplication
+
+import qutepart.perf
+from qutepart import Qutepart
+
+
+class Test(unittest.TestCase):
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        qutepart.perf.reset()
+        self.qpart = Qutepart()
+        self.finished = []
+        self.slices = []
+        self.qpart.highlightingFinished.connect(self.finished.append)
+        self.qpart.highlightingSliceFinished.connect(self.slices.append)
+
+    def tearDown(self):
+        self.qpart.terminate()
+
+    def _waitHighlightingFinished(self):
+        while self.qpart.isHighlightingInProgress():
+            QApplication.instance().processEvents()
+
+    def _load(self, lineCount):
+        self.qpart.lines = ['x = 1  # comment'] * lineCount
+        self.qpart.detectSyntax(language='Python')
+        self._waitHighlightingFinished()
+
+    def test_no_syntax(self):
+        self.assertIsNone(self.qpart.highlightingCounters())
+
+    def test_load(self):
+        self._load(20000)
+        counters = self.qpart.highlightingCounters()
+        # visible blocks might be parsed twice, if context stack was guessed wrong
+        self.assertGreaterEqual(counters.blocksParsed, 20000)
+        self.assertEqual(counters.charactersParsed, counters.blocksParsed * len('x = 1  # comment'))
+        self.assertGreater(counters.slicesRescheduled, 0)
+        self.assertEqual(counters.slices, len(self.slices))
+        self.assertAlmostEqual(counters.sliceTime, sum(self.slices))
+        self.assertEqual(counters.maxSliceTime, max(self.slices))
+        self.assertEqual(counters.fullHighlightings, 1)
+        self.assertEqual(self.finished, [counters.lastFullHighlightingTime])
+
+        # whole text replaced
+        self.qpart.text = 'y = 2\n' * 100
+        self._waitHighlightingFinished()
+        self.assertEqual(self.qpart.highlightingCounters().fullHighlightings, 2)
+        self.assertEqual(len(self.finished), 2)
+
+    def test_edit(self):
+        self._load(100)
+        qutepart.perf.reset()
+
+        self.qpart.lines[10] = 'x = 2  # comment'
+        self._waitHighlightingFinished()
+        counters = self.qpart.highlightingCounters()
+        self.assertEqual(counters.blocksParsed, 1)
+        self.assertEqual(counters.formatsUnchanged, 1)
+        self.assertEqual(counters.fullHighlightings, 0)
+
+    def test_long_line_counted_once(self):
+        self.qpart.lines = ['x = 1', 'x = 1 + ' * 100000, 'x = 1']
+        self.qpart.detectSyntax(language='Python')
+        self._waitHighlightingFinished()
+        counters = self.qpart.highlightingCounters()
+        self.assertGreater(counters.slicesRescheduled, 0)  # the long line has been parsed in many slices
+        self.assertEqual(counters.blocksParsed, 3)
+        self.assertEqual(counters.charactersParsed, len(self.qpart.text) - 2)
+
+    def test_snapshot(self):
+        self._load(100)
+        other = Qutepart()
+        other.text = 'int x;'
+        other.detectSyntax(language='C++')
+        other.terminate()  # counters of terminated editors are kept
+
+        snapshot = qutepart.perf.snapshot()
+        self.assertGreaterEqual(snapshot.languages['Python'].blocksParsed, 100)
+        self.assertEqual(snapshot.languages['C++'].blocksParsed, 1)
+        self.assertGreater(snapshot.frameBudget, 0)
+
+        qutepart.perf.reset()
+        snapshot = qutepart.perf.snapshot()
+        self.assertNotIn('C++', snapshot.languages)
+        self.assertEqual(snapshot.languages['Python'].blocksParsed, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
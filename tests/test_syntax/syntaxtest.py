@@ -0,0 +1,40 @@
+"""Common setup of syntax tests.
+Import it before qutepart
+"""
+
+import os.path
+import sys
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+sys.path.insert(0, topLevelPath)
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
+sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+
+import qutepart.syntax.loader
+
+# tests don't write to the user's cache. Cache tests set their own directory
+qutepart.syntax.loader.cacheDirectory = None
+
+from qutepart.syntax import textFormat, unpackSegments
+
+
+"""Lines of PHP, which includes HTML, CSS and JavaScript. Many syntaxes and contexts are used
+"""
+PHP_LINES = ['<html><head><style>body { color: red; }</style>',
+             '<script>var x = "string"; // comment',
+             '</script></head>',
+             '<?php $x = array(1, 2.5, 0x10); /* comment',
+             ' end */ echo "Hello $x\\n"; ?>',
+             '<p class="x">&amp; text</p>']
+
+
+def highlight(syntax, lines):
+    """Highlight lines. Returns [(textTypeMap, [(length, format attributes or None)])],
+    which can be compared for syntaxes, loaded in different ways
+    """
+    result = []
+    for lineData, segments in syntax.highlightLines(lines):
+        textTypeMap = lineData[1] if lineData is not None else None
+        result.append((textTypeMap, [(length, vars(textFormat(styleIndex)) if styleIndex else None)
+                                     for length, styleIndex in unpackSegments(segments)]))
+    return result
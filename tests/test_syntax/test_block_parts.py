@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+import os.path
+import threading
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager, extendSegments
+
+
+class BlockPartsTestCase(unittest.TestCase):
+    """Parsing line by parts gives the same result, as parsing whole line
+    """
+    def _test(self, languageName, lines):
+        syntax = SyntaxManager().getSyntax(None, languageName=languageName)
+        for maxLength in (1, 3, 10):
+            contextStack = None
+            for line in lines:
+                lineData, segments = syntax.highlightBlock(line, contextStack)
+
+                partialLineState = None
+                partsSegments = []
+                while True:
+                    partLineData, partialLineState, partSegments = \
+                        syntax.highlightBlockPart(line, contextStack, partialLineState, maxLength)
+                    extendSegments(partsSegments, partSegments)
+                    if partialLineState is None:
+                        break
+                    self.assertIsNone(partLineData)
+
+                self.assertEqual(partLineData, lineData)
+                self.assertEqual(partsSegments, segments)
+                contextStack = lineData[0]
+
+    def test_c(self):
+        self._test('C', ['int main(int argc, char** argv) { /* comment',
+                         'comment */ return "string\\n" + 0x10; // comment',
+                         '',
+                         '    #if 0 // comment'])
+
+    def test_python(self):
+        self._test('Python', ['def foo(self, x=None):  # comment',
+                              '    """docstring """ + """ start',
+                              'end """; return [len(x), 0o17, 1.5]'])
+
+    def test_dynamic(self):
+        self._test('Perl', ['print <<EOF . "text";', 'text EOF', 'EOF', 'my $x = 1;'])
+
+    def test_release_gil(self):
+        """Parsing in a thread, which releases the GIL, gives the same result
+        """
+        syntax = SyntaxManager().getSyntax(None, languageName='Perl')
+        lines = ['print <<EOF . "text";', 'text EOF', 'EOF', 'my $x = 1; $x =~ s/a(b)/c/g;']
+
+        def highlight(releaseGil):
+            result = []
+            contextStack = None
+            for line in lines:
+                lineData, segments = syntax.highlightBlock(line, contextStack, releaseGil)
+                partialLineState = None
+                partsSegments = []
+                while True:
+                    partLineData, partialLineState, partSegments = \
+                        syntax.highlightBlockPart(line, contextStack, partialLineState, 5, releaseGil)
+                    extendSegments(partsSegments, partSegments)
+                    if partialLineState is None:
+                        break
+                result.append((lineData, segments, partLineData, partsSegments))
+                contextStack = lineData[0]
+            return result
+
+        threadResult = []
+        thread = threading.Thread(target=lambda: threadResult.append(highlight(True)))
+        thread.start()
+        thread.join()
+        self.assertEqual(threadResult, [highlight(False)])
+
+
+if __name__ == '__main__':
+    unittest.main()
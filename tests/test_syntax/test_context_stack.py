@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager
+
+
+class ContextStackTestCase(unittest.TestCase):
+    def _stacks(self, syntax, lines):
+        result = []
+        contextStack = None
+        for line in lines:
+            (contextStack, textTypeMap), segments = syntax.highlightBlock(line, contextStack)
+            result.append(contextStack)
+        return result
+
+    def test_interned(self):
+        """Equal stacks are the same object
+        """
+        syntax = SyntaxManager().getSyntax(None, languageName='C++')
+        lines = ['/* comment', 'still comment', 'int x; /* another', 'comment */']
+        first = self._stacks(syntax, lines)
+        second = self._stacks(syntax, lines)
+        for firstStack, secondStack in zip(first, second):
+            self.assertIs(firstStack, secondStack)
+        self.assertIs(first[0], first[1])
+
+    def test_dynamic_data(self):
+        """Stacks with different dynamic data are different
+        """
+        syntax = SyntaxManager().getSyntax(None, languageName='Bash')
+        first = self._stacks(syntax, ['cat << EOF', 'text'])
+        second = self._stacks(syntax, ['cat << END', 'text'])
+        self.assertIsNot(first[0], second[0])
+        self.assertIsNot(first[1], second[1])
+        self.assertIs(self._stacks(syntax, ['cat << EOF'])[0], first[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+import qutepart.syntax.loader
+from qutepart.syntax.loader import _regExpFirstChars, _makeDispatchTable, _ANY_CHAR
+from qutepart.syntax import SyntaxManager
+
+
+class RegExpFirstCharsTestCase(unittest.TestCase):
+    def _firstChars(self, pattern, insensitive=False):
+        asciiChars, nonAscii = _regExpFirstChars(pattern, insensitive)
+        return ''.join(sorted(asciiChars)), nonAscii
+
+    def test_literal(self):
+        self.assertEqual(self._firstChars('#\\s*include'), ('#', False))
+        self.assertEqual(self._firstChars('\\bif\\b'), ('i', False))
+
+    def test_alternatives(self):
+        self.assertEqual(self._firstChars('(if|else|while)\\b'), ('eiw', False))
+        self.assertEqual(self._firstChars('(a|b?)c'), ('abc', False))
+
+    def test_set(self):
+        self.assertEqual(self._firstChars('[0-3x]+'), ('0123x', False))
+        self.assertEqual(self._firstChars('\\d'), ('0123456789', True))
+
+    def test_insensitive(self):
+        self.assertEqual(self._firstChars('end', True), ('Ee', True))
+        self.assertEqual(self._firstChars('(?i)end'), ('Ee', True))
+
+    def test_unknown(self):
+        self.assertEqual(_regExpFirstChars('.x', False), _ANY_CHAR)
+        self.assertEqual(_regExpFirstChars('x*', False), _ANY_CHAR)  # may match empty string
+        self.assertEqual(_regExpFirstChars('[[:alpha:]]', False), _ANY_CHAR)  # PCRE only
+        self.assertEqual(_regExpFirstChars('(', False), _ANY_CHAR)  # invalid
+
+
+class DispatchTableTestCase(unittest.TestCase):
+    def test_order_preserved(self):
+        asciiTable, nonAsciiIndexes = _makeDispatchTable([(frozenset('b'), False),
+                                                          _ANY_CHAR,
+                                                          (frozenset('ab'), True)])
+        self.assertEqual(asciiTable[ord('a')], (1, 2))
+        self.assertEqual(asciiTable[ord('b')], (0, 1, 2))
+        self.assertEqual(asciiTable[ord('c')], (1, ))
+        self.assertEqual(nonAsciiIndexes, (1, 2))
+
+    def test_highlighting(self):
+        """Dispatch table must not change highlighting
+        """
+        syntax = SyntaxManager().getSyntax(None, languageName='C++')
+        text = '    if (x == 0x1F) { printf("%d\\n", 10); }  // comment'
+        (contextStack, textTypeMap), segments = syntax.highlightBlock(text, None)
+
+        for context in syntax.parser.contexts.values():
+            context.setRules(context.rules)  # all rules are tried for every character
+        (contextStack, plainTextTypeMap), plainSegments = syntax.highlightBlock(text, None)
+        self.assertEqual(plainSegments, segments)
+        self.assertEqual(plainTextTypeMap, textTypeMap)
+
+
+if __name__ == '__main__':
+    unittest.main()
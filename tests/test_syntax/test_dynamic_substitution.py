@@ -4,12 +4,12 @@ import unittest
 import sys
 import os.path
 
-topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-sys.path.insert(0, topLevelPath)
-sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
-sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
 
 from qutepart.syntax.parser import StringDetect, RegExpr
+import qutepart.syntax.loader
+from qutepart.syntax import SyntaxManager
 
 class TestCase(unittest.TestCase):
     def test_StringDetect(self):
@@ -20,6 +20,24 @@ class TestCase(unittest.TestCase):
         self.assertEqual(RegExpr._makeDynamicSubsctitutions('a%1c%3', ['a', '|']),
                          'a\|c%3')
 
+    def test_cache(self):
+        """Dynamic rules are not recompiled for every character of a heredoc
+        """
+        syntax = SyntaxManager().getSyntax(None, languageName='Bash')
+        lines = ['cat <<END'] + \
+                ['heredoc text $HOME'] * 10 + \
+                ['END',
+                 'echo']
+
+        contextStack = None
+        hits, misses = qutepart.syntax.loader.dynamicRuleCacheInfo()
+        for line in lines:
+            (contextStack, textTypeMap), segments = syntax.highlightBlock(line, contextStack)
+        newHits, newMisses = qutepart.syntax.loader.dynamicRuleCacheInfo()
+
+        self.assertGreater(newHits - hits, len(lines))
+        self.assertLess(newMisses - misses, 5)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+
+import io
+import itertools
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager, unpackSegments
+
+
+class HighlightLinesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.syntax = SyntaxManager().getSyntax(None, languageName='C')
+
+    def test_same_as_highlight_block(self):
+        lines = ['int main() {',
+                 '    /* comment',
+                 '       comment */ return 0;',
+                 '}']
+        contextStack = None
+        for line, (lineData, segments) in zip(lines, self.syntax.highlightLines(lines)):
+            expectedLineData, expectedSegments = self.syntax.highlightBlock(line, contextStack)
+            self.assertEqual(lineData, expectedLineData)
+            self.assertEqual(segments, expectedSegments)
+            contextStack = lineData[0] if lineData is not None else None
+
+    def test_file_object(self):
+        """Line separators are ignored
+        """
+        file_ = io.StringIO('int x;  /* comment\r\n   comment */\nint y;\n')
+        results = list(self.syntax.highlightLines(file_))
+        self.assertEqual(len(results), 3)
+        self.assertEqual([sum(length for length, styleIndex in unpackSegments(segments)) for lineData, segments in results],
+                         [18, 13, 6])
+        lineData, segments = results[1]
+        self.assertTrue(self.syntax.isComment(lineData, 3))
+
+    def test_lazy(self):
+        """Lines are parsed as they are consumed
+        """
+        lines = itertools.cycle(['int x;', '/* comment */'])
+        results = list(itertools.islice(self.syntax.highlightLines(lines), 1000))
+        self.assertEqual(len(results), 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntaxtest import PHP_LINES, highlight  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+class LazyLoadingTestCase(unittest.TestCase):
+    def setUp(self):
+        self._oldLazyContextLoading = qutepart.syntax.loader.lazyContextLoading
+
+    def tearDown(self):
+        qutepart.syntax.loader.lazyContextLoading = self._oldLazyContextLoading
+
+    def _getSyntax(self, lazy):
+        qutepart.syntax.loader.lazyContextLoading = lazy
+        return SyntaxManager().getSyntax(languageName='PHP/PHP')
+
+    def _loadedContextNames(self, syntax):
+        return set(name for name, context in syntax.parser.contexts.items() \
+                        if context.loader is None)
+
+    def test_same_as_eager(self):
+        self.assertEqual(highlight(self._getSyntax(lazy=True), PHP_LINES),
+                         highlight(self._getSyntax(lazy=False), PHP_LINES))
+
+    def test_loaded_when_entered(self):
+        syntax = self._getSyntax(lazy=True)
+        self.assertEqual(self._loadedContextNames(syntax), set([syntax.parser.defaultContext.name]))
+
+        syntax.highlightBlock('<?php $x = 1; /* comment', None)
+        loaded = self._loadedContextNames(syntax)
+        self.assertIn('phpsource', loaded)
+        self.assertIn('twolinecomment', loaded)
+        self.assertNotIn('onelinecomment', loaded)
+        self.assertNotIn('heredoc', loaded)
+
+    def test_eager(self):
+        syntax = self._getSyntax(lazy=False)
+        self.assertEqual(self._loadedContextNames(syntax), set(syntax.parser.contexts.keys()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+
+import os.path
+import shutil
+import tempfile
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import Syntax, SyntaxManager, styles, unpackSegments
+import qutepart.syntax.loader
+import qutepart.syntax.parser
+
+
+_XML = '''<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE language SYSTEM "language.dtd">
+<language name="RegExpPosition" version="1" kateversion="5.0" section="Other" extensions="">
+    <highlighting>
+        <contexts>
+            <context name="Normal" attribute="Normal Text" lineEndContext="#stay">
+                <RegExpr attribute="Keyword" context="#stay" String="(?&lt;=@)\\w+"/>
+                <RegExpr attribute="Comment" context="#stay" String="(^|\\s)\\(.*"/>
+                <RegExpr attribute="Decimal" context="#stay" String="\\B\\d+"/>
+            </context>
+        </contexts>
+        <itemDatas>
+            <itemData name="Normal Text" defStyleNum="dsNormal"/>
+            <itemData name="Keyword"     defStyleNum="dsKeyword"/>
+            <itemData name="Comment"     defStyleNum="dsComment"/>
+            <itemData name="Decimal"     defStyleNum="dsDecVal"/>
+        </itemDatas>
+    </highlighting>
+</language>
+'''
+
+
+class RegExpPositionTest(unittest.TestCase):
+    """RegExpr patterns see the whole line, not only the text from the current position.
+    Both parsers highlight the same way
+    """
+    def setUp(self):
+        self._tempDir = tempfile.mkdtemp()
+        self._xmlFilePath = os.path.join(self._tempDir, 'regexpposition.xml')
+        with open(self._xmlFilePath, 'w', encoding='utf-8') as xmlFile:
+            xmlFile.write(_XML)
+
+    def tearDown(self):
+        shutil.rmtree(self._tempDir)
+
+    def _highlight(self, parserModule, line):
+        """Returns [(length, defStyleName or None)]
+        """
+        oldParserModule = qutepart.syntax.loader._parserModule
+        qutepart.syntax.loader._parserModule = parserModule
+        try:
+            syntax = Syntax(SyntaxManager())
+            qutepart.syntax.loader.loadSyntax(syntax, self._xmlFilePath)
+        finally:
+            qutepart.syntax.loader._parserModule = oldParserModule
+
+        lineData, segments = syntax.highlightBlock(line, None)
+        allStyles = styles()
+        return [(length, allStyles[styleIndex][0] if styleIndex else None)
+                for length, styleIndex in unpackSegments(segments)]
+
+    def _test(self, line, expected):
+        self.assertEqual(self._highlight(qutepart.syntax.parser, line), expected)
+        if qutepart.syntax.loader.binaryParserAvailable:
+            self.assertEqual(self._highlight(qutepart.syntax.loader._parserModule, line), expected)
+
+    def test_look_behind(self):
+        self._test('@name x', [(1, 'dsNormal'), (4, 'dsKeyword'), (2, 'dsNormal')])
+
+    def test_caret(self):
+        """^ doesn't match in the middle of the line
+        """
+        self._test('x(comment', [(9, 'dsNormal')])
+        self._test('(comment', [(8, 'dsComment')])
+        self._test('x (comment', [(1, 'dsNormal'), (9, 'dsComment')])
+
+    def test_not_word_boundary(self):
+        self._test('1 a2', [(3, 'dsNormal'), (1, 'dsDecVal')])
+
+
+if __name__ == '__main__':
+    unittest.main()
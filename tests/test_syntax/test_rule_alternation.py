@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+import qutepart.syntax.loader
+import qutepart.syntax.parser
+from qutepart.syntax import SyntaxManager
+
+
+@unittest.skipIf(qutepart.syntax.loader.binaryParserAvailable, 'Alternation is implemented by Python parser only')
+class RuleAlternationTestCase(unittest.TestCase):
+    def setUp(self):
+        self._minParsedLength = qutepart.syntax.parser._ALTERNATION_MIN_PARSED_LENGTH
+        qutepart.syntax.parser._ALTERNATION_MIN_PARSED_LENGTH = 0
+
+    def tearDown(self):
+        qutepart.syntax.parser._ALTERNATION_MIN_PARSED_LENGTH = self._minParsedLength
+
+    def _highlight(self, syntax, lines):
+        result = []
+        contextStack = None
+        for line in lines:
+            (contextStack, textTypeMap), segments = syntax.highlightBlock(line, contextStack)
+            result.append((segments, textTypeMap))
+        return result
+
+    def _test(self, languageName, lines, compiledContextName):
+        syntax = SyntaxManager().getSyntax(None, languageName=languageName)
+        result = self._highlight(syntax, lines)
+
+        context = syntax.parser.contexts[compiledContextName]
+        self.assertIsNotNone(context._ruleAlternation(syntax.parser.deliminatorSet, 0))
+
+        for context in syntax.parser.contexts.values():
+            context._ruleAlternations = dict.fromkeys(context._ruleAlternations)  # all rules are tried by the loop
+        self.assertEqual(self._highlight(syntax, lines), result)
+
+    def test_cpp(self):
+        self._test('C++',
+                   ['#include <stdio.h>',
+                    '    if (x == 0x1F) { printf("%d\\n", 10); }  // comment',
+                    'int main(int argc, char** argv) { return 0.5e3; } /* multiline',
+                    '   comment */ struct S;'],
+                   'Normal')
+
+    def test_python(self):
+        self._test('Python',
+                   ['def foo(self, x=None):',
+                    '    """docstring',
+                    '    """',
+                    '    return [len(x), 0o17, 1.5, r"raw\\n", u\'\\u1234\']  # comment'],
+                   'Normal')
+
+
+if __name__ == '__main__':
+    unittest.main()
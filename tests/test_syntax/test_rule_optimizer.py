@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+
+import os
+import os.path
+import unittest
+import sys
+import xml.etree.ElementTree
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntaxtest import highlight  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+filesPath = os.path.join(os.path.dirname(__file__), 'files')
+
+
+class _Parser:
+    """Parser attributes, which are used by the optimizer
+    """
+    def __init__(self, lists):
+        self.lists = lists
+
+
+class RewriteTestCase(unittest.TestCase):
+    def _optimize(self, ruleTexts, lists={}):
+        ruleElements = [xml.etree.ElementTree.fromstring(text) for text in ruleTexts]
+        result = qutepart.syntax.loader._optimizeRules(ruleElements, _Parser(lists), set(['static']))
+        return [(element.tag, element.attrib) for element in result]
+
+    def _optimizeOne(self, ruleText, lists={}):
+        result = self._optimize([ruleText], lists)
+        self.assertEqual(len(result), 1)
+        return result[0]
+
+    def test_reg_expr_to_string_detect(self):
+        self.assertEqual(self._optimizeOne('<RegExpr attribute="Op" String="\\*\\*" context="static"/>'),
+                         ('StringDetect', {'attribute': 'Op', 'String': '**', 'context': 'static'}))
+        self.assertEqual(self._optimizeOne('<RegExpr attribute="Op" String="(?:foo)bar"/>'),
+                         ('StringDetect', {'attribute': 'Op', 'String': 'foobar'}))
+
+    def test_reg_expr_to_detect_char(self):
+        self.assertEqual(self._optimizeOne('<RegExpr attribute="Op" String="\\\\" lookAhead="true"/>'),
+                         ('DetectChar', {'attribute': 'Op', 'char': '\\\\', 'lookAhead': 'true'}))
+        self.assertEqual(self._optimizeOne('<RegExpr String=":" insensitive="true"/>'),
+                         ('DetectChar', {'char': ':'}))
+
+    def test_reg_expr_to_any_char(self):
+        self.assertEqual(self._optimizeOne('<RegExpr String="[-+*]"/>'),
+                         ('AnyChar', {'String': '*+-'}))
+        self.assertEqual(self._optimizeOne('<RegExpr String="a|b"/>'),
+                         ('AnyChar', {'String': 'ab'}))
+        self.assertEqual(self._optimizeOne('<RegExpr String="[0-3]"/>'),
+                         ('AnyChar', {'String': '0123'}))
+
+    def test_reg_expr_not_rewritten(self):
+        for string in ('\\bfoo', 'foo$', '^foo', 'a+', 'a.', '\\d', '[^a]', 'ab|c', '\\x41',
+                       '(?i)ab', '[[:alpha:]]', 'ф', ''):
+            text = '<RegExpr String="%s"/>' % string
+            self.assertEqual(self._optimizeOne(text)[0], 'RegExpr', string)
+
+        for text in ('<RegExpr String="abc" insensitive="true"/>',
+                     '<RegExpr String="%1" dynamic="true"/>',
+                     '<RegExpr String="abc" context="dynamicContext"/>',
+                     '<RegExpr String="abc" context="#pop!##Other"/>'):
+            self.assertEqual(self._optimizeOne(text)[0], 'RegExpr', text)
+
+        self.assertEqual(self._optimizeOne('<RegExpr String="abc" context="#pop#pop"/>')[0], 'StringDetect')
+
+    def test_rule_with_children_not_rewritten(self):
+        lists = {'one': ['word']}
+        for text in ('<RegExpr String="foo"><DetectChar char="("/></RegExpr>',
+                     '<keyword String="one"><DetectChar char="("/></keyword>'):
+            ruleElement = xml.etree.ElementTree.fromstring(text)
+            result = qutepart.syntax.loader._optimizeRules([ruleElement], _Parser(lists), set())
+            self.assertEqual(len(result), 1)
+            self.assertIs(result[0], ruleElement)
+
+    def test_keyword_to_word_detect(self):
+        lists = {'one': ['word'], 'many': ['word', 'other'], 'unicode': ['ф']}
+        self.assertEqual(self._optimizeOne('<keyword String="one" insensitive="true"/>', lists),
+                         ('WordDetect', {'String': 'word', 'insensitive': 'true'}))
+        self.assertEqual(self._optimizeOne('<keyword String="many"/>', lists)[0], 'keyword')
+        self.assertEqual(self._optimizeOne('<keyword String="unicode"/>', lists)[0], 'keyword')
+        self.assertEqual(self._optimizeOne('<keyword String="missing"/>', lists)[0], 'keyword')
+
+    def test_merge_detect_char(self):
+        result = self._optimize(['<DetectChar attribute="Op" char="(" context="#stay"/>',
+                                 '<DetectChar attribute="Op" char=")" context="#stay"/>',
+                                 '<DetectChar attribute="Op" char="\\\\" context="#stay"/>',
+                                 '<DetectChar attribute="Op" char="{" context="static"/>',
+                                 '<StringDetect attribute="Op" String="--"/>',
+                                 '<DetectChar attribute="Op" char="}" context="static"/>',
+                                 '<DetectChar attribute="Op" char="1" dynamic="true"/>'])
+        self.assertEqual(result,
+                         [('AnyChar', {'attribute': 'Op', 'String': '()\\', 'context': '#stay'}),
+                          ('DetectChar', {'attribute': 'Op', 'char': '{', 'context': 'static'}),
+                          ('StringDetect', {'attribute': 'Op', 'String': '--'}),
+                          ('DetectChar', {'attribute': 'Op', 'char': '}', 'context': 'static'}),
+                          ('DetectChar', {'attribute': 'Op', 'char': '1', 'dynamic': 'true'})])
+
+
+class DifferentialTestCase(unittest.TestCase):
+    """Highlighting of the test files is the same with and without the optimizer
+    """
+    def setUp(self):
+        self._oldOptimizeRules = qutepart.syntax.loader.optimizeRules
+
+    def tearDown(self):
+        qutepart.syntax.loader.optimizeRules = self._oldOptimizeRules
+
+    def test_same_highlighting(self):
+        qutepart.syntax.loader.optimizeRules = False
+        managerWithout = SyntaxManager()
+        qutepart.syntax.loader.optimizeRules = True
+        managerWith = SyntaxManager()
+
+        for fileName in sorted(os.listdir(filesPath)):
+            with open(os.path.join(filesPath, fileName), encoding='utf-8', errors='replace') as file_:
+                lines = file_.read().splitlines()
+
+            firstLine = lines[0] if lines else None
+            qutepart.syntax.loader.optimizeRules = False
+            syntaxWithout = managerWithout.getSyntax(sourceFilePath=fileName, firstLine=firstLine)
+            qutepart.syntax.loader.optimizeRules = True
+            syntaxWith = managerWith.getSyntax(sourceFilePath=fileName, firstLine=firstLine)
+            if syntaxWith is None:
+                continue
+
+            self.assertEqual(highlight(syntaxWithout, lines), highlight(syntaxWith, lines), fileName)
+
+
+if __name__ == '__main__':
+    unittest.main()
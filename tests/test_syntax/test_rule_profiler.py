@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+_TEXT = ['import os',
+         'def main(argv):',
+         '    """Docstring"""',
+         '    return len(argv) + 0x10  # comment']
+
+
+class RuleProfilerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.syntax = SyntaxManager().getSyntax(xmlFileName='python.xml')
+
+    def tearDown(self):
+        qutepart.syntax.loader.setRuleProfilingEnabled(False)
+
+    def _highlight(self):
+        for lineData, segments in self.syntax.highlightLines(_TEXT):
+            pass
+
+    def test_profile(self):
+        qutepart.syntax.loader.setRuleProfilingEnabled(True)
+        self.syntax = SyntaxManager().getSyntax(xmlFileName='python.xml')  # rules are described, when profiling
+        self._highlight()
+        profile = self.syntax.ruleProfile()
+        self.assertTrue(profile)
+        for item in profile:
+            self.assertGreaterEqual(item.attempts, item.successes)
+            self.assertGreater(item.attempts, 0)
+            self.assertGreaterEqual(item.time, 0)
+        self.assertGreater(sum(item.successes for item in profile), 0)
+        self.assertEqual(profile, sorted(profile, key=lambda item: item.time, reverse=True))
+
+        contextNames = set(item.contextName for item in profile)
+        self.assertIn('Normal', contextNames)
+        descriptions = [item.description for item in profile if item.contextName == 'Normal']
+        self.assertTrue(any(description.startswith('keyword(') for description in descriptions),
+                        descriptions)
+
+    def test_disabled(self):
+        self._highlight()
+        self.assertEqual(self.syntax.ruleProfile(), [])
+        self.assertEqual(self.syntax._ruleDescriptions, {})
+
+    def test_reset(self):
+        qutepart.syntax.loader.setRuleProfilingEnabled(True)
+        self._highlight()
+        self.assertTrue(self.syntax.ruleProfile())
+        self.syntax.resetRuleProfile()
+        self.assertEqual(self.syntax.ruleProfile(), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
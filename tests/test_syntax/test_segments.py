@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager, unpackSegments
+
+
+class SegmentsTestCase(unittest.TestCase):
+    def _test(self, languageName, lines):
+        syntax = SyntaxManager().getSyntax(None, languageName=languageName)
+        contextStack = None
+        for line in lines:
+            (contextStack, textTypeMap), segments = syntax.highlightBlock(line, contextStack)
+            segments = list(unpackSegments(segments))
+            self.assertEqual(sum(length for length, styleIndex in segments), len(line))
+            for length, styleIndex in segments:
+                self.assertGreater(length, 0)
+            for (length, styleIndex), (nextLength, nextStyleIndex) in zip(segments, segments[1:]):
+                self.assertNotEqual(styleIndex, nextStyleIndex)
+
+    def test_merged(self):
+        """Adjacent segments of the same format are merged
+        """
+        self._test('C', ['int main(int argc, char** argv) {',
+                         '    return argc + 1 ;  /* comment',
+                         '      comment */ }'])
+        self._test('Perl', ['my $x = <<EOF;', 'text', 'EOF', 'print "$x\\n" if 1;'])
+
+    def test_long(self):
+        """Segments longer than 32767 characters don't overflow
+        """
+        self._test('C', ['/* ' + 'x' * 100000 + ' */', 'x' * 40000 + ';'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+
+import glob
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntaxtest import PHP_LINES, highlight, topLevelPath  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager, Syntax
+import qutepart.syntax.loader
+
+
+xmlDirPath = os.path.join(topLevelPath, 'qutepart', 'syntax', 'data', 'xml')
+
+
+class SyntaxCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self._oldCacheDirectory = qutepart.syntax.loader.cacheDirectory
+        self._tmpDir = tempfile.mkdtemp()
+        qutepart.syntax.loader.cacheDirectory = os.path.join(self._tmpDir, 'cache')
+
+    def tearDown(self):
+        qutepart.syntax.loader.cacheDirectory = self._oldCacheDirectory
+        shutil.rmtree(self._tmpDir)
+
+    def _load(self, filePath):
+        """Load syntax and return (cache hits, cache misses) done
+        """
+        hits, misses = qutepart.syntax.loader.syntaxCacheInfo()
+        qutepart.syntax.loader.loadSyntax(Syntax(None), filePath)
+        newHits, newMisses = qutepart.syntax.loader.syntaxCacheInfo()
+        return newHits - hits, newMisses - misses
+
+    def test_same_as_xml(self):
+        """Syntax, loaded from the cache, highlights text the same way as loaded from XML.
+        PHP includes other syntaxes, therefore both cached and not cached dispatch tables are checked
+        """
+        xmlSyntax = SyntaxManager().getSyntax(languageName='PHP/PHP')
+        cachedSyntax = SyntaxManager().getSyntax(languageName='PHP/PHP')
+        self.assertGreater(qutepart.syntax.loader.syntaxCacheInfo()[0], 0)
+
+        self.assertEqual(highlight(xmlSyntax, PHP_LINES), highlight(cachedSyntax, PHP_LINES))
+
+        for name, context in xmlSyntax.parser.contexts.items():
+            cachedContext = cachedSyntax.parser.contexts[name]
+            self.assertEqual(context.dispatchTable, cachedContext.dispatchTable)
+            self.assertEqual(len(context.flatRules), len(cachedContext.flatRules))
+            self.assertEqual(context.attribute, cachedContext.attribute)
+
+    def test_invalidated_when_xml_changed(self):
+        xmlFilePath = os.path.join(self._tmpDir, 'ini.xml')
+        shutil.copy(os.path.join(xmlDirPath, 'ini.xml'), xmlFilePath)
+
+        self.assertEqual(self._load(xmlFilePath), (0, 1))
+        self.assertEqual(self._load(xmlFilePath), (1, 0))
+
+        with open(xmlFilePath, 'a') as xmlFile:
+            xmlFile.write('<!-- modified -->\n')
+        self.assertEqual(self._load(xmlFilePath), (0, 1))
+        self.assertEqual(self._load(xmlFilePath), (1, 0))
+
+    def test_broken_cache_file(self):
+        xmlFilePath = os.path.join(xmlDirPath, 'ini.xml')
+        self._load(xmlFilePath)
+
+        for cacheFilePath in glob.glob(os.path.join(qutepart.syntax.loader.cacheDirectory, '*', '*')):
+            with open(cacheFilePath, 'wb') as cacheFile:
+                cacheFile.write(b'garbage')
+
+        self.assertEqual(self._load(xmlFilePath), (0, 1))
+        self.assertEqual(self._load(xmlFilePath), (1, 0))
+
+    def test_old_versions_removed(self):
+        """Subdirectories of other qutepart and cache format versions are removed, when the cache is written
+        """
+        cacheDirectory = qutepart.syntax.loader.cacheDirectory
+        versionPrefix = qutepart.syntax.loader._cacheVersionPrefix()
+        oldDirs = ['0.1.0-2-py3.7', versionPrefix + '0-py3.7']
+        keptDirs = [versionPrefix + '-py2.7', 'other']
+        for name in oldDirs + keptDirs:
+            os.makedirs(os.path.join(cacheDirectory, name))
+
+        xmlFilePath = os.path.join(xmlDirPath, 'ini.xml')
+        self._load(xmlFilePath)
+        currentDir = os.path.basename(os.path.dirname(qutepart.syntax.loader._cacheFilePath(xmlFilePath)))
+        self.assertEqual(sorted(os.listdir(cacheDirectory)), sorted(keptDirs + [currentDir]))
+
+    def test_disabled(self):
+        qutepart.syntax.loader.cacheDirectory = None
+        xmlFilePath = os.path.join(xmlDirPath, 'ini.xml')
+        self.assertEqual(self._load(xmlFilePath), (0, 0))
+        self.assertEqual(self._load(xmlFilePath), (0, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
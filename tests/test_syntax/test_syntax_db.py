@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+
+import os.path
+import subprocess
+import unittest
+import sys
+
+
+topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
+dataPath = os.path.join(topLevelPath, 'qutepart', 'syntax', 'data')
+
+
+class SyntaxDbTestCase(unittest.TestCase):
+    def test_up_to_date(self):
+        """syntax_db.json matches headers of the XML definitions
+        """
+        process = subprocess.run([sys.executable, os.path.join(dataPath, 'regenerate-definitions-db.py'),
+                                  '--check', '--full', '--jobs', '1'],
+                                 stdout=subprocess.PIPE, universal_newlines=True)
+        self.assertEqual(process.returncode, 0, process.stdout)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+
+import fnmatch
+import json
+import os.path
+import re
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from syntaxtest import topLevelPath  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager
+
+
+class SyntaxDetectionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.manager = SyntaxManager()
+        with open(os.path.join(topLevelPath, 'qutepart', 'syntax', 'data', 'syntax_db.json'),
+                  encoding='utf-8') as syntaxDbFile:
+            self.syntaxDb = json.load(syntaxDbFile)
+
+    def _linearScan(self, regExps, name):
+        """Apply patterns one by one, as it was implemented before the index
+        """
+        for regExp, xmlFileName in regExps:
+            if regExp.match(name):
+                return xmlFileName
+        return None
+
+    def test_detect_many(self):
+        self.assertEqual(self.manager.detectMany(['/home/user/main.c',
+                                                  'setup.py',
+                                                  'src/Makefile',
+                                                  'unknown.extension']),
+                         ['C', 'Python', 'Makefile', None])
+
+    def test_same_as_linear_scan(self):
+        """For every pattern make names, which match it and other patterns.
+        The first pattern in the database order shall win
+        """
+        globToXmlFileName = self.syntaxDb['extensionToXmlFileName']
+        xmlFileNameToSyntaxName = {xmlFileName: syntaxName \
+                                        for syntaxName, xmlFileName in self.syntaxDb['syntaxNameToXmlFileName'].items()}
+        names = ['', '.', 'Makefile.am', 'CMakeLists.txt', 'a.tar.gz', 'foo.patch', 'usr.local.lib.x']
+        for glob in globToXmlFileName:
+            name = glob.replace('*', 'xx').replace('?', 'q')
+            names += [name, glob.replace('*', ''), 'a' + glob.replace('*', '.b'), name.upper(), name + '~']
+        names = [name for name in names if '/' not in name]
+
+        regExps = [(re.compile(fnmatch.translate(glob)), xmlFileName) \
+                        for glob, xmlFileName in globToXmlFileName.items()]
+        results = self.manager.detectMany(names)
+        for name, result in zip(names, results):
+            xmlFileName = self._linearScan(regExps, name)
+            expected = xmlFileNameToSyntaxName[xmlFileName] if xmlFileName is not None else None
+            self.assertEqual(result, expected, name)
+
+    def test_db_loaded_when_used(self):
+        manager = SyntaxManager()
+        self.assertFalse(manager._syntaxDbLoaded)
+        manager.detectMany(['main.c'])
+        self.assertTrue(manager._syntaxDbLoaded)
+
+    def test_get_syntax_by_file_name(self):
+        self.assertEqual(self.manager.getSyntax(sourceFilePath='/tmp/file.feh').name, 'ferite')
+        self.assertEqual(self.manager.getSyntax(sourceFilePath='/tmp/GNUmakefile.in').name, 'Makefile')
+        self.assertIsNone(self.manager.getSyntax(sourceFilePath='/tmp/file.unknown'))
+
+    def test_get_syntax_by_first_line(self):
+        self.assertEqual(self.manager.getSyntax(firstLine='<?php hello() ?>').name, 'PHP (HTML)')
+        self.assertEqual(self.manager.getSyntax(firstLine='#!/usr/bin/env python3').name, 'Python')
+        self.assertEqual(self.manager.getSyntax(firstLine='<?xml version="1.0"?>').name, 'XML')
+        self.assertIsNone(self.manager.getSyntax(firstLine='hello'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+
+import os.path
+import unittest
+import sys
+
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
+
+
+from qutepart.syntax import SyntaxManager
+
+
+class TextTypeMapTestCase(unittest.TestCase):
+    def setUp(self):
+        self.syntax = SyntaxManager().getSyntax(None, languageName='C')
+
+    def _textTypes(self, text, contextStack=None):
+        lineData, segments = self.syntax.highlightBlock(text, contextStack)
+        return ''.join(self.syntax._getTextType(lineData, column) for column in range(len(text) + 2))
+
+    def test_types(self):
+        self.assertEqual(self._textTypes('x = 1; // abc'),
+                         '       cccccc  ')
+        self.assertEqual(self._textTypes('a /* b */ "s" // c'),
+                         '  ccccccc sss cccc  ')
+
+    def test_shared(self):
+        """Lines of single text type share text type maps
+        """
+        (contextStack, codeMap), segments = self.syntax.highlightBlock('int x = 1;', None)
+        (contextStack, otherCodeMap), segments = self.syntax.highlightBlock('return;', None)
+        self.assertEqual(codeMap, ())
+        self.assertIs(codeMap, otherCodeMap)
+
+        (contextStack, commentMap), segments = self.syntax.highlightBlock('// abc', None)
+        (contextStack, otherCommentMap), segments = self.syntax.highlightBlock('// longer comment', None)
+        self.assertIs(commentMap, otherCommentMap)  # lines of different length share the map
+        self.assertEqual(self.syntax._getTextType((None, commentMap), 5), 'c')
+        self.assertEqual(self.syntax._getTextType((None, commentMap), 16), 'c')
+
+        lineData, segments = self.syntax.highlightBlock('/* a */ x', None)  # trailing code is not a comment
+        self.assertEqual(self.syntax._getTextType(lineData, 8), ' ')
+
+
+if __name__ == '__main__':
+    unittest.main()
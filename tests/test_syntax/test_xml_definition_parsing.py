@@ -5,13 +5,12 @@ import unittest
 import sys
 
 
-topLevelPath = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..'))
-sys.path.insert(0, topLevelPath)
-sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.4/'))
-sys.path.insert(0, os.path.join(topLevelPath, 'build/lib.linux-x86_64-3.5/'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import syntaxtest  # adds qutepart to sys.path and disables the syntax cache
 
 
 from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
 
 
 class XmlParsingTestCase(unittest.TestCase):
@@ -24,6 +23,30 @@ class XmlParsingTestCase(unittest.TestCase):
             if xmlFileName.endswith('.xml'):
                 syntax = SyntaxManager().getSyntax(None, xmlFileName = xmlFileName)
 
+    def test_include_rules_flattened(self):
+        """IncludeRules are expanded in the flat rule lists, rules order is preserved
+        """
+        manager = SyntaxManager()
+        syntax = manager.getSyntax(None, languageName = 'HTML')
+        includeRulesClass = qutepart.syntax.loader._parserModule.IncludeRules
+        for context in syntax.parser.contexts.values():
+            for rule in context.flatRules:
+                self.assertNotIsInstance(rule, includeRulesClass)
+
+        context = syntax.parser.contexts['CSS content']
+        cssContext = manager.getSyntax(None, languageName = 'CSS').parser.defaultContext
+        self.assertEqual(context.flatRules, context.rules[:1] + cssContext.flatRules)
+
+    def test_include_attrib(self):
+        """includeAttrib="true" replaces format of the including context
+        """
+        manager = SyntaxManager()
+        syntax = manager.getSyntax(None, languageName = 'HTML')
+        cssContext = manager.getSyntax(None, languageName = 'CSS').parser.defaultContext
+        self.assertEqual(syntax.parser.contexts['CSS content'].attribute, cssContext.attribute)
+        self.assertEqual(syntax.parser.contexts['CSS content'].format, cssContext.format)
+        self.assertNotEqual(syntax.parser.contexts['JS'].attribute, cssContext.attribute)
+
 
 if __name__ == '__main__':
     unittest.main()
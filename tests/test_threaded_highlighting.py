@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import base
+
+from PyQt5.QtWidgets import QApplication
+
+from qutepart import Qutepart
+from qutepart.syntaxhlighter import SyntaxHighlighter
+
+
+class Test(unittest.TestCase):
+    """Text is parsed in the background thread
+    """
+    app = base.papp  # app crashes, if created more than once
+
+    def setUp(self):
+        self.qpart = Qutepart()
+        self.qpart.threadedHighlighting = True
+        self._savedValues = (SyntaxHighlighter._THREAD_CHUNK_SIZE,
+                             SyntaxHighlighter._LONG_LINE_PART_LENGTH)
+        SyntaxHighlighter._THREAD_CHUNK_SIZE = 100
+        SyntaxHighlighter._LONG_LINE_PART_LENGTH = 1000
+
+    def tearDown(self):
+        (SyntaxHighlighter._THREAD_CHUNK_SIZE,
+         SyntaxHighlighter._LONG_LINE_PART_LENGTH) = self._savedValues
+        self.qpart.terminate()
+
+    def _waitHighlightingFinished(self):
+        while self.qpart.isHighlightingInProgress():
+            QApplication.instance().processEvents()
+
+    def test_highlight(self):
+        self.qpart.lines = ['x = 1  # comment'] * 10000 + \
+                           ['s = """', 'string', '"""'] + \
+                           ['y = 2  # comment'] * 10000
+        self.qpart.detectSyntax(language='Python')
+        self._waitHighlightingFinished()
+
+        self.assertTrue(self.qpart.isCode(0, 0))
+        self.assertTrue(self.qpart.isComment(5000, 9))
+        self.assertFalse(self.qpart.isCode(10001, 0))
+        self.assertTrue(self.qpart.isCode(20002, 0))
+        self.assertTrue(self.qpart.isComment(20002, 9))
+
+    def test_long_line(self):
+        longLine = 'x = [' + '1, "s", ' * 5000 + '0]  """ string'
+        self.qpart.lines = ['y = 1'] * 10000 + [longLine, 'string """', 'y = 1']
+        self.qpart.detectSyntax(language='Python')
+        self._waitHighlightingFinished()
+
+        self.assertFalse(self.qpart.isCode(10000, longLine.index('"s"') + 1))
+        self.assertTrue(self.qpart.isCode(10000, longLine.index('0]')))
+        self.assertFalse(self.qpart.isCode(10001, 0))
+        self.assertTrue(self.qpart.isCode(10002, 0))
+
+    def test_edit_while_parsing(self):
+        self.qpart.lines = ['x = 1  # comment'] * 20000
+        self.qpart.detectSyntax(language='Python')
+        for i in range(3):
+            QApplication.instance().processEvents()
+
+        self.qpart.lines[1] = 's = """'
+        self._waitHighlightingFinished()
+        self.assertTrue(self.qpart.isCode(0, 0))
+        self.assertFalse(self.qpart.isCode(19999, 0))
+
+        self.qpart.lines[1] = 's = 1'
+        self._waitHighlightingFinished()
+        self.assertTrue(self.qpart.isComment(19999, 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
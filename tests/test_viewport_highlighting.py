@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+import unittest
+
+import base
+
+from PyQt5.QtWidgets import QApplication
+
+from qutepart import Qutepart
+from qutepart.syntaxhlighter import SyntaxHighlighter
+
+
+class Test(unittest.TestCase):
+    """Visible lines are highlighted before parsing reaches them
+    """
+    app = base.papp  # app crashes, if created more than once
+
+    LINE_COUNT = 50000
+
+    def setUp(self):
+        self.qpart = Qutepart()
+        self.qpart.resize(800, 600)
+        self.qpart.show()
+        # parsing of the file requires many timer iterations
+        self._savedValues = (SyntaxHighlighter._MAX_PARSING_TIME_BIG_CHANGE_SEC,
+                             SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC)
+        SyntaxHighlighter._MAX_PARSING_TIME_BIG_CHANGE_SEC = 0.001
+        SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC = 0.001
+
+    def tearDown(self):
+        (SyntaxHighlighter._MAX_PARSING_TIME_BIG_CHANGE_SEC,
+         SyntaxHighlighter._MAX_PARSING_TIME_SMALL_CHANGE_SEC) = self._savedValues
+        self.qpart.terminate()
+
+    def _waitHighlightingFinished(self):
+        while self.qpart.isHighlightingInProgress():
+            QApplication.instance().processEvents()
+
+    def _scrollToBottom(self):
+        lastLine = len(self.qpart.lines) - 1
+        self.qpart.cursorPosition = (lastLine, 0)
+        self.qpart.ensureCursorVisible()
+
+        # a few timer iterations
+        for i in range(10):
+            QApplication.instance().processEvents()
+
+        return lastLine
+
+    def test_last_line_highlighted_first(self):
+        self.qpart.lines = ['x = 1  # comment'] * self.LINE_COUNT
+        self.qpart.detectSyntax(language='Python')
+        lastLine = self._scrollToBottom()
+
+        self.assertTrue(self.qpart.isHighlightingInProgress())
+        self.assertTrue(self.qpart.isComment(lastLine, 9))
+        self.assertFalse(self.qpart.isComment(lastLine // 2, 9))  # not parsed yet
+
+        self._waitHighlightingFinished()
+        self.assertTrue(self.qpart.isComment(lastLine // 2, 9))
+        self.assertTrue(self.qpart.isComment(lastLine, 9))
+
+    def test_guess_corrected(self):
+        self.qpart.lines = ['x = 1', 's = """'] + ['x = 1  # comment'] * self.LINE_COUNT
+        self.qpart.detectSyntax(language='Python')
+        lastLine = self._scrollToBottom()
+
+        self.assertTrue(self.qpart.isHighlightingInProgress())
+        self.assertTrue(self.qpart.isComment(lastLine, 9))  # guess
+
+        self._waitHighlightingFinished()
+        self.assertFalse(self.qpart.isComment(lastLine, 9))  # inside a string
+
+    def test_disabled(self):
+        self.qpart.viewportFirstHighlighting = False
+        self.qpart.lines = ['x = 1  # comment'] * self.LINE_COUNT
+        self.qpart.detectSyntax(language='Python')
+        lastLine = self._scrollToBottom()
+
+        self.assertTrue(self.qpart.isHighlightingInProgress())
+        self.assertFalse(self.qpart.isComment(lastLine, 9))
+
+        self._waitHighlightingFinished()
+        self.assertTrue(self.qpart.isComment(lastLine, 9))
+
+
+if __name__ == '__main__':
+    unittest.main()
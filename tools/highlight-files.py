@@ -0,0 +1,268 @@
+#!/usr/bin/env python3
+"""Highlight many files using all CPU cores and print files/sec and MB/sec statistics.
+Every worker process has own SyntaxManager and keeps loaded syntaxes
+
+Output formats:
+    html    <pre> fragment with inline styles
+    ansi    text with 24-bit color escape sequences
+    json    JSON object per file {"path", "language", "styles", "lines"}, where
+            lines are lists of [length, styleIndex] tokens, styleIndex is None for not highlighted text
+
+Without --output-dir results are printed to stdout in order of files.
+With --output-dir every result is saved to a file, directory structure is preserved.
+Binary files and hidden directories are skipped
+"""
+
+import argparse
+import concurrent.futures
+import html
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, '.')
+sys.path.insert(0, '..')
+
+from qutepart.syntax import SyntaxManager, TextFormat, textFormat, unpackSegments
+
+
+_FILE_EXTENSIONS = {'html': '.html', 'ansi': '.ansi', 'json': '.json'}
+
+_DEFAULT_FORMAT = TextFormat()
+
+_manager = None  # per worker process
+_textFormats = {}  # styleIndex: TextFormat. Formats are used as dictionary keys, therefore made once
+
+
+def _initWorker():
+    global _manager
+    _manager = SyntaxManager()
+
+
+def _htmlStyle(format):
+    style = []
+    if format.color != _DEFAULT_FORMAT.color:
+        style.append('color:' + format.color)
+    if format.background != _DEFAULT_FORMAT.background:
+        style.append('background:' + format.background)
+    if format.bold:
+        style.append('font-weight:bold')
+    if format.italic:
+        style.append('font-style:italic')
+    decorations = [name for name, enabled in (('underline', format.underline),
+                                              ('line-through', format.strikeOut))
+                   if enabled]
+    if decorations:
+        style.append('text-decoration:' + ' '.join(decorations))
+    return ';'.join(style)
+
+
+def _rgb(color):
+    """#rrggbb or #rgb to (r, g, b)
+    """
+    color = color.lstrip('#')
+    if len(color) == 3:
+        color = ''.join(c * 2 for c in color)
+    return tuple(int(color[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _ansiStyle(format):
+    codes = []
+    if format.color != _DEFAULT_FORMAT.color:
+        codes.append('38;2;%d;%d;%d' % _rgb(format.color))
+    if format.background != _DEFAULT_FORMAT.background:
+        codes.append('48;2;%d;%d;%d' % _rgb(format.background))
+    if format.bold:
+        codes.append('1')
+    if format.italic:
+        codes.append('3')
+    if format.underline:
+        codes.append('4')
+    if format.strikeOut:
+        codes.append('9')
+    return '\x1b[%sm' % ';'.join(codes) if codes else ''
+
+
+def _jsonStyle(format):
+    return {'color': format.color,
+            'background': format.background,
+            'bold': format.bold,
+            'italic': format.italic,
+            'underline': format.underline,
+            'strikeOut': format.strikeOut,
+            'textType': format.textType}
+
+
+def _textFormat(styleIndex):
+    if styleIndex not in _textFormats:
+        _textFormats[styleIndex] = textFormat(styleIndex)
+    return _textFormats[styleIndex]
+
+
+def _highlightedLines(syntax, lines):
+    """Generator of lists of (text, format) for every line
+    """
+    if syntax is None:
+        for line in lines:
+            yield [(line, None)]
+        return
+
+    for line, (lineData, highlightedSegments) in zip(lines, syntax.highlightLines(lines)):
+        tokens = []
+        pos = 0
+        for length, styleIndex in unpackSegments(highlightedSegments):
+            tokens.append((line[pos:pos + length], _textFormat(styleIndex)))
+            pos += length
+        yield tokens
+
+
+def _renderHtml(path, syntax, lines):
+    styles = {}
+    result = ['<pre class="qutepart" data-language="%s">' % html.escape(syntax.name if syntax else '')]
+    for tokens in _highlightedLines(syntax, lines):
+        for text, format in tokens:
+            if format is not None and format not in styles:
+                styles[format] = _htmlStyle(format)
+
+            if format is None or not styles[format]:
+                result.append(html.escape(text, quote=False))
+            else:
+                result.append('<span style="%s">%s</span>' % (styles[format], html.escape(text, quote=False)))
+        result.append('\n')
+    result.append('</pre>\n')
+    return ''.join(result)
+
+
+def _renderAnsi(path, syntax, lines):
+    styles = {}
+    result = []
+    for tokens in _highlightedLines(syntax, lines):
+        for text, format in tokens:
+            if format is not None and format not in styles:
+                styles[format] = _ansiStyle(format)
+
+            if format is None or not styles[format]:
+                result.append(text)
+            else:
+                result.append(styles[format] + text + '\x1b[0m')
+        result.append('\n')
+    return ''.join(result)
+
+
+def _renderJson(path, syntax, lines):
+    styleIndexes = {}  # format: index
+    styleIndexesByValue = {}  # different formats might have equal attributes
+    styles = []
+    jsonLines = []
+    for tokens in _highlightedLines(syntax, lines):
+        jsonTokens = []
+        for text, format in tokens:
+            if format is None:
+                styleIndex = None
+            else:
+                if format not in styleIndexes:
+                    style = _jsonStyle(format)
+                    key = tuple(sorted(style.items()))
+                    if key not in styleIndexesByValue:
+                        styleIndexesByValue[key] = len(styles)
+                        styles.append(style)
+                    styleIndexes[format] = styleIndexesByValue[key]
+                styleIndex = styleIndexes[format]
+            if jsonTokens and jsonTokens[-1][1] == styleIndex:
+                jsonTokens[-1][0] += len(text)
+            else:
+                jsonTokens.append([len(text), styleIndex])
+        jsonLines.append(jsonTokens)
+
+    return json.dumps({'path': path,
+                       'language': syntax.name if syntax else None,
+                       'styles': styles,
+                       'lines': jsonLines}) + '\n'
+
+
+_RENDERERS = {'html': _renderHtml, 'ansi': _renderAnsi, 'json': _renderJson}
+
+
+def _highlightFile(args):
+    """Highlight a file in a worker process.
+    Return (size, result) where result is None, if saved to the output directory.
+    Return None, if the file is binary
+    """
+    path, outputPath, outputFormat = args
+    with open(path, 'rb') as file_:
+        data = file_.read()
+
+    if b'\0' in data[:8192]:
+        return None
+
+    text = data.decode('utf-8', errors='replace')
+    lines = text.splitlines()
+    firstLine = lines[0] if lines else ''
+    syntax = _manager.getSyntax(sourceFilePath=path, firstLine=firstLine)
+
+    result = _RENDERERS[outputFormat](path, syntax, lines)
+
+    if outputPath is None:
+        return len(data), result
+    else:
+        os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+        with open(outputPath, 'w', encoding='utf-8') as file_:
+            file_.write(result)
+        return len(data), None
+
+
+def _listFiles(paths):
+    """Generator of (path, pathRelativeToArgument)
+    """
+    for path in paths:
+        if os.path.isdir(path):
+            for dirPath, dirNames, fileNames in os.walk(path):
+                dirNames[:] = sorted(name for name in dirNames if not name.startswith('.'))
+                for fileName in sorted(fileNames):
+                    filePath = os.path.join(dirPath, fileName)
+                    yield filePath, os.path.relpath(filePath, path)
+        else:
+            yield path, os.path.basename(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Highlight files using all CPU cores')
+    parser.add_argument('paths', nargs='+', metavar='PATH', help='file or directory')
+    parser.add_argument('-f', '--format', choices=sorted(_RENDERERS), default='html', help='output format')
+    parser.add_argument('-o', '--output-dir', help='save results to the directory instead of printing')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='count of worker processes')
+    args = parser.parse_args()
+
+    tasks = []
+    for path, relativePath in _listFiles(args.paths):
+        if args.output_dir is not None:
+            outputPath = os.path.join(args.output_dir, relativePath + _FILE_EXTENSIONS[args.format])
+        else:
+            outputPath = None
+        tasks.append((path, outputPath, args.format))
+
+    startTime = time.perf_counter()
+    totalSize = 0
+    skippedCount = 0
+    with concurrent.futures.ProcessPoolExecutor(args.jobs, initializer=_initWorker) as executor:
+        chunkSize = max(1, min(64, len(tasks) // (args.jobs * 4)))
+        for fileResult in executor.map(_highlightFile, tasks, chunksize=chunkSize):
+            if fileResult is None:
+                skippedCount += 1
+                continue
+
+            size, result = fileResult
+            totalSize += size
+            if result is not None:
+                sys.stdout.write(result)
+    elapsed = time.perf_counter() - startTime
+
+    filesCount = len(tasks) - skippedCount
+    megabytes = totalSize / (1024 * 1024)
+    sys.stderr.write('%d files (%d binary skipped), %.1f MB in %.2f s: %.1f files/sec, %.2f MB/sec\n' %
+                     (filesCount, skippedCount, megabytes, elapsed, filesCount / elapsed, megabytes / elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,50 @@
 #!/usr/bin/env python3
+"""Show parsed syntax definition.
+With --profile highlight the text file and show the most expensive rules of the syntax
 
+Usage: show-syntax.py SYNTAX_FILE_NAME [--profile TEXT_FILE] [--top N]
+"""
+
+import argparse
 import sys
 sys.path.insert(0, '.')
 sys.path.insert(0, '..')
 
 from qutepart.syntax import SyntaxManager
+import qutepart.syntax.loader
+
+
+def showProfile(syntax, textFilePath, top):
+    with open(textFilePath, encoding='utf-8', errors='replace') as textFile:
+        lines = textFile.read().splitlines()
+
+    try:
+        for lineData, segments in syntax.highlightLines(lines):
+            pass
+    finally:
+        qutepart.syntax.loader.setRuleProfilingEnabled(False)
+
+    profile = syntax.ruleProfile()
+    totalTime = sum(item.time for item in profile)
+    print('%d lines, %d rules tried, %.1f ms in rules' % (len(lines), len(profile), totalTime * 1000))
+    print('%9s %9s %9s %6s  %-30s %s' % ('attempts', 'successes', 'ms', '%', 'context', 'rule'))
+    for item in profile[:top]:
+        print('%9d %9d %9.2f %6.1f  %-30s %s' % (item.attempts, item.successes, item.time * 1000,
+                                               item.time * 100 / totalTime if totalTime else 0,
+                                               item.contextName, item.description))
+
 
 if __name__ == '__main__':
-    if len(sys.argv) != 2:
-        print('Usage:\n\t%s SYNTAX_FILE_NAME' % sys.argv[0])
-    else:
-        syntax = SyntaxManager().getSyntax(xmlFileName=sys.argv[1])
+    parser = argparse.ArgumentParser(description='Show syntax definition or profile of its rules')
+    parser.add_argument('syntaxFileName', metavar='SYNTAX_FILE_NAME', help='XML file name, i.e. python.xml')
+    parser.add_argument('--profile', metavar='TEXT_FILE', help='highlight the file and show rule statistics')
+    parser.add_argument('--top', type=int, default=30, help='count of rules to show with --profile')
+    args = parser.parse_args()
+
+    if args.profile is not None:
+        qutepart.syntax.loader.setRuleProfilingEnabled(True)  # before loading, so that rules are described
+    syntax = SyntaxManager().getSyntax(xmlFileName=args.syntaxFileName)
+    if args.profile is None:
         print(str(syntax))
+    else:
+        showProfile(syntax, args.profile, args.top)